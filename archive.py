@@ -0,0 +1,188 @@
+import os
+import re
+import json
+import zlib
+import struct
+import tarfile
+import zipfile
+
+# Images read in place from uncompressed tar or zip archives. A path that
+# runs through an archive, e.g. /scratch/race_per_7000.tar/Asian/x/x.jpg,
+# names the member Asian/x/x.jpg of /scratch/race_per_7000.tar. The offset
+# of every member is indexed once, cached next to the archive, and each
+# read is a single pread: nothing is extracted and no per-image file is
+# ever created or stat-ed.
+
+INDEX_VERSION = 1
+
+_ARCHIVE_PATH = re.compile(r'^(.*?\.(?:tar|zip))(?:/+(.*))?$')
+_archives = {}
+_is_archive = {}
+
+
+def split_archive_path(path):
+    # (archive path, member path) for a path inside an archive, the member
+    # is '' for the archive itself. None for any other path.
+    if '.tar' not in path and '.zip' not in path:
+        return None
+    match = _ARCHIVE_PATH.match(path)
+    if not match:
+        return None
+    archive_path = match.group(1)
+    if archive_path not in _is_archive:
+        _is_archive[archive_path] = os.path.isfile(archive_path)
+    if not _is_archive[archive_path]:
+        return None
+    member = match.group(2)
+    return archive_path, os.path.normpath(member) if member else ''
+
+
+def open_archive(archive_path):
+    if archive_path not in _archives:
+        _archives[archive_path] = Archive(archive_path)
+    return _archives[archive_path]
+
+
+def read_archive_file(path):
+    # the content of a file inside an archive, None for any other path
+    location = split_archive_path(path)
+    if location is None:
+        return None
+    archive_path, member = location
+    return open_archive(archive_path).read(member)
+
+
+def index_path(archive_path):
+    return archive_path + '.index.json'
+
+
+class Archive(object):
+    # The members are {name: (data offset, stored size, compression, size)}.
+    # Reads go through os.pread on one descriptor, which keeps no file
+    # position, so the forked dataloader workers can share it.
+
+    def __init__(self, path):
+        self.path = path
+        self.members = self._load_index()
+        self.fd = None
+        self.tree = None
+
+    def read(self, member):
+        try:
+            offset, stored_size, compression, size = self.members[member]
+        except KeyError:
+            raise FileNotFoundError(
+                'no {} in archive {}'.format(member, self.path))
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_RDONLY)
+        data = os.pread(self.fd, stored_size, offset)
+        if compression == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(data, -15)
+        elif compression != zipfile.ZIP_STORED:
+            with zipfile.ZipFile(self.path) as archive:
+                data = archive.read(member)
+        return data
+
+    def isdir(self, member):
+        return member.rstrip('/') in self._tree()
+
+    def listdir(self, member=''):
+        # ([sub directories], [(file, size)]) of a directory
+        directories, files = self._tree().get(member.rstrip('/'), ({}, {}))
+        return sorted(directories), sorted(files.items())
+
+    def _tree(self):
+        if self.tree is None:
+            self.tree = {'': ({}, {})}
+            for name, (_, _, _, size) in self.members.items():
+                parent = ''
+                parts = name.split('/')
+                for part in parts[:-1]:
+                    directory = part if not parent else parent + '/' + part
+                    self.tree[parent][0][part] = True
+                    self.tree.setdefault(directory, ({}, {}))
+                    parent = directory
+                self.tree[parent][1][parts[-1]] = size
+        return self.tree
+
+    def _load_index(self):
+        stat = os.stat(self.path)
+        try:
+            with open(index_path(self.path), 'r') as f:
+                index = json.load(f)
+            if index.get('version') == INDEX_VERSION and \
+                    index['size'] == stat.st_size and \
+                    index['mtime'] == stat.st_mtime_ns:
+                return {name: tuple(member)
+                        for name, member in index['members'].items()}
+        except (OSError, ValueError, KeyError):
+            pass
+
+        if zipfile.is_zipfile(self.path):
+            members = self._index_zip()
+        else:
+            members = self._index_tar()
+        self._write_index({
+            'version': INDEX_VERSION,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'members': members
+        })
+        return members
+
+    def _index_tar(self):
+        try:
+            archive = tarfile.open(self.path, 'r:')
+        except tarfile.ReadError:
+            raise RuntimeError(
+                '{} is not an uncompressed tar archive, compressed '
+                'archives can not be read in place'.format(self.path))
+        members = {}
+        with archive:
+            for member in archive:
+                if member.isfile():
+                    members[os.path.normpath(member.name)] = (
+                        member.offset_data, member.size,
+                        zipfile.ZIP_STORED, member.size)
+        return members
+
+    def _index_zip(self):
+        members = {}
+        with open(self.path, 'rb') as f, zipfile.ZipFile(f) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                # the data follows the local header, whose name and extra
+                # field lengths may differ from the central directory's
+                f.seek(info.header_offset + 26)
+                name_length, extra_length = struct.unpack('<HH', f.read(4))
+                members[os.path.normpath(info.filename)] = (
+                    info.header_offset + 30 + name_length + extra_length,
+                    info.compress_size, info.compress_type, info.file_size)
+        return members
+
+    def _write_index(self, index):
+        temp_file = '{}.{}.tmp'.format(index_path(self.path), os.getpid())
+        try:
+            with open(temp_file, 'w') as f:
+                json.dump(index, f)
+            os.replace(temp_file, index_path(self.path))
+        except OSError:
+            # a read-only location still works, it is just indexed per run
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+
+def list_people(images_root):
+    # load_manifest's {person name: {'mtime': ..., 'images': [...]}} for a
+    # race directory inside an archive, the archive index is the cache
+    archive_path, root = split_archive_path(images_root)
+    archive = open_archive(archive_path)
+    people = {}
+    for name in archive.listdir(root)[0]:
+        _, files = archive.listdir(root + '/' + name if root else name)
+        people[name] = {
+            'mtime': 0,
+            'images': [[image, size, 0] for image, size in files]
+        }
+    return people
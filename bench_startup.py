@@ -0,0 +1,89 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.realpath(__file__))
+
+
+def time_command(command, repeat):
+    # wall time of fresh interpreters, the median hides the first run that
+    # warms the page cache
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        subprocess.run(command, cwd=ROOT, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.time() - start)
+    return sorted(timings)[len(timings) // 2]
+
+
+def python_command(code):
+    return [sys.executable, '-c', code]
+
+
+def write_checkpoint(arch, path):
+    code = (
+        'import torch\n'
+        'from models import Resnet18FaceModel, Resnet50FaceModel\n'
+        'model_class = {{"resnet18": Resnet18FaceModel, '
+        '"resnet50": Resnet50FaceModel}}["{}"]\n'
+        'model = model_class(False, pretrained=False)\n'
+        'torch.save({{"state_dict": model.state_dict()}}, "{}")\n'
+    ).format(arch, path)
+    subprocess.run(python_command(code), cwd=ROOT, check=True)
+
+
+def main(args):
+    model_class = {'resnet18': 'Resnet18FaceModel',
+                   'resnet50': 'Resnet50FaceModel'}[args.arch]
+    benchmarks = [
+        ('import torch, torchvision',
+         python_command('import torch, torchvision')),
+        ('import main', python_command('import main')),
+        ('build {} (pretrained=False)'.format(args.arch), python_command(
+            'import models; models.{}(False, pretrained=False)'.format(
+                model_class))),
+    ]
+    if args.pretrained:
+        # needs the ImageNet weights in the torch hub cache or the network
+        benchmarks.append((
+            'build {} (pretrained=True)'.format(args.arch), python_command(
+                'import models; models.{}(False, pretrained=True)'.format(
+                    model_class))))
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        checkpoint = os.path.join(temp_dir, 'checkpoint.pth.tar')
+        write_checkpoint(args.arch, checkpoint)
+        benchmarks.append(('main.py --verify-model', [
+            sys.executable, 'main.py', '--arch', args.arch,
+            '--verify-model', checkpoint,
+            '--verify-images', args.verify_images]))
+
+        for name, command in benchmarks:
+            print('{:<40} {:8.3f}s'.format(
+                name, time_command(command, args.repeat)))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='cold start time of the entry points')
+    parser.add_argument('--arch', type=str, default='resnet50',
+                        help='network arch to use, support resnet18 and '
+                             'resnet50 (default: resnet50)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='runs per measurement, the median is reported '
+                             '(default: 5)')
+    parser.add_argument('--pretrained', action='store_true',
+                        help='also time building the backbone with the '
+                             'ImageNet weights')
+    parser.add_argument('--verify-images', type=str,
+                        default='images/obama_a.png,images/obama_b.png',
+                        help='images passed to --verify-images')
+    main(parser.parse_args())
@@ -0,0 +1,114 @@
+import os
+import queue
+import threading
+
+import torch
+
+
+def snapshot_to_cpu(state):
+    # copy every tensor so the training loop can keep updating the originals
+    # in place while the copy is being serialized
+    if torch.is_tensor(state):
+        state = state.detach()
+        return state.clone() if state.device.type == 'cpu' else state.cpu()
+    if isinstance(state, dict):
+        return type(state)(
+            (key, snapshot_to_cpu(value)) for key, value in state.items())
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot_to_cpu(value) for value in state)
+    return state
+
+
+class CheckpointWriter(object):
+    # Serializes checkpoints on a background thread. Each file is written
+    # to a temporary name, synced and then renamed, so a job killed
+    # mid-write never leaves a truncated checkpoint under the final name.
+    # keep_last removes all but the newest N checkpoints, keep_best spares
+    # the one with the lowest metric from that cleanup. Files saved with
+    # managed=False are left out of the retention bookkeeping. Once closed
+    # the writer's thread is gone and saving raises.
+
+    def __init__(self, keep_last=None, keep_best=False):
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.saved = []
+        self.best = None
+        self.error = None
+        self.closed = False
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def save(self, state, path, metric=None, managed=True):
+        if self.closed:
+            raise RuntimeError("checkpoint writer is closed")
+        self._raise_error()
+        self.queue.put((snapshot_to_cpu(state), path, metric, managed))
+
+    def track(self, path, metric=None):
+        # a checkpoint already on disk, e.g. of the run being resumed, kept
+        # or removed like the ones saved here
+        if self.closed:
+            raise RuntimeError("checkpoint writer is closed")
+        self.wait()
+        self._retain(path, metric)
+
+    def wait(self):
+        self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.join()
+        self.queue.put(None)
+        self.thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError(
+                "writing checkpoint failed: {}".format(error)) from error
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            except Exception as error:
+                self.error = error
+            finally:
+                self.queue.task_done()
+
+    def _write(self, state, path, metric, managed):
+        temp_path = '{}.tmp'.format(path)
+        with open(temp_path, 'wb') as f:
+            torch.save(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        if managed:
+            self._retain(path, metric)
+
+    def _retain(self, path, metric):
+        if path in self.saved:
+            self.saved.remove(path)
+        self.saved.append(path)
+
+        if self.keep_best and metric is not None and (
+                self.best is None or metric < self.best[0]):
+            self.best = (metric, path)
+
+        if not self.keep_last:
+            return
+        best_path = self.best[1] if self.best is not None else None
+        for old_path in self.saved[:-self.keep_last]:
+            if old_path == best_path:
+                continue
+            self.saved.remove(old_path)
+            if os.path.isfile(old_path):
+                os.remove(old_path)
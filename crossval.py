@@ -0,0 +1,134 @@
+import os
+import copy
+import json
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import main
+
+# Cross validation over the folds of dataset.fold: every fold is trained
+# by main.train in its own process and its model evaluated per race. The
+# images are decoded once into a shard (and with --frozen_backbone their
+# backbone features cached) before the folds start, the fold processes
+# only map those files read-only, so the page cache holds one copy.
+
+
+def fold_args(args, fold):
+    args = copy.copy(args)
+    args.fold = fold
+    args.save_file_name = '{}_fold{}'.format(args.save_file_name, fold)
+    if args.events:
+        root, extension = os.path.splitext(args.events)
+        args.events = '{}_fold{}{}'.format(root, fold, extension)
+    return args
+
+
+def init_worker(threads):
+    import torch
+    torch.set_num_threads(threads)
+
+
+def run_fold(args):
+    # trains one fold, its printed output goes to <save_file_name>.out in
+    # the log directory, where grap.py finds it next to the events
+    log_file = os.path.join(
+        main.get_log_dir(args), '{}.out'.format(args.save_file_name))
+    with open(log_file, 'w', buffering=1) as f, \
+            contextlib.redirect_stdout(f):
+        model = main.train(args).eval()
+        model_class = main.get_model_class(args)
+        accuracies = {}
+        for race in main.get_races(args):
+            evaluation = main.prepare_race_evaluation(args, model_class, race)
+            result = main.evaluate_race(args, model, evaluation)
+            accuracies[race] = result['accuracy']
+            print('[{}] Model accuracy is {}'.format(race, result['accuracy']))
+    return args.fold, accuracies
+
+
+def prepare_caches(args):
+    # the shard, and the backbone feature cache, every fold reads
+    model_class = main.get_model_class(args)
+    whole_set, _ = main.load_training_set(args, model_class)
+    if args.frozen_backbone:
+        model = model_class(False).to(main.device)
+        if args.warm_start:
+            main.warm_start(model, args.warm_start)
+        main.cache_backbone_features(args, model, model_class, whole_set)
+
+
+def summarize(fold_accuracies):
+    # {fold: {race: accuracy}} to the mean and std over the folds per race
+    races = {}
+    for fold in sorted(fold_accuracies):
+        for race, accuracy in fold_accuracies[fold].items():
+            races.setdefault(race, []).append(accuracy)
+    return {race: {'mean': float(np.mean(accuracies)),
+                   'std': float(np.std(accuracies)),
+                   'folds': len(accuracies)}
+            for race, accuracies in races.items()}
+
+
+def crossval(args):
+    cpus = os.cpu_count() or 1
+    jobs = args.jobs if args.jobs else min(len(args.folds), cpus)
+    threads = args.threads if args.threads else max(1, cpus // jobs)
+    log_dir = main.get_log_dir(args)
+    if not args.shard:
+        args.shard = os.path.join(
+            log_dir, '{}.shard'.format(args.save_file_name))
+    prepare_caches(args)
+
+    print('running folds {} in {} processes of {} threads'.format(
+        ' '.join(map(str, args.folds)), jobs, threads))
+    fold_accuracies = {}
+    # spawned, the fold processes start their own dataloader workers
+    with ProcessPoolExecutor(
+            jobs, mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker, initargs=(threads,)) as executor:
+        for fold, accuracies in executor.map(
+                run_fold, [fold_args(args, fold) for fold in args.folds]):
+            fold_accuracies[fold] = accuracies
+            print('fold {}: {}'.format(fold, ' - '.join(
+                '{} {:.6f}'.format(race, accuracy)
+                for race, accuracy in accuracies.items())))
+
+    races = summarize(fold_accuracies)
+    for race, summary in races.items():
+        print('[{}] accuracy {:.6f} +- {:.6f} over {} folds'.format(
+            race, summary['mean'], summary['std'], summary['folds']))
+    if len(races) > 1:
+        means = np.array([summary['mean'] for summary in races.values()])
+        print('Bias gap: {:.6f} mean accuracy between best and worst '
+              'race'.format(means.max() - means.min()))
+
+    report_file = args.report if args.report else os.path.join(
+        log_dir, '{}.crossval.json'.format(args.save_file_name))
+    with open(report_file, 'w') as f:
+        json.dump({'folds': fold_accuracies, 'races': races}, f, indent=2)
+    print('Report written to {}'.format(report_file))
+
+
+if __name__ == '__main__':
+    parser = main.get_parser()
+    parser.description = 'k-fold cross validation of main.py train'
+    parser.add_argument('--folds', type=int, nargs='+',
+                        default=list(range(main.NUM_FOLDS)),
+                        choices=range(main.NUM_FOLDS), metavar='K',
+                        help='folds to run (default: all {})'.format(
+                            main.NUM_FOLDS))
+    parser.add_argument('--jobs', type=int,
+                        help='folds trained at the same time (default: one '
+                             'per fold, at most one per CPU)')
+    parser.add_argument('--threads', type=int,
+                        help='torch threads of every fold, besides its '
+                             '--num_workers loader processes (default: the '
+                             'CPUs divided by --jobs)')
+    parser.set_defaults(save_file_name='crossval', race='all')
+    args = parser.parse_args()
+    if not args.pairs:
+        parser.error('--pairs is needed to evaluate the folds per race')
+    crossval(args)
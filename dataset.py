@@ -1,54 +1,42 @@
 import os
 import random
 import re
-import tarfile
 import sys
 import itertools
 import random
+import json
 from math import ceil, floor
 
 
+import torch
 from torch.utils import data
 import numpy as np
 
-from utils import image_loader, download
+from utils import image_loader
+from manifest import load_manifest, manifest_path, select_people
+from archive import split_archive_path
 
 
-def create_datasets(dataroot, train_val_split=0.9):
-    if not os.path.isdir(dataroot):
-        os.mkdir(dataroot)
-
-    dataroot_files = os.listdir(dataroot)
-    data_tarball_file = []
-    data_dir_name = []
-
-    if data_dir_name not in dataroot_files:
-        if data_tarball_file not in dataroot_files:
-            tarball = download(dataroot, DATASET_TARBALL)
-        with tarfile.open(tarball, 'r') as t:
-            t.extractall(dataroot)
-
-
-  
-        
-def create_datasetsR(race, number_of_people, dataroot):
-    if not os.path.isdir(dataroot):
+def create_datasetsR(race, number_of_people, dataroot, seed=None,
+                     refresh=False):
+    # dataroot may also be an archive, or a directory inside one
+    if not os.path.isdir(dataroot) and split_archive_path(dataroot) is None:
         os.mkdir(dataroot)
 
 
     images_root = os.path.join(dataroot, race)
-    names = os.listdir(images_root)
-    if len(names) == 0:
+    people = load_manifest(
+        images_root, manifest_path(dataroot, race), verify=refresh)
+    if len(people) == 0:
         raise RuntimeError('Empty dataset')
 
     whole_set=[]
-    random.shuffle(names)
-    names = names[:number_of_people]
+    names = select_people(people, number_of_people, seed)
     for klass, name in enumerate(names):
           def add_class(image):
-            image_path = os.path.join(images_root, name, image)
+            image_path = os.path.join(images_root, name, image[0])
             return (image_path, klass, name)
-          images_of_person = os.listdir(os.path.join(images_root, name))
+          images_of_person = people[name]['images']
           whole_set += map(
                     add_class,
                     images_of_person)
@@ -76,23 +64,182 @@ class DatasetSplit(data.Dataset):
         return self.dataset[index]  
    
  
+class ResumableSampler(data.Sampler):
+    # Shuffles like a seeded RandomSampler, but the order only depends on
+    # (seed, epoch) and iteration can start at any position, so a resumed
+    # run sees exactly the samples an uninterrupted one would have seen.
+    # Every index comes with its own seed for SeededDataset, which makes
+    # the random augmentation of a sample independent of which worker
+    # loads it and of what was loaded before.
+
+    def __init__(self, data_source, shuffle=True, seed=0, num_replicas=1,
+                 rank=0, pad=True):
+        # with several replicas, e.g. the processes of distributed.py, each
+        # one gets every num_replicas-th position of the same order. With
+        # pad the order wraps around so all of them get as many samples,
+        # without it every sample is seen once and the last replicas may
+        # get one less, e.g. for validation.
+        self.data_size = len(data_source)
+        self.num_replicas = num_replicas
+        self.rank = rank
+        if pad:
+            self.num_samples = -(-self.data_size // num_replicas)
+        else:
+            self.num_samples = len(range(rank, self.data_size, num_replicas))
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+
+    def set_epoch(self, epoch, start=0):
+        # start counts the samples of this replica
+        self.epoch = epoch
+        self.start = min(start, self.num_samples)
+
+    def __len__(self):
+        return self.num_samples - self.start
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed * 1000003 + self.epoch)
+        if self.shuffle:
+            order = torch.randperm(self.data_size, generator=generator)
+        else:
+            order = torch.arange(self.data_size)
+        seeds = torch.randint(
+            2 ** 62, (self.data_size,), generator=generator)
+        for position in range(
+                self.rank + self.start * self.num_replicas,
+                self.num_samples * self.num_replicas, self.num_replicas):
+            position %= self.data_size
+            yield (order[position].item(), seeds[position].item())
+
+
+class SeededDataset(data.Dataset):
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        index, seed = index
+        with torch.random.fork_rng(devices=[]):
+            torch.manual_seed(seed)
+            return self.dataset[index]
+
+
 class Dataset(data.Dataset):
 
-    def __init__(self, datasets, transform=None, target_transform=None):
+    def __init__(self, datasets, transform=None, target_transform=None,
+                 loader=None):
         self.datasets = datasets
         self.num_classes = len(datasets)
         self.transform = transform
         self.target_transform = target_transform
+        self.loader = loader if loader else image_loader
 
     def __len__(self):
         return len(self.datasets)
 
     def __getitem__(self, index):
-        image = image_loader(self.datasets[index][0])
+        image = self.loader(self.datasets[index][0])
         if self.transform:
             image = self.transform(image)
         return (image, self.datasets[index][1], self.datasets[index][2])
-    
+
+
+def pack_shard(datasets, shard_path, image_shape, num_workers=0,
+               selection=None):
+    # decode and resize every image once into a flat uint8 file, images are
+    # stored as (height, width, channel) arrays in the loader's BGR order.
+    # selection, the parameters the images were chosen by, is kept in the
+    # index so a shard of another selection is not reused
+    from imageaug import transform_for_packing
+
+    height, width = image_shape
+    image_size = height * width * 3
+    shard = np.memmap(shard_path, dtype=np.uint8, mode='w+',
+                      shape=(max(len(datasets), 1), height, width, 3))
+
+    loader = data.DataLoader(
+        Dataset(datasets, transform_for_packing(image_shape)),
+        batch_size=None, num_workers=num_workers)
+
+    entries = []
+    for index, (image, klass, name) in enumerate(loader):
+        shard[index] = image.numpy()
+        entries.append((index * image_size, int(klass), name))
+    shard.flush()
+    del shard
+
+    with open(shard_path + '.json', 'w') as f:
+        json.dump({'image_shape': [height, width, 3], 'selection': selection,
+                   'entries': entries}, f)
+
+    return entries
+
+
+def load_shard(shard_path, selection=None):
+    # the entries and image shape, None when there is no shard or it was
+    # packed from another selection
+    try:
+        with open(shard_path + '.json', 'r') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not os.path.isfile(shard_path) or selection is not None and \
+            index.get('selection') != json.loads(json.dumps(selection)):
+        return None
+    entries = [tuple(entry) for entry in index['entries']]
+    return entries, tuple(index['image_shape'])
+
+
+class ShardDataset(data.Dataset):
+
+    def __init__(self, datasets, shard_path, image_shape, transform=None,
+                 target_transform=None):
+        self.datasets = datasets
+        self.shard_path = shard_path
+        self.image_shape = tuple(image_shape)
+        self.image_size = int(np.prod(self.image_shape))
+        self.transform = transform
+        self.target_transform = target_transform
+        # opened lazily so every dataloader worker maps the file itself
+        self.shard = None
+
+    def __len__(self):
+        return len(self.datasets)
+
+    def __getitem__(self, index):
+        if self.shard is None:
+            self.shard = np.memmap(self.shard_path, dtype=np.uint8, mode='r')
+        offset, klass, name = self.datasets[index]
+        image = self.shard[offset:offset + self.image_size] \
+            .reshape(self.image_shape)
+        if self.transform:
+            image = self.transform(image)
+        return (image, klass, name)
+
+
+class ImageDataset(data.Dataset):
+
+    def __init__(self, image_paths, transform=None, loader=None):
+        self.image_paths = image_paths
+        self.transform = transform
+        self.loader = loader if loader else image_loader
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def __getitem__(self, index):
+        image = self.loader(self.image_paths[index])
+        if self.transform:
+            image = self.transform(image)
+        return image
+
+
 class PairedDataset(data.Dataset):
 
     def __init__(self, dataroot, pairs_cfg, transform=None, loader=None):
@@ -115,6 +262,20 @@ class PairedDataset(data.Dataset):
                 self.transform(self.loader(self.image_names_b[index])),
                 self.matches[index])
 
+    def unique_images(self):
+        # every image once, plus the position of each pair's images in it
+        image_paths = []
+        positions = {}
+        indices_a = []
+        indices_b = []
+        for name_a, name_b in zip(self.image_names_a, self.image_names_b):
+            for name, indices in ((name_a, indices_a), (name_b, indices_b)):
+                if name not in positions:
+                    positions[name] = len(image_paths)
+                    image_paths.append(name)
+                indices.append(positions[name])
+        return image_paths, indices_a, indices_b
+
     def _prepare_dataset(self):
         raise NotImplementedError
         
@@ -1,2 +1,64 @@
 import torch
 device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+class DevicePrefetcher(object):
+    # Wraps a DataLoader so that, on CUDA, the copy of the next batch to
+    # the device runs on a side stream while the current batch computes.
+    # The copies only overlap when the DataLoader pins its memory. Other
+    # devices get the batches moved as they come. Everything else, e.g.
+    # sampler and batch_size, is the wrapped DataLoader's.
+
+    def __init__(self, dataloader, device=device):
+        self.dataloader = dataloader
+        self.device = device
+        self.stream = torch.cuda.Stream() \
+            if torch.device(device).type == 'cuda' else None
+
+    def __len__(self):
+        return len(self.dataloader)
+
+    def __getattr__(self, name):
+        if name == 'dataloader':
+            raise AttributeError(name)
+        return getattr(self.dataloader, name)
+
+    def __iter__(self):
+        iterator = iter(self.dataloader)
+        if self.stream is None:
+            for batch in iterator:
+                yield self._to_device(batch)
+            return
+
+        next_batch = self._preload(iterator)
+        while next_batch is not None:
+            torch.cuda.current_stream().wait_stream(self.stream)
+            batch = next_batch
+            # the tensors were allocated on the side stream, keep their
+            # memory until the compute stream is done with them
+            for tensor in self._tensors(batch):
+                tensor.record_stream(torch.cuda.current_stream())
+            next_batch = self._preload(iterator)
+            yield batch
+
+    def _preload(self, iterator):
+        try:
+            batch = next(iterator)
+        except StopIteration:
+            return None
+        with torch.cuda.stream(self.stream):
+            return self._to_device(batch)
+
+    def _to_device(self, batch):
+        if torch.is_tensor(batch):
+            return batch.to(self.device, non_blocking=True)
+        if isinstance(batch, (list, tuple)):
+            return type(batch)(self._to_device(item) for item in batch)
+        return batch
+
+    def _tensors(self, batch):
+        if torch.is_tensor(batch):
+            return [batch]
+        if isinstance(batch, (list, tuple)):
+            return [tensor for item in batch for tensor in self._tensors(item)]
+        return []
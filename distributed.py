@@ -0,0 +1,98 @@
+import os
+import sys
+import random
+import contextlib
+
+import torch
+import torch.distributed as dist
+
+# Data parallel training in several processes of one machine, over the gloo
+# backend. Every process trains on its share of the samples, DDP averages
+# the gradients, and the center updates are computed from the features and
+# targets of all processes, so every replica applies the same update and
+# the centers never drift apart. Only the first process writes checkpoints,
+# events and printed output.
+
+
+def get_rank():
+    return dist.get_rank() if dist.is_available() and \
+        dist.is_initialized() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if dist.is_available() and \
+        dist.is_initialized() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def all_gather(tensor):
+    # the tensors of every process concatenated along the first dimension,
+    # they must have the same shape in every process
+    tensors = [torch.empty_like(tensor) for _ in range(get_world_size())]
+    dist.all_gather(tensors, tensor.contiguous())
+    return torch.cat(tensors)
+
+
+def broadcast_flag(flag):
+    # the first process' decision, in every process
+    tensor = torch.tensor([1 if flag else 0])
+    dist.broadcast(tensor, 0)
+    return bool(tensor.item())
+
+
+def run_process(rank, args, world_size, threads, port):
+    import main
+
+    torch.set_num_threads(threads)
+    dist.init_process_group(
+        'gloo', init_method='tcp://127.0.0.1:{}'.format(port),
+        rank=rank, world_size=world_size)
+    try:
+        if rank:
+            with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f):
+                main.train(args)
+        else:
+            main.train(args)
+    finally:
+        dist.destroy_process_group()
+
+
+def launch(args):
+    import main
+    from crossval import prepare_caches
+
+    cpus = os.cpu_count() or 1
+    threads = args.threads if args.threads else \
+        max(1, cpus // args.nproc - args.num_workers)
+    # the processes must select the same people and shuffle alike
+    if args.seed is None:
+        args.seed = random.randrange(2 ** 31)
+        print('seed {}'.format(args.seed))
+    # listed, packed and cached once, not by every process at the same time
+    main.get_log_dir(args)
+    prepare_caches(args)
+    print('training in {} processes of {} threads'.format(
+        args.nproc, threads))
+    sys.stdout.flush()
+    torch.multiprocessing.spawn(
+        run_process, args=(args, args.nproc, threads, args.master_port),
+        nprocs=args.nproc)
+
+
+if __name__ == '__main__':
+    import main
+
+    parser = main.get_parser()
+    parser.description = 'data parallel main.py train in several processes'
+    parser.add_argument('--nproc', type=int, required=True,
+                        help='training processes')
+    parser.add_argument('--threads', type=int,
+                        help='torch threads of every process (default: the '
+                             'CPUs divided by --nproc, less --num_workers)')
+    parser.add_argument('--master_port', type=int, default=29500,
+                        help='local port the processes rendezvous on '
+                             '(default: 29500)')
+    launch(parser.parse_args())
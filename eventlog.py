@@ -0,0 +1,21 @@
+import json
+import time
+
+
+class EventLog(object):
+    # Appends one JSON object per line. Every record is flushed as it is
+    # written, a run that dies keeps everything it logged and the file can
+    # be followed while it grows.
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a')
+
+    def write(self, event, **fields):
+        record = {'event': event, 'time': time.time()}
+        record.update(fields)
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
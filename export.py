@@ -0,0 +1,139 @@
+import copy
+import json
+import time
+import zipfile
+
+import torch
+from torch import nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+EXPORT_FORMATS = ('torchscript', 'onnx')
+QUANTIZATIONS = ('none', 'dynamic', 'static')
+
+
+def fold_batch_norms(module):
+    # folds, in place, every BatchNorm2d into the Conv2d it follows: the
+    # conv1/bn1, conv2/bn2, .. attribute pairs of the resnet stem and blocks
+    # and the (conv, bn) pairs of the downsample Sequentials
+    for child in module.children():
+        fold_batch_norms(child)
+
+    if isinstance(module, nn.Sequential):
+        for index in range(len(module) - 1):
+            if isinstance(module[index], nn.Conv2d) and \
+                    isinstance(module[index + 1], nn.BatchNorm2d):
+                module[index] = fuse_conv_bn_eval(
+                    module[index], module[index + 1])
+                module[index + 1] = nn.Identity()
+
+    index = 1
+    while isinstance(getattr(module, 'conv{}'.format(index), None),
+                     nn.Conv2d) and \
+            isinstance(getattr(module, 'bn{}'.format(index), None),
+                       nn.BatchNorm2d):
+        setattr(module, 'conv{}'.format(index), fuse_conv_bn_eval(
+            getattr(module, 'conv{}'.format(index)),
+            getattr(module, 'bn{}'.format(index))))
+        setattr(module, 'bn{}'.format(index), nn.Identity())
+        index += 1
+    return module
+
+
+class InferenceModel(nn.Module):
+    # the embedding path of a ResnetFaceModel: BN folded into the
+    # convolutions, no classifier and no centers. Returns the normalized
+    # features only, which is what traces and exports cleanly.
+
+    def __init__(self, model):
+        super().__init__()
+        base = fold_batch_norms(copy.deepcopy(model.base).eval())
+        self.stem = nn.Sequential(base.conv1, base.relu, base.maxpool)
+        self.layers = nn.Sequential(
+            base.layer1, base.layer2, base.layer3, base.layer4)
+        self.extract_feature = copy.deepcopy(model.extract_feature)
+        self.feature_dim = model.feature_dim
+        self.eval()
+
+    def forward(self, x):
+        x = self.layers(self.stem(x))
+        feature = self.extract_feature(torch.flatten(x, 1))
+        return feature.div(
+            torch.norm(feature, p=2, dim=1, keepdim=True).expand_as(feature))
+
+
+class ExportedModel(nn.Module):
+    # runs a model on the CPU behind the (logits, features) interface of
+    # FaceModel, so evaluate, verify, identify and serve can use exported
+    # models. Wraps FaceModels as well, to compare them on the same device.
+
+    def __init__(self, module, meta):
+        super().__init__()
+        self.module = module
+        self.meta = meta
+        self.FEATURE_DIM = meta['feature_dim']
+        self.IMAGE_SHAPE = tuple(meta['image_shape'])
+
+    def forward(self, x):
+        output = self.module(x.cpu())
+        return output if isinstance(output, tuple) else (None, output)
+
+
+def quantize_dynamic(model):
+    # int8 weights for the Linear layers, activations are quantized on the
+    # fly. extract_feature holds most of the parameters of the model.
+    return torch.ao.quantization.quantize_dynamic(
+        model, {nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_static(model, calibration_batches, example_inputs):
+    # int8 weights and activations for the convolutions and the Linear,
+    # the activation ranges are observed on calibration_batches
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    engine = torch.backends.quantized.engine
+    prepared = prepare_fx(
+        model, get_default_qconfig_mapping(engine), example_inputs)
+    with torch.no_grad():
+        for images in calibration_batches:
+            prepared(images)
+    return convert_fx(prepared)
+
+
+def is_exported(path):
+    # TorchScript archives carry their code, torch.save checkpoints do not
+    if not zipfile.is_zipfile(path):
+        return False
+    with zipfile.ZipFile(path) as archive:
+        return any('/code/' in name for name in archive.namelist())
+
+
+def save_torchscript(model, example_inputs, path, meta):
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(model, example_inputs))
+    torch.jit.save(traced, path,
+                   _extra_files={'meta.json': json.dumps(meta)})
+
+
+def save_onnx(model, example_inputs, path):
+    torch.onnx.export(
+        model, example_inputs, path, input_names=['images'],
+        output_names=['features'],
+        dynamic_axes={'images': {0: 'batch'}, 'features': {0: 'batch'}})
+
+
+def load_exported(path):
+    extra_files = {'meta.json': ''}
+    module = torch.jit.load(path, map_location='cpu',
+                            _extra_files=extra_files)
+    return ExportedModel(module, json.loads(extra_files['meta.json'])).eval()
+
+
+def measure_latency(model, images, repeat=10):
+    # mean seconds per forward pass of images, after a warm-up pass
+    with torch.no_grad():
+        model(images)
+        start = time.time()
+        for _ in range(repeat):
+            model(images)
+    return (time.time() - start) / repeat
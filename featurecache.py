@@ -0,0 +1,111 @@
+import os
+import json
+import hashlib
+
+import numpy as np
+import torch
+from torch.utils import data
+
+from device import device
+
+# Backbone outputs computed once per image, for runs that only train the
+# head (extract_feature, classifier), the centers and the loss on top of a
+# frozen backbone. The images go through the deterministic preprocessing of
+# transform_for_infer, so the cache is valid for every epoch. The flattened
+# layer4 outputs are stored as float16 rows of one flat file, like a shard,
+# with a JSON index next to it.
+
+CACHE_VERSION = 1
+
+
+def backbone_signature(model, sources):
+    # identifies the backbone weights and the images a cache was built from,
+    # sources are the image paths or shard offsets of the samples
+    digest = hashlib.sha1()
+    digest.update(type(model).__name__.encode())
+    for name, tensor in model.base.state_dict().items():
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    for source in sources:
+        digest.update(str(source).encode())
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def build_feature_cache(model, dataset, cache_path, signature,
+                        batch_size=256, num_workers=0):
+    # dataset yields (uint8 image, class, name) samples, e.g. a Dataset or a
+    # ShardDataset with transform_for_loading and no flip
+    from imageaug import BatchTransform, BatchCollate
+
+    loader = data.DataLoader(
+        dataset, batch_size=batch_size, num_workers=num_workers,
+        collate_fn=BatchCollate(BatchTransform()))
+
+    training = model.training
+    model.eval()
+    cache = None
+    entries = []
+    with torch.no_grad():
+        for images, klasses, names in loader:
+            features = model.backbone(images.to(device)).cpu().numpy()
+            if cache is None:
+                cache = np.memmap(cache_path, dtype=np.float16, mode='w+',
+                                  shape=(len(dataset), features.shape[1]))
+            cache[len(entries):len(entries) + len(features)] = features
+            for klass, name in zip(klasses.tolist(), names):
+                entries.append((len(entries), klass, name))
+    model.train(training)
+    if cache is None:
+        raise ValueError('no images to cache the backbone features of')
+    feature_size = cache.shape[1]
+    cache.flush()
+    del cache
+
+    with open(cache_path + '.json', 'w') as f:
+        json.dump({
+            'version': CACHE_VERSION,
+            'signature': signature,
+            'feature_size': feature_size,
+            'entries': entries
+        }, f)
+
+    return entries
+
+
+def load_feature_cache(cache_path, signature=None):
+    # the (row, class, name) entries and the feature size, None when there
+    # is no cache or it was built from other images or backbone weights
+    try:
+        with open(cache_path + '.json', 'r') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get('version') != CACHE_VERSION or \
+            not os.path.isfile(cache_path) or \
+            signature is not None and index['signature'] != signature:
+        return None
+    entries = [tuple(entry) for entry in index['entries']]
+    return entries, index['feature_size']
+
+
+class FeatureCacheDataset(data.Dataset):
+
+    def __init__(self, datasets, cache_path, feature_size):
+        self.datasets = datasets
+        self.cache_path = cache_path
+        self.feature_size = feature_size
+        # opened lazily so every dataloader worker maps the file itself
+        self.cache = None
+
+    def __len__(self):
+        return len(self.datasets)
+
+    def __getitem__(self, index):
+        if self.cache is None:
+            self.cache = np.memmap(
+                self.cache_path, dtype=np.float16, mode='r') \
+                .reshape(-1, self.feature_size)
+        row, klass, name = self.datasets[index]
+        features = torch.from_numpy(self.cache[row].astype(np.float32))
+        return (features, klass, name)
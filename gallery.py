@@ -0,0 +1,198 @@
+import os
+
+import torch
+from torch.utils.data import DataLoader
+
+from dataset import ImageDataset
+from inference import embed_images
+from manifest import load_manifest, manifest_path
+
+
+def _merge_topk(scores, indices, new_scores, new_indices, k):
+    scores = torch.cat([scores, new_scores], dim=1)
+    indices = torch.cat([indices, new_indices], dim=1)
+    scores, positions = scores.topk(min(k, scores.size(1)), dim=1)
+    return scores, torch.gather(indices, 1, positions)
+
+
+class IVFIndex(object):
+    # Inverted file index: the gallery is clustered with spherical k-means
+    # and a query is only compared with the members of its num_probes
+    # closest clusters. Approximate, but the cost per query drops from the
+    # gallery size to roughly num_probes / num_lists of it.
+
+    def __init__(self, centroids, order, offsets):
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, embeddings, num_lists, iterations=10, seed=0,
+              block_size=65536):
+        generator = torch.Generator().manual_seed(seed)
+        num_lists = min(num_lists, len(embeddings))
+        # the centroids are fit on a sample, every member is assigned after
+        sample = embeddings[torch.randperm(
+            len(embeddings), generator=generator)[:num_lists * 256]]
+        centroids = sample[:num_lists].clone()
+
+        for _ in range(iterations):
+            assignments = cls._assign(sample, centroids, block_size)
+            sums = torch.zeros_like(centroids).index_add_(
+                0, assignments, sample)
+            counts = torch.bincount(assignments, minlength=num_lists)
+            # restart empty lists from random members
+            empty = torch.nonzero(counts == 0).flatten()
+            if len(empty):
+                sums[empty] = sample[torch.randint(
+                    len(sample), (len(empty),), generator=generator)]
+            centroids = sums / torch.norm(
+                sums, p=2, dim=1, keepdim=True).clamp(min=1e-12)
+
+        assignments = cls._assign(embeddings, centroids, block_size)
+        order = torch.argsort(assignments)
+        offsets = torch.cat([
+            torch.zeros(1, dtype=torch.long),
+            torch.cumsum(torch.bincount(
+                assignments, minlength=num_lists), dim=0)])
+        return cls(centroids, order, offsets)
+
+    @staticmethod
+    def _assign(embeddings, centroids, block_size):
+        return torch.cat([
+            torch.argmax(embeddings[start:start + block_size] @
+                         centroids.t(), dim=1)
+            for start in range(0, len(embeddings), block_size)])
+
+    def search(self, embeddings, queries, k, num_probes=8):
+        num_probes = min(num_probes, len(self.centroids))
+        _, probes = (queries @ self.centroids.t()).topk(num_probes, dim=1)
+
+        scores = torch.full((len(queries), k), -float('inf'))
+        indices = torch.full((len(queries), k), -1, dtype=torch.long)
+        for query_index, query in enumerate(queries):
+            candidates = torch.cat([
+                self.order[self.offsets[probe]:self.offsets[probe + 1]]
+                for probe in probes[query_index].tolist()])
+            candidate_scores = embeddings[candidates] @ query
+            top_scores, positions = candidate_scores.topk(
+                min(k, len(candidates)))
+            scores[query_index, :len(positions)] = top_scores
+            indices[query_index, :len(positions)] = candidates[positions]
+        return scores, indices
+
+    def state_dict(self):
+        return {
+            'centroids': self.centroids,
+            'order': self.order,
+            'offsets': self.offsets
+        }
+
+
+class Gallery(object):
+    # L2-normalized embeddings of known faces. For unit vectors the squared
+    # L2 distance used by verify is 2 - 2 * cosine similarity, so the search
+    # ranks by a plain matrix multiply.
+
+    def __init__(self, embeddings, labels, identities, image_paths):
+        self.embeddings = embeddings
+        self.labels = labels
+        self.identities = identities
+        self.image_paths = image_paths
+        self.max_images_per_identity = torch.bincount(labels).max().item() \
+            if len(labels) else 0
+        self.index = None
+
+    @classmethod
+    def from_directory(cls, model, images_root, transform, batch_size=256,
+                       num_workers=0):
+        # images_root holds one directory of images per identity, like the
+        # race directories create_datasetsR reads
+        dataroot, name = os.path.split(os.path.normpath(images_root))
+        people = load_manifest(images_root, manifest_path(dataroot, name))
+
+        identities = sorted(people)
+        image_paths = []
+        labels = []
+        for label, identity in enumerate(identities):
+            for image in people[identity]['images']:
+                image_paths.append(
+                    os.path.join(images_root, identity, image[0]))
+                labels.append(label)
+
+        dataloader = DataLoader(
+            ImageDataset(image_paths, transform),
+            batch_size=batch_size, num_workers=num_workers)
+        embeddings = embed_images(
+            model, dataloader, len(image_paths), model.FEATURE_DIM)
+        return cls(embeddings, torch.tensor(labels, dtype=torch.long),
+                   identities, image_paths)
+
+    def build_index(self, num_lists, iterations=10, seed=0):
+        self.index = IVFIndex.build(
+            self.embeddings, num_lists, iterations, seed)
+        return self.index
+
+    def search(self, queries, k=5, block_size=65536, num_probes=None):
+        # top-k gallery images per query as (squared distances, indices),
+        # exact unless num_probes is given and an index was built
+        k = min(k, len(self.embeddings))
+        if num_probes is not None and self.index is not None:
+            scores, indices = self.index.search(
+                self.embeddings, queries, k, num_probes)
+        else:
+            scores = torch.empty(len(queries), 0)
+            indices = torch.empty(len(queries), 0, dtype=torch.long)
+            for start in range(0, len(self.embeddings), block_size):
+                block_scores = queries @ \
+                    self.embeddings[start:start + block_size].t()
+                block_scores, block_indices = block_scores.topk(
+                    min(k, block_scores.size(1)), dim=1)
+                scores, indices = _merge_topk(
+                    scores, indices, block_scores, block_indices + start, k)
+        return (2 - 2 * scores).clamp(min=0), indices
+
+    def identify(self, queries, k=5, block_size=65536, num_probes=None):
+        # the k best images of the k best identities are always among the
+        # k * max_images_per_identity best images, so identities are ranked
+        # exactly by their closest image
+        distances, indices = self.search(
+            queries, k * self.max_images_per_identity, block_size,
+            num_probes)
+
+        results = []
+        for query_distances, query_indices in zip(distances, indices):
+            matches = []
+            seen = set()
+            for distance, index in zip(query_distances.tolist(),
+                                       query_indices.tolist()):
+                if index < 0:
+                    continue
+                label = self.labels[index].item()
+                if label in seen:
+                    continue
+                seen.add(label)
+                matches.append((self.identities[label], distance,
+                                self.image_paths[index]))
+                if len(matches) == k:
+                    break
+            results.append(matches)
+        return results
+
+    def save(self, path):
+        torch.save({
+            'embeddings': self.embeddings,
+            'labels': self.labels,
+            'identities': self.identities,
+            'image_paths': self.image_paths,
+            'index': self.index.state_dict() if self.index else None
+        }, path)
+
+    @classmethod
+    def load(cls, path):
+        state = torch.load(path)
+        gallery = cls(state['embeddings'], state['labels'],
+                      state['identities'], state['image_paths'])
+        if state['index'] is not None:
+            gallery.index = IVFIndex(**state['index'])
+        return gallery
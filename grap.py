@@ -1,13 +1,227 @@
-import re
-import os
-
-f = open( "learingrate_02.out.262859" , "r")
-a='learingrate_02.out.262859'
-
-train = re.search(\[train:(\d+)\] cross entropy loss: (\d+\.\d+) - center loss: (\d+\.\d+) - total weighted loss: (\d+\.\d+) , a )
-
-train_end = re.search( \[train:(\d+)\] finished. cross entropy loss: (\d+\.\d+) - center loss: (\d+\.\d+) - together: (\d+\.\d+) - top1 acc: (\d+\.\d+) % - top3 acc: (\d+\.\d+), a )
-
-validate =  re.search( \[validate:(\d+)\] cross entropy loss: (\d+\.\d+) - center loss: (\d+\.\d+) - total weighted loss: (\d+\.\d+), a )
-
-print( train.group() + train.group(1) + train.group(2) + train.group(3) )
+import os
+import re
+import csv
+import sys
+import gzip
+import json
+import fnmatch
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+# Summarizes training logs: the printed output of main.py train, e.g. SLURM
+# .out files, and the JSONL event files written with --events. Logs are
+# read line by line, only one record per run and epoch is kept, so the
+# size of a log does not matter.
+
+FIELDS = ('cross_entropy', 'center', 'together', 'top1', 'top3')
+LOG_PATTERNS = ('*.out*', '*.log*', '*.jsonl*')
+
+_NUMBER = r'([-+]?(?:\d+(?:\.\d*)?(?:[eE][-+]?\d+)?|nan|inf))'
+_INTERVAL = re.compile(
+    r'\[(train|validate):(\d+)\] cross entropy loss: ' + _NUMBER +
+    r' - center loss: ' + _NUMBER + r' - total weighted loss: ' + _NUMBER)
+_EPOCH = re.compile(
+    r'\[(train|validate):(\d+)\] finished\. cross entropy loss: ' +
+    _NUMBER + r' - center loss: ' + _NUMBER + r' - together: ' + _NUMBER +
+    r' - top1 acc: ' + _NUMBER + r' % - top3 acc: ' + _NUMBER + r' %')
+
+
+def parse_line(line):
+    # an 'interval' or 'epoch' record, or None for any other line. Legacy
+    # accuracies are printed in percent and converted to fractions like the
+    # events. Logs of older Trainers print the unweighted cross entropy +
+    # center loss as the epoch 'together', now it is the weighted loss.
+    if line.startswith('{'):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return None
+        if isinstance(record, dict) and \
+                record.get('event') in ('interval', 'epoch'):
+            return record
+        return None
+
+    if '[train:' not in line and '[validate:' not in line:
+        return None
+    match = _EPOCH.search(line)
+    if match:
+        values = [float(value) for value in match.groups()[2:]]
+        values[3] /= 100
+        values[4] /= 100
+        record = {'event': 'epoch'}
+    else:
+        match = _INTERVAL.search(line)
+        if not match:
+            return None
+        values = [float(value) for value in match.groups()[2:]]
+        record = {'event': 'interval'}
+    record['mode'] = match.group(1)
+    record['epoch'] = int(match.group(2))
+    record.update(zip(FIELDS, values))
+    return record
+
+
+def read_log(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', errors='replace') as f:
+        for line in f:
+            record = parse_line(line)
+            if record:
+                yield record
+
+
+def run_name(path):
+    name = os.path.basename(path)
+    for suffix in ('.gz', '.jsonl', '.events', '.log'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+
+def summarize_log(path):
+    # the last epoch record per mode and epoch wins, so restarted or
+    # resumed runs in one log show their final numbers
+    epochs = {'train': {}, 'validate': {}}
+    intervals = 0
+    for record in read_log(path):
+        if record['event'] == 'interval':
+            intervals += 1
+            continue
+        epochs.setdefault(record['mode'], {})[record['epoch']] = {
+            key: record.get(key)
+            for key in FIELDS + ('images', 'seconds', 'images_per_sec')}
+    return {'run': run_name(path), 'path': path, 'intervals': intervals,
+            'epochs': epochs}
+
+
+def summary_row(run):
+    train = run['epochs'].get('train', {})
+    validate = run['epochs'].get('validate', {})
+    row = {
+        'run': run['run'],
+        'epochs': max(train) if train else 0,
+        'intervals': run['intervals']
+    }
+    for mode, epochs in (('train', train), ('validate', validate)):
+        last = epochs[max(epochs)] if epochs else {}
+        row['{}_cross_entropy'.format(mode)] = last.get('cross_entropy')
+        row['{}_top1'.format(mode)] = last.get('top1')
+    if validate:
+        best = min(validate, key=lambda epoch: validate[epoch]['together'])
+        row['best_validate_together'] = validate[best]['together']
+        row['best_validate_together_epoch'] = best
+        best = max(validate, key=lambda epoch: validate[epoch]['top1'])
+        row['best_validate_top1'] = validate[best]['top1']
+        row['best_validate_top1_epoch'] = best
+    speeds = [values['images_per_sec'] for values in train.values()
+              if values.get('images_per_sec')]
+    row['train_images_per_sec'] = sum(speeds) / len(speeds) \
+        if speeds else None
+    return row
+
+
+def find_logs(paths):
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, _, files in os.walk(path):
+            for name in sorted(files):
+                if any(fnmatch.fnmatch(name, pattern)
+                       for pattern in LOG_PATTERNS):
+                    yield os.path.join(root, name)
+
+
+def print_table(rows, columns, output):
+    def format_value(value):
+        if value is None:
+            return '-'
+        if isinstance(value, float):
+            return '{:.6f}'.format(value)
+        return str(value)
+
+    cells = [[format_value(row.get(column)) for column in columns]
+             for row in rows]
+    widths = [max([len(column)] + [len(line[index]) for line in cells])
+              for index, column in enumerate(columns)]
+    for line in [list(columns)] + cells:
+        output.write('  '.join(
+            cell.ljust(width) for cell, width in zip(line, widths))
+            .rstrip() + '\n')
+
+
+def plot_curves(runs, metric, path):
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(1, 2, figsize=(12, 4))
+    for axis, mode in zip(axes, ('train', 'validate')):
+        for run in runs:
+            epochs = sorted(run['epochs'].get(mode, {}))
+            if epochs:
+                axis.plot(epochs, [run['epochs'][mode][epoch][metric]
+                                   for epoch in epochs], label=run['run'])
+        axis.set_title('{} {}'.format(mode, metric))
+        axis.set_xlabel('epoch')
+    if len(runs) <= 20:
+        axes[1].legend(fontsize='small')
+    fig.savefig(path, dpi=fig.dpi)
+
+
+def main(args):
+    paths = list(find_logs(args.logs))
+    if args.jobs > 1:
+        with ProcessPoolExecutor(args.jobs) as executor:
+            runs = list(executor.map(summarize_log, paths))
+    else:
+        runs = [summarize_log(path) for path in paths]
+
+    rows = [summary_row(run) for run in runs]
+    if args.sort:
+        # runs without the column go last
+        rows = sorted(
+            [row for row in rows if row.get(args.sort) is not None],
+            key=lambda row: row[args.sort], reverse=args.descending) + \
+            [row for row in rows if row.get(args.sort) is None]
+    columns = list(rows[0]) if rows else ['run']
+    for row in rows[1:]:
+        columns.extend(key for key in row if key not in columns)
+
+    if args.format == 'json':
+        json.dump(runs, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    elif args.format == 'csv':
+        writer = csv.DictWriter(sys.stdout, columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        print_table(rows, columns, sys.stdout)
+
+    if args.plot:
+        plot_curves(runs, args.metric, args.plot)
+        print('curves written to {}'.format(args.plot), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='summarize training logs and event files')
+    parser.add_argument('logs', nargs='+',
+                        help='log files, or directories searched for '
+                             + ', '.join(LOG_PATTERNS))
+    parser.add_argument('--format', type=str, default='table',
+                        choices=('table', 'csv', 'json'),
+                        help='table and csv print one summary row per run, '
+                             'json every epoch (default: table)')
+    parser.add_argument('--sort', type=str,
+                        help='column to sort the runs by, e.g. '
+                             'best_validate_together')
+    parser.add_argument('--descending', action='store_true',
+                        help='sort in descending order')
+    parser.add_argument('--plot', type=str,
+                        help='write the per epoch curves of --metric to '
+                             'this image')
+    parser.add_argument('--metric', type=str, default='cross_entropy',
+                        choices=FIELDS,
+                        help='metric of the curves (default: cross_entropy)')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='logs parsed in parallel (default: 1)')
+    main(parser.parse_args())
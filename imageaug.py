@@ -1,21 +1,106 @@
+import numpy as np
+import torch
+from torch.utils.data.dataloader import default_collate
 from torchvision import transforms
+from torchvision.transforms import functional
+
+
+class ResizeImage(object):
+    # cv2 HWC uint8 array to a CHW uint8 tensor of image_shape. The channels
+    # stay in the BGR order of cv2, the one the models were trained on.
+
+    def __init__(self, image_shape):
+        self.image_shape = tuple(image_shape)
+
+    def __call__(self, image):
+        image = torch.from_numpy(
+            np.require(image, requirements=['C', 'W'])).permute(2, 0, 1)
+        if tuple(image.shape[1:]) != self.image_shape:
+            image = functional.resize(
+                image, self.image_shape, antialias=True)
+        return image
+
+
+class BatchTransform(object):
+    # uint8 images, one (C, H, W) or a batch (N, C, H, W), to normalized
+    # float tensors. With flip_tta the mirrored batch is appended, so both
+    # views of an image run in the same forward pass, see merge_flipped.
+
+    def __init__(self, flip_tta=False, mean=(0.5, 0.5, 0.5),
+                 std=(0.5, 0.5, 0.5)):
+        self.flip_tta = flip_tta
+        self.mean = torch.tensor(mean).view(-1, 1, 1)
+        self.std = torch.tensor(std).view(-1, 1, 1)
+
+    def __call__(self, images):
+        images = images.float().div_(255) \
+            .sub_(self.mean.to(images.device)) \
+            .div_(self.std.to(images.device))
+        if self.flip_tta:
+            images = torch.cat([images, images.flip(-1)])
+        return images
+
+
+class BatchCollate(object):
+    # collate_fn applying a BatchTransform to the uint8 images of a batch,
+    # once per batch instead of once per image. With fields only those
+    # positions of the samples are collated, e.g. (0, 1) drops the names
+    # of (image, class, name) samples.
+
+    def __init__(self, batch_transform, fields=None):
+        self.batch_transform = batch_transform
+        self.fields = fields
+
+    def __call__(self, samples):
+        if self.fields is not None:
+            samples = [tuple(sample[field] for field in self.fields)
+                       for sample in samples]
+        batch = default_collate(samples)
+        if torch.is_tensor(batch):
+            return self.batch_transform(batch)
+        return [self.batch_transform(item)
+                if torch.is_tensor(item) and item.dtype == torch.uint8
+                else item for item in batch]
+
+
+def _to_array(image):
+    return np.ascontiguousarray(image.permute(1, 2, 0).numpy())
+
+
+def merge_flipped(features):
+    # features of a flip_tta batch back to one normalized feature per image
+    features = torch.add(*features.chunk(2))
+    return features.div(
+        torch.norm(features, p=2, dim=1, keepdim=True).expand_as(features))
+
+
+def transform_for_loading(image_shape, flip=False):
+    # the per image part, run in the dataloader workers. The random flip is
+    # drawn here so SeededDataset keeps it reproducible.
+    steps = [ResizeImage(image_shape)]
+    if flip:
+        steps.append(transforms.RandomHorizontalFlip())
+    return transforms.Compose(steps)
 
 
 def transform_for_training(image_shape):
     return transforms.Compose(
-       [transforms.ToPILImage(),
-        transforms.Resize(image_shape),
-        transforms.RandomHorizontalFlip(),
-        transforms.ToTensor(),
-        transforms.Normalize([0.5, 0.5, 0.5], [0.5, 0.5, 0.5])]
+       [transform_for_loading(image_shape, flip=True),
+        BatchTransform()]
     )
 
 
 def transform_for_infer(image_shape):
     return transforms.Compose(
-       [transforms.ToPILImage(),
-        transforms.Resize(image_shape),
-        transforms.RandomHorizontalFlip(),
-        transforms.ToTensor(),
-        transforms.Normalize([0.5, 0.5, 0.5], [0.5, 0.5, 0.5])]
-    )
\ No newline at end of file
+       [transform_for_loading(image_shape),
+        BatchTransform()]
+    )
+
+
+def transform_for_packing(image_shape):
+    # the deterministic part of the pipelines above, applied once when the
+    # images are packed into a shard
+    return transforms.Compose(
+       [ResizeImage(image_shape),
+        _to_array]
+    )
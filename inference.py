@@ -0,0 +1,201 @@
+import os
+import itertools
+from collections import OrderedDict, deque
+
+import torch
+from torch.utils.data import DataLoader
+from torch.utils.data.dataloader import default_collate
+
+from device import device
+from dataset import ImageDataset
+from imageaug import merge_flipped
+
+
+def embed_images(model, dataloader, num_images, feature_dim,
+                 flip_tta=False):
+    # runs every image of the dataloader through the model once, in order.
+    # With flip_tta the batches hold the images followed by their mirrored
+    # copies, see imageaug.BatchTransform.
+    embeddings = torch.zeros(num_images, feature_dim)
+    start = 0
+    with torch.no_grad():
+        for images in dataloader:
+            images = images.to(device)
+            _, batched_embeddings = model(images)
+            if flip_tta:
+                batched_embeddings = merge_flipped(batched_embeddings)
+            end = start + len(batched_embeddings)
+            embeddings[start:end, :] = batched_embeddings.cpu()
+            start = end
+    return embeddings
+
+
+def pair_distances(embeddings, indices_a, indices_b, chunk_size=65536):
+    # squared L2 distance of every pair, looked up by image index
+    indices_a = torch.as_tensor(indices_a, dtype=torch.long)
+    indices_b = torch.as_tensor(indices_b, dtype=torch.long)
+    for start in range(0, len(indices_a), chunk_size):
+        end = start + chunk_size
+        yield torch.sum(torch.pow(
+            embeddings[indices_a[start:end]] -
+            embeddings[indices_b[start:end]], 2), dim=1)
+
+
+def read_pairs(lines):
+    # one pair per line, the two paths split by a comma or whitespace
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        pair = line.split(',') if ',' in line else line.split()
+        if len(pair) != 2:
+            raise ValueError('expected 2 images per line, got {!r}'.format(
+                line))
+        yield pair[0].strip(), pair[1].strip()
+
+
+def count_written_pairs(output_path, block_size=1 << 20):
+    # number of complete lines in a previous output, a partially written
+    # last line is cut off so the run can append after it. The file is read
+    # block_size bytes at a time, however many pairs it holds.
+    if not os.path.isfile(output_path):
+        return 0
+    with open(output_path, 'r+b') as f:
+        # the end of the last complete line, searched back from the end
+        end = f.seek(0, os.SEEK_END)
+        while end:
+            start = max(0, end - block_size)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b'\n')
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        f.truncate(end)
+
+        f.seek(0)
+        count = 0
+        for block in iter(lambda: f.read(block_size), b''):
+            count += block.count(b'\n')
+    return count
+
+
+class PathDataset(ImageDataset):
+    # the images of verify_pairs, indexed by their paths. None, the
+    # placeholder of a chunk with no images to decode, stays None.
+
+    def __init__(self, transform=None, loader=None):
+        super().__init__(None, transform, loader)
+
+    def __getitem__(self, image_path):
+        if image_path is None:
+            return None
+        image = self.loader(image_path)
+        if self.transform:
+            image = self.transform(image)
+        return image
+
+
+def collate_images(images):
+    images = [image for image in images if image is not None]
+    return default_collate(images) if images else None
+
+
+class ChunkBatches(object):
+    # Batch sampler of verify_pairs: reads the pairs chunk by chunk and
+    # yields the paths of every chunk that are not in the LRU embedding
+    # cache, each once, batch_size at a time. A batch never spans two
+    # chunks, a chunk without new images yields one [None] batch. The
+    # cache's contents are tracked here, the plan of every chunk, (pairs,
+    # new paths, paths evicted after it, batches), waits in self.chunks
+    # until verify_pairs has its embeddings. The loader only samples a few
+    # batches ahead, so only a few chunks wait.
+
+    def __init__(self, pairs, batch_size, chunk_size, cache_size):
+        self.pairs = pairs
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.cache_size = cache_size
+        self.chunks = deque()
+
+    def __iter__(self):
+        cached = OrderedDict()
+        while True:
+            chunk = list(itertools.islice(self.pairs, self.chunk_size))
+            if not chunk:
+                return
+
+            new_paths = []
+            chunk_paths = set()
+            for pair in chunk:
+                for image_path in pair:
+                    if image_path in chunk_paths:
+                        continue
+                    chunk_paths.add(image_path)
+                    if image_path in cached:
+                        cached.move_to_end(image_path)
+                    else:
+                        new_paths.append(image_path)
+
+            for image_path in new_paths:
+                cached[image_path] = None
+            evicted = []
+            while len(cached) > self.cache_size:
+                evicted.append(cached.popitem(last=False)[0])
+
+            batches = [new_paths[start:start + self.batch_size]
+                       for start in range(0, len(new_paths),
+                                          self.batch_size)] or [[None]]
+            self.chunks.append((chunk, new_paths, evicted, len(batches)))
+            for batch in batches:
+                yield batch
+
+
+def verify_pairs(model, transform, pairs, output, threshold, batch_size,
+                 num_workers=0, chunk_size=65536, cache_size=10000):
+    # Streams pairs through the model chunk by chunk: only the images of a
+    # chunk that are not in the LRU embedding cache are decoded, each of
+    # them once, and every chunk's results are written before the next one
+    # is read. One loader decodes the images of all chunks, its workers
+    # run ahead into the next chunk. Memory stays bounded by chunk_size and
+    # cache_size.
+    sampler = ChunkBatches(pairs, batch_size, chunk_size, cache_size)
+    dataloader = DataLoader(
+        PathDataset(transform), batch_sampler=sampler,
+        num_workers=num_workers, collate_fn=collate_images)
+    cache = {}
+    written = 0
+    batches = 0
+    embeddings = []
+    with torch.no_grad():
+        for images in dataloader:
+            if images is not None:
+                _, batched_embeddings = model(images.to(device))
+                embeddings.append(batched_embeddings.cpu())
+            batches += 1
+            chunk, new_paths, evicted, num_batches = sampler.chunks[0]
+            if batches < num_batches:
+                continue
+            sampler.chunks.popleft()
+            batches = 0
+
+            if embeddings:
+                cache.update(zip(new_paths, torch.cat(embeddings)))
+            embeddings = []
+            embeddings_a = torch.stack(
+                [cache[image_a] for image_a, _ in chunk])
+            embeddings_b = torch.stack(
+                [cache[image_b] for _, image_b in chunk])
+            distances = torch.sum(
+                torch.pow(embeddings_a - embeddings_b, 2), dim=1).tolist()
+
+            output.write(''.join(
+                '{}\t{}\t{:.6f}\t{}\n'.format(
+                    image_a, image_b, distance, int(distance < threshold))
+                for (image_a, image_b), distance in zip(chunk, distances)))
+            output.flush()
+            written += len(chunk)
+
+            for image_path in evicted:
+                del cache[image_path]
+    return written
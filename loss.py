@@ -1,7 +1,5 @@
 import torch
 
-from device import device
-
 
 def compute_center_loss(features, centers, targets):
     features = features.view(features.size(0), -1)
@@ -11,34 +9,31 @@ def compute_center_loss(features, centers, targets):
     return center_loss
 
 
-def get_center_delta(features, centers, targets, alpha):
-    # implementation equation (4) in the center-loss paper
+def _get_batch_center_delta(features, centers, targets, alpha):
+    # implementation equation (4) in the center-loss paper, one row per
+    # sample of the batch. The delta of a class is written to the row of its
+    # first occurrence in the batch, every other row stays zero, so the
+    # result can be index_add_-ed to centers[targets] without ever building
+    # anything of size num_classes or syncing the unique classes to the host
     features = features.view(features.size(0), -1)
-    targets, indices = torch.sort(targets)
-    target_centers = centers[targets]
-    features = features[indices]
 
-    delta_centers = target_centers - features
-    uni_targets, indices = torch.unique(
-            targets.cpu(), sorted=True, return_inverse=True)
+    same_class = targets.unsqueeze(0) == targets.unsqueeze(1)
+    first_occurrence = torch.argmax(same_class.int(), dim=1)
+    same_class_feature_count = torch.sum(
+        same_class, dim=1).float().unsqueeze(1)
 
-    uni_targets = uni_targets.to(device)
-    indices = indices.to(device)
+    delta_centers = torch.zeros_like(features).index_add_(
+        0, first_occurrence, centers[targets] - features)
+    return delta_centers / (same_class_feature_count + 1.0) * alpha
 
-    delta_centers = torch.zeros(
-        uni_targets.size(0), delta_centers.size(1)
-    ).to(device).index_add_(0, indices, delta_centers)
 
-    targets_repeat_num = uni_targets.size()[0]
-    uni_targets_repeat_num = targets.size()[0]
-    targets_repeat = targets.repeat(
-            targets_repeat_num).view(targets_repeat_num, -1)
-    uni_targets_repeat = uni_targets.unsqueeze(1).repeat(
-            1, uni_targets_repeat_num)
-    same_class_feature_count = torch.sum(
-            targets_repeat == uni_targets_repeat, dim=1).float().unsqueeze(1)
+def get_center_delta(features, centers, targets, alpha):
+    delta_centers = _get_batch_center_delta(features, centers, targets, alpha)
+    return torch.zeros_like(centers).index_add_(0, targets, delta_centers)
+
 
-    delta_centers = delta_centers / (same_class_feature_count + 1.0) * alpha
-    result = torch.zeros_like(centers)
-    result[uni_targets, :] = delta_centers
-    return result
+def update_centers_(features, centers, targets, alpha):
+    # in-place, sparse equivalent of centers - get_center_delta(...): only
+    # the rows of the classes present in the batch are read or written
+    delta_centers = _get_batch_center_delta(features, centers, targets, alpha)
+    return centers.index_add_(0, targets, delta_centers, alpha=-1)
@@ -1,19 +1,41 @@
 import os 
+import sys
 import argparse 
+import json
+import random
+import itertools
 
 import torch
 from torch.utils.data import DataLoader
-from torchvision import transforms
 import numpy as np
 
-from dataset import Dataset, create_datasets,create_datasetsR,fold, LFWPairedDataset, DatasetSplit
+from dataset import Dataset, create_datasetsR,fold, LFWPairedDataset, DatasetSplit
+from dataset import ShardDataset, pack_shard, load_shard, ImageDataset
+from dataset import ResumableSampler, SeededDataset
+from archive import split_archive_path
 from models import Resnet50FaceModel, Resnet18FaceModel
-from device import device
+from device import device, DevicePrefetcher
 from trainer import Trainer
-from utils import download, generate_roc_curve, image_loader
-from metrics import compute_roc, select_threshold
-from imageaug import transform_for_infer, transform_for_training
-
+from distributed import get_rank, get_world_size
+from profiling import StepProfiler
+from utils import download, generate_roc_curve, generate_roc_curves, image_loader
+from utils import ReducedImageLoader
+from metrics import compute_roc, select_threshold, RocAccumulator
+from imageaug import transform_for_infer, transform_for_loading
+from imageaug import BatchTransform, BatchCollate
+from inference import embed_images, pair_distances
+from inference import read_pairs, count_written_pairs, verify_pairs
+from gallery import Gallery
+from featurecache import FeatureCacheDataset, backbone_signature
+from featurecache import build_feature_cache, load_feature_cache
+from server import EmbeddingServer
+from export import InferenceModel, ExportedModel, is_exported, load_exported
+from export import quantize_dynamic, quantize_static, measure_latency
+from export import save_torchscript, save_onnx, EXPORT_FORMATS, QUANTIZATIONS
+
+
+RACES = ('Caucasian', 'Indian', 'Asian', 'African')
+NUM_FOLDS = 10
 
 
 def main(args):
@@ -21,6 +43,12 @@ def main(args):
         evaluate(args)
     elif args.verify_model:
         verify(args)
+    elif args.identify:
+        identify(args)
+    elif args.serve:
+        serve(args)
+    elif args.export:
+        export(args)
     else:
         train(args)
 
@@ -31,15 +59,17 @@ def get_dataset_dir(args):
     dataset_dir = args.dataset_dir if args.dataset_dir else os.path.join(
         home,'RFW','Balancedface','race_per_7000')
 
-    if not os.path.isdir(dataset_dir):
+    # a tar or zip archive of the race directories is read in place
+    if not os.path.isdir(dataset_dir) and \
+            split_archive_path(dataset_dir) is None:
         os.mkdir(dataset_dir)
 
     return dataset_dir
 
-def get_dataset_dir_eve(args):
+def get_dataset_dir_eve(args, race):
     
     home = os.path.expanduser('/cmlscratch/dtinubu/datasets')
-    dataset_dir = os.path.join(home,'RFW','eve_set','test','data',args.race)
+    dataset_dir = os.path.join(home,'RFW','eve_set','test','data',race)
 
     if not os.path.isdir(dataset_dir):
         os.mkdir(dataset_dir)
@@ -47,6 +77,12 @@ def get_dataset_dir_eve(args):
     return dataset_dir
 
 
+def get_races(args):
+    if args.race == 'all':
+        return list(RACES)
+    return args.race.split(',')
+
+
 def get_log_dir(args):
     log_dir = args.log_dir if args.log_dir else os.path.join(
         os.path.dirname(os.path.realpath(__file__)), 'logs')
@@ -67,130 +103,350 @@ def get_model_class(args):
 
     return model_class
 
-def train(args):
-    group_flie = args.save_file_name
+def load_model(model_class, path):
+    # a checkpoint written by train, or a model written by --export
+    if is_exported(path):
+        return load_exported(path)
+
+    # the checkpoint overwrites the backbone, skip the ImageNet weights
+    model = model_class(False, pretrained=False).to(device)
+    checkpoint = torch.load(path)
+    model.load_state_dict(checkpoint['state_dict'], strict=False)
+    return model.eval()
+
+
+def load_training_set(args, model_class):
+    # the samples of every race and the number of people in them
     t_training_set=[]
     t_num_classes=0
     dataset_dir = get_dataset_dir(args)
+
+    # a packed shard already holds the decoded selection, no need to list
+    # the race directories again, unless it was packed from other images
+    Numbers_of_pics = (args.w,args.sa,args.ai,args.af)
+    selection = {'dataset_dir': os.path.abspath(dataset_dir),
+                 'races': list(RACES), 'pics': list(Numbers_of_pics),
+                 'seed': args.seed,
+                 'image_shape': list(model_class.IMAGE_SHAPE)}
+    shard = load_shard(args.shard, selection) if args.shard else None
+    if shard:
+        whole_set, _ = shard
+        t_num_classes = max(klass for _, klass, _ in whole_set) + 1
+    else:
+        if args.shard and os.path.isfile(args.shard):
+            print('{} was packed from another selection, repacking'.format(
+                args.shard))
+        # zip loop 
+        for race, num_of_pics in zip(RACES,Numbers_of_pics):  
+           race_set, num_classes_w = create_datasetsR(
+               race, num_of_pics, dataset_dir, seed=args.seed,
+               refresh=args.refresh_manifest)
+           # the people of a race are numbered after those of the races
+           # before it
+           t_training_set.extend(
+               (image_path, klass + t_num_classes, name)
+               for image_path, klass, name in race_set)
+           t_num_classes+=num_classes_w
+        whole_set = t_training_set
+        if args.shard:
+            whole_set = pack_shard(whole_set, args.shard,
+                                   model_class.IMAGE_SHAPE, args.num_workers,
+                                   selection)
+
+    return whole_set, t_num_classes
+
+
+def train(args, epoch_callback=None):
+    group_flie = args.save_file_name
     log_dir = get_log_dir(args)
     model_class = get_model_class(args)
-    
-    # zip loop 
-    Races =  ('Caucasian','Indian','Asian','African')
-    Numbers_of_pics = (args.w,args.sa,args.ai,args.af)
-    for race, num_of_pics in zip(Races,Numbers_of_pics):  
-       whole_set, num_classes_w = create_datasetsR(race,num_of_pics,dataset_dir)
-       t_training_set.extend(whole_set)
-       t_num_classes+=num_classes_w
-    
-    folds = fold(10, whole_set)
-    training_set, validation_set = next(folds)
-    num_classes = len(whole_set)
-    training_dataset = Dataset(
-                training_set, transform_for_training(model_class.IMAGE_SHAPE))
-    validation_dataset = Dataset(
-            validation_set, transform_for_infer(model_class.IMAGE_SHAPE))
-
-    training_dataloader = torch.utils.data.DataLoader(
-            training_dataset,
+
+    whole_set, num_classes = load_training_set(args, model_class)
+    model = model_class(
+        num_classes, sampled_classes=args.sampled_classes).to(device)
+    if args.warm_start:
+        warm_start(model, args.warm_start)
+    if args.frozen_backbone:
+        # the samples become rows of the backbone feature cache
+        model.freeze_backbone()
+        whole_set, feature_size = cache_backbone_features(
+            args, model, model_class, whole_set)
+
+    # fold yields (validation, training) splits, --fold picks the one of
+    # a cross validation, see crossval.py
+    validation_set, training_set = next(itertools.islice(
+        fold(NUM_FOLDS, whole_set), args.fold, None))
+    # the workers only resize (and flip) uint8 images, the batches are
+    # normalized in one go by BatchCollate
+    if args.frozen_backbone:
+        training_dataset = FeatureCacheDataset(
+                training_set, args.frozen_backbone, feature_size)
+        validation_dataset = FeatureCacheDataset(
+                validation_set, args.frozen_backbone, feature_size)
+    elif args.shard:
+        image_shape = model_class.IMAGE_SHAPE + (3,)
+        training_dataset = ShardDataset(
+                training_set, args.shard, image_shape,
+                transform_for_loading(model_class.IMAGE_SHAPE, flip=True))
+        validation_dataset = ShardDataset(
+                validation_set, args.shard, image_shape,
+                transform_for_loading(model_class.IMAGE_SHAPE))
+    else:
+        loader = ReducedImageLoader(model_class.IMAGE_SHAPE)
+        training_dataset = Dataset(
+                    training_set,
+                    transform_for_loading(model_class.IMAGE_SHAPE, flip=True),
+                    loader=loader)
+        validation_dataset = Dataset(
+                validation_set,
+                transform_for_loading(model_class.IMAGE_SHAPE),
+                loader=loader)
+
+    # seeded per-sample augmentation makes a run resumable mid-epoch
+    sampler_seed = args.seed if args.seed is not None else \
+        random.randrange(2 ** 31)
+    # in a distributed run every process gets its share of the samples,
+    # see distributed.py
+    rank, world_size = get_rank(), get_world_size()
+    # the names are not needed for training, the workers stay alive between
+    # the epochs and phases, and the next batch is copied to the device
+    # while the current one runs
+    training_dataloader = DevicePrefetcher(torch.utils.data.DataLoader(
+            SeededDataset(training_dataset),
             batch_size=args.batch_size,
             num_workers=args.num_workers,
-            shuffle=True
-       )
-
-    validation_dataloader = torch.utils.data.DataLoader(
-            validation_dataset,
+            sampler=ResumableSampler(
+                training_dataset, shuffle=True, seed=sampler_seed,
+                num_replicas=world_size, rank=rank),
+            collate_fn=BatchCollate(BatchTransform(), fields=(0, 1)),
+            pin_memory=device == 'cuda',
+            persistent_workers=args.num_workers > 0
+       ))
+
+    validation_dataloader = DevicePrefetcher(torch.utils.data.DataLoader(
+            SeededDataset(validation_dataset),
             batch_size=args.batch_size,
             num_workers=args.num_workers,
-            shuffle=False
-       )
-
-    model = model_class(num_classes).to(device)
-
+            # not padded, every image is scored once, as in one process
+            sampler=ResumableSampler(
+                validation_dataset, shuffle=False, seed=sampler_seed,
+                num_replicas=world_size, rank=rank, pad=False),
+            collate_fn=BatchCollate(BatchTransform(), fields=(0, 1)),
+            pin_memory=device == 'cuda',
+            persistent_workers=args.num_workers > 0
+       ))
+
+    # the sparse gradients of a sampled classifier only update the rows of
+    # the sampled classes, momentum and weight decay would touch every row
+    sparse = [model.classifier.weight] if args.sampled_classes else []
     trainables_wo_bn = [param for name, param in model.named_parameters() if
-                            param.requires_grad and 'bn' not in name]
+                            param.requires_grad and 'bn' not in name and
+                            not any(param is other for other in sparse)]
     trainables_only_bn = [param for name, param in model.named_parameters() if
                               param.requires_grad and 'bn' in name]
 
     optimizer = torch.optim.SGD([
             {'params': trainables_wo_bn, 'weight_decay': 0.0001},
             {'params': trainables_only_bn}
-        ], lr=args.lr, momentum=0.9)
+        ] + ([{'params': sparse, 'momentum': 0}] if sparse else []),
+        lr=args.lr, momentum=0.9)
 
+    # the centers are kept in sync by the Trainer's center update, they
+    # need no broadcast before every forward
+    trainer_model = torch.nn.parallel.DistributedDataParallel(
+        model, broadcast_buffers=False) if world_size > 1 else model
 
     trainer = Trainer(group_flie,
             optimizer,
-            model,
+            trainer_model,
             training_dataloader,
             validation_dataloader,
             max_epoch=args.epochs,
             resume=args.resume,
-            log_dir=log_dir
+            log_dir=log_dir,
+            log_interval=args.log_interval,
+            keep_last=args.keep_last,
+            keep_best=args.keep_best,
+            snapshot_interval=args.snapshot_interval,
+            lamda=args.lamda,
+            alpha=args.alpha,
+            profiler=StepProfiler(
+                args.profile, args.profile_steps, args.profile_trace)
+            if args.profile and rank == 0 else None,
+            events=None if rank else args.events if args.events else
+            os.path.join(log_dir, '{}.events.jsonl'.format(group_flie)),
+            epoch_callback=epoch_callback
         )
 
     trainer.train(group_flie)
+    return model
+
+
+def warm_start(model, path):
+    # weights of a checkpoint, e.g. of a frozen backbone run, to fine-tune
+    # from. Unlike --resume the epochs and the optimizer start over, and
+    # tensors whose shape differs, e.g. another class count, are skipped.
+    state_dict = model.state_dict()
+    checkpoint = torch.load(path, map_location=device, weights_only=False)
+    loaded = {name: tensor for name, tensor in
+              checkpoint['state_dict'].items()
+              if name in state_dict and tensor.shape == state_dict[name].shape}
+    model.load_state_dict(loaded, strict=False)
+    skipped = sorted(set(state_dict) - set(loaded))
+    print('warm started from {}{}'.format(
+        path, ', skipped ' + ', '.join(skipped) if skipped else ''))
+
+
+def cache_backbone_features(args, model, model_class, whole_set):
+    # the (row, class, name) samples of the backbone feature cache and its
+    # feature size, the cache is built once per images and backbone weights
+    signature = backbone_signature(model, [item[0] for item in whole_set])
+    cache = load_feature_cache(args.frozen_backbone, signature)
+    if cache is not None:
+        return cache
+
+    print('caching the backbone features of {} images in {}'.format(
+        len(whole_set), args.frozen_backbone))
+    transform = transform_for_loading(model_class.IMAGE_SHAPE)
+    if args.shard:
+        dataset = ShardDataset(whole_set, args.shard,
+                               model_class.IMAGE_SHAPE + (3,), transform)
+    else:
+        dataset = Dataset(whole_set, transform, loader=ReducedImageLoader(
+            model_class.IMAGE_SHAPE))
+    build_feature_cache(
+        model, dataset, args.frozen_backbone, signature,
+        batch_size=args.batch_size, num_workers=args.num_workers)
+    return load_feature_cache(args.frozen_backbone)
+
+
+def prepare_race_evaluation(args, model_class, race):
+    dataset_dir = get_dataset_dir_eve(args, race)
+    pairs_path =os.path.join('/cmlscratch' , 'dtinubu' , 'datasets' , 'RFW' , 'eve_set' , 'test', 'txts', race , args.pairs)
+
+    transform = transform_for_infer(model_class.IMAGE_SHAPE)
+    dataset = LFWPairedDataset(dataset_dir, pairs_path, transform)
+
+    # pairs share most of their images, embed each image only once
+    image_paths, indices_a, indices_b = dataset.unique_images()
+    dataloader = DataLoader(
+        ImageDataset(image_paths,
+                     transform_for_loading(model_class.IMAGE_SHAPE),
+                     loader=ReducedImageLoader(model_class.IMAGE_SHAPE)),
+        batch_size=args.batch_size, num_workers=args.num_workers,
+        collate_fn=BatchCollate(BatchTransform(flip_tta=args.flip_tta)))
+
+    # creating the iterator starts the workers, so the images of this race
+    # are already being decoded while the previous race runs on the model
+    return {
+        'race': race,
+        'dataset': dataset,
+        'num_images': len(image_paths),
+        'indices_a': indices_a,
+        'indices_b': indices_b,
+        'batches': iter(dataloader)
+    }
+
+
+def evaluate_race(args, model, evaluation):
+    dataset = evaluation['dataset']
+    embedings = embed_images(
+        model, evaluation['batches'], evaluation['num_images'],
+        model.FEATURE_DIM, flip_tta=args.flip_tta)
+
+    accumulator = RocAccumulator()
+    distances = []
+    matches = []
+    start = 0
+    for batched_distances in pair_distances(
+            embedings, evaluation['indices_a'], evaluation['indices_b']):
+        end = start + len(batched_distances)
+        batched_matches = torch.tensor(dataset.matches[start:end])
+        start = end
+        accumulator.update(batched_distances, batched_matches)
+
+        # the k-fold accuracy needs every distance, the streaming
+        # metrics only need the histograms
+        if not args.stream_metrics:
+            distances.append(batched_distances)
+            matches.append(batched_matches)
+
+    result = accumulator.summary(args.far)
+
+    if args.stream_metrics:
+        result['fpr'], result['tpr'] = accumulator.roc()
+    else:
+        thresholds = np.arange(0, 4, 0.1)
+        result['tpr'], result['fpr'], result['accuracy'], _ = compute_roc(
+            torch.cat(distances),
+            torch.cat(matches),
+            thresholds
+        )
+
+    return result
 
 
 def evaluate(args):
-    dataset_dir = get_dataset_dir_eve(args)
     log_dir = get_log_dir(args)
     model_class = get_model_class(args)
-    
-    pairs_path =os.path.join('/cmlscratch' , 'dtinubu' , 'datasets' , 'RFW' , 'eve_set' , 'test', 'txts', args.race , args.pairs)
-        
-    dataset = LFWPairedDataset(
-        dataset_dir, pairs_path,transform_for_infer(model_class.IMAGE_SHAPE))
-    dataloader = DataLoader(dataset, batch_size=args.batch_size, num_workers=args.num_workers)
-    model = model_class(False).to(device)
-
-    checkpoint = torch.load(args.evaluate)
-    model.load_state_dict(checkpoint['state_dict'], strict=False)
-    model.eval()
-
-    embedings_a = torch.zeros(len(dataset), model.FEATURE_DIM)
-    embedings_b = torch.zeros(len(dataset), model.FEATURE_DIM)
-    matches = torch.zeros(len(dataset), dtype=torch.uint8)
-
-    for iteration, (images_a, images_b, batched_matches) \
-            in enumerate(dataloader):
-        current_batch_size = len(batched_matches)
-        images_a = images_a.to(device)
-        images_b = images_b.to(device)
-
-        _, batched_embedings_a = model(images_a)
-        _, batched_embedings_b = model(images_b)
+    races = get_races(args)
 
-        start = args.batch_size * iteration
-        end = start + current_batch_size
+    model = load_model(model_class, args.evaluate)
 
-        embedings_a[start:end, :] = batched_embedings_a.data
-        embedings_b[start:end, :] = batched_embedings_b.data
-        matches[start:end] = batched_matches.data
-
-    thresholds = np.arange(0, 4, 0.1)
-    distances = torch.sum(torch.pow(embedings_a - embedings_b, 2), dim=1)
-
-    tpr, fpr, accuracy, best_thresholds = compute_roc(
-        distances,
-        matches,
-        thresholds
-    )
+    results = {}
+    evaluation = prepare_race_evaluation(args, model_class, races[0])
+    for index, race in enumerate(races):
+        next_evaluation = prepare_race_evaluation(
+            args, model_class, races[index + 1]) \
+            if index + 1 < len(races) else None
+        results[race] = evaluate_race(args, model, evaluation)
+        evaluation = next_evaluation
 
     roc_file = args.roc if args.roc else os.path.join(log_dir, 'roc.png')
-    generate_roc_curve(fpr, tpr, roc_file)
-    print('Model accuracy is {}'.format(accuracy))
+    if len(races) == 1:
+        generate_roc_curve(
+            results[race]['fpr'], results[race]['tpr'], roc_file)
+    else:
+        generate_roc_curves(
+            {race: (result['fpr'], result['tpr'])
+             for race, result in results.items()}, roc_file)
+
+    for race, result in results.items():
+        if len(races) > 1:
+            print('[{}]'.format(race))
+        print('Model accuracy is {}'.format(result['accuracy']))
+        for far, (tar, threshold, tar_upper_bound) in \
+                result['tar_at_far'].items():
+            print('TAR@FAR={:g}: {:.6f} (<= {:.6f}) at threshold '
+                  '{:.6f}'.format(far, tar, tar_upper_bound, threshold))
+        print('EER: {:.6f} at threshold {:.6f}'.format(
+            result['eer'], result['eer_threshold']))
+        print('AUC: {:.6f}'.format(result['auc']))
+
+    if len(races) > 1:
+        accuracies = np.array(
+            [result['accuracy'] for result in results.values()])
+        print('Bias gap: {:.6f} accuracy between best and worst race, '
+              'std {:.6f}'.format(
+                  accuracies.max() - accuracies.min(), accuracies.std()))
     print('ROC curve generated at {}'.format(roc_file))
 
+    if args.report:
+        report = {race: {key: value for key, value in result.items()
+                         if key not in ('fpr', 'tpr')}
+                  for race, result in results.items()}
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('Report written to {}'.format(args.report))
+
 
 def verify(args):
-    dataset_dir = get_dataset_dir(args)
-    log_dir = get_log_dir(args)
     model_class = get_model_class(args)
 
-    model = model_class(False).to(device)
-    checkpoint = torch.load(args.verify_model)
-    model.load_state_dict(checkpoint['state_dict'], strict=False)
-    model.eval()
+    model = load_model(model_class, args.verify_model)
+
+    if args.verify_pairs:
+        return verify_pair_file(args, model, model_class)
 
     image_a, image_b = args.verify_images.split(',')
     image_a = transform_for_infer(
@@ -205,8 +461,146 @@ def verify(args):
     print("distance: {}".format(distance))
 
 
-if __name__ == '__main__':
+def verify_pair_file(args, model, model_class):
+    # results are appended, a rerun with the same output skips the pairs it
+    # already holds
+    skip = count_written_pairs(args.verify_output) \
+        if args.verify_output else 0
+    input_file = sys.stdin if args.verify_pairs == '-' else \
+        open(args.verify_pairs, 'r')
+    output_file = open(args.verify_output, 'a') if args.verify_output \
+        else sys.stdout
+    try:
+        pairs = itertools.islice(read_pairs(input_file), skip, None)
+        written = verify_pairs(
+            model, transform_for_infer(model_class.IMAGE_SHAPE), pairs,
+            output_file, args.threshold, args.batch_size, args.num_workers)
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+    if args.verify_output:
+        print('verified {} pairs ({} skipped) into {}'.format(
+            written, skip, args.verify_output), file=sys.stderr)
+
+
+def identify(args):
+    model_class = get_model_class(args)
+    transform = transform_for_infer(model_class.IMAGE_SHAPE)
+
+    model = load_model(model_class, args.identify)
+
+    if os.path.isdir(args.gallery):
+        gallery = Gallery.from_directory(
+            model, args.gallery, transform, args.batch_size,
+            args.num_workers)
+        if args.ivf_lists:
+            gallery.build_index(args.ivf_lists)
+        if args.gallery_cache:
+            gallery.save(args.gallery_cache)
+            print('gallery saved to {}'.format(args.gallery_cache))
+    else:
+        gallery = Gallery.load(args.gallery)
+
+    probes = args.probes.split(',')
+    images = torch.stack([
+        transform(image_loader(probe)) for probe in probes]).to(device)
+    with torch.no_grad():
+        _, queries = model(images)
+
+    num_probes = args.ivf_probes if gallery.index is not None else None
+    results = gallery.identify(queries.cpu(), args.top_k,
+                               num_probes=num_probes)
+    for probe, matches in zip(probes, results):
+        print(probe)
+        for rank, (identity, distance, image_path) in enumerate(matches):
+            print("  {}. {} distance: {} ({})".format(
+                rank + 1, identity, distance, image_path))
+
+
+def serve(args):
+    model_class = get_model_class(args)
 
+    model = load_model(model_class, args.serve)
+
+    server = EmbeddingServer(
+        model, transform_for_infer(model_class.IMAGE_SHAPE),
+        (args.host, args.port), max_batch_size=args.batch_size,
+        max_latency=args.max_latency_ms / 1000.0)
+    print('serving {} on http://{}:{}'.format(
+        args.serve, *server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def export(args):
+    if args.export_format == 'onnx' and args.quantize != 'none':
+        raise ValueError('only float models are exported to onnx, '
+                         'quantize them in the onnx runtime')
+    # exported models are meant for CPU serving, everything runs there
+    model_class = get_model_class(args)
+    race = get_races(args)[0]
+    model = load_model(model_class, args.export).cpu()
+    example_inputs = (torch.zeros(1, 3, *model_class.IMAGE_SHAPE),)
+
+    meta = {
+        'arch': args.arch,
+        'feature_dim': model_class.FEATURE_DIM,
+        'image_shape': list(model_class.IMAGE_SHAPE),
+        'quantize': args.quantize
+    }
+
+    inference_model = InferenceModel(model)
+    if args.quantize == 'dynamic':
+        inference_model = quantize_dynamic(inference_model)
+    elif args.quantize == 'static':
+        calibration = prepare_race_evaluation(args, model_class, race)
+        inference_model = quantize_static(
+            inference_model, itertools.islice(
+                calibration['batches'], args.calibration_batches),
+            example_inputs)
+
+    output = args.export_output
+    if not output:
+        name = args.export[:-len('.pth.tar')] \
+            if args.export.endswith('.pth.tar') \
+            else os.path.splitext(args.export)[0]
+        output = '{}.{}'.format(
+            name, 'onnx' if args.export_format == 'onnx' else 'pt')
+    if args.export_format == 'onnx':
+        save_onnx(inference_model, example_inputs, output)
+        # the onnx graph is the traced inference model, measure that one
+        exported = ExportedModel(inference_model, meta)
+    else:
+        save_torchscript(inference_model, example_inputs, output, meta)
+        exported = load_exported(output)
+    print('exported {} to {}'.format(args.export, output))
+
+    results = {}
+    for name, candidate in (('checkpoint', ExportedModel(model, meta)),
+                            ('exported', exported)):
+        result = evaluate_race(
+            args, candidate, prepare_race_evaluation(args, model_class, race))
+        latencies = [
+            measure_latency(candidate, torch.randn(
+                batch_size, 3, *model_class.IMAGE_SHAPE)) / batch_size
+            for batch_size in (1, args.batch_size)]
+        results[name] = result
+        print('{}: accuracy {:.6f}, EER {:.6f}, {:.2f} ms/image at batch '
+              'size 1, {:.2f} ms/image at batch size {}'.format(
+                  name, result['accuracy'], result['eer'],
+                  latencies[0] * 1000, latencies[1] * 1000, args.batch_size))
+    print('accuracy delta on {}: {:+.6f}'.format(
+        race, results['exported']['accuracy'] -
+        results['checkpoint']['accuracy']))
+
+
+def get_parser():
     parser = argparse.ArgumentParser(description='center loss example')
     parser.add_argument('--batch_size', type=int, default=256, metavar='N',
                         help='input batch size for training (default: 256)')
@@ -214,16 +608,63 @@ if __name__ == '__main__':
                         help='log directory')
     parser.add_argument('--epochs', type=int, default=100, metavar='N',
                         help='number of epochs to train (default: 100)')
+    parser.add_argument('--log_interval', type=int, default=10, metavar='N',
+                        help='batches between training log lines '
+                             '(default: 10)')
     parser.add_argument('--lr', type=float, default=0.001,
                         help='learning rate (default: 0.001)')
+    parser.add_argument('--lamda', type=float, default=0.03,
+                        help='weight of the center loss (default: 0.03)')
+    parser.add_argument('--alpha', type=float, default=0.5,
+                        help='learning rate of the centers (default: 0.5)')
     parser.add_argument('--arch', type=str, default='resnet50',
                         help='network arch to use, support resnet18 and '
                              'resnet50 (default: resnet50)')
     parser.add_argument('--resume', type=str,
                         help='model path to the resume training',
                         default=False)
+    parser.add_argument('--sampled_classes', type=int, metavar='N',
+                        help='softmax over the classes of a batch and '
+                             'sampled negatives, N classes in total, '
+                             'instead of all of them')
+    parser.add_argument('--fold', type=int, default=0,
+                        choices=range(NUM_FOLDS), metavar='K',
+                        help='validate on fold K of {} and train on the '
+                             'others (default: 0)'.format(NUM_FOLDS))
+    parser.add_argument('--frozen_backbone', type=str, metavar='CACHE',
+                        help='train only the head, the centers and the loss '
+                             'on backbone features cached in this file, '
+                             'built on the first run')
+    parser.add_argument('--warm_start', type=str,
+                        help='checkpoint to start training from, e.g. of a '
+                             '--frozen_backbone run, with fresh epochs and '
+                             'optimizer')
+    parser.add_argument('--keep_last', type=int, metavar='N',
+                        help='only keep the newest N checkpoints')
+    parser.add_argument('--keep_best', action='store_true',
+                        help='never remove the checkpoint with the lowest '
+                             'validation loss')
+    parser.add_argument('--snapshot_interval', type=int, metavar='N',
+                        help='write a resumable snapshot every N training '
+                             'batches, resume it with --resume '
+                             '<save_file_name>/snapshot.pth.tar')
+    parser.add_argument('--events', type=str,
+                        help='JSONL file the training progress is appended '
+                             'to (default: $LOG_DIR/<save_file_name>'
+                             '.events.jsonl), summarized by grap.py')
+    parser.add_argument('--profile', type=str,
+                        help='time every training and validation step, per '
+                             'phase, into this JSONL file')
+    parser.add_argument('--profile_steps', type=int, nargs=2,
+                        metavar=('FIRST', 'LAST'),
+                        help='with --profile, also record these training '
+                             'steps with torch.profiler')
+    parser.add_argument('--profile_trace', type=str,
+                        help='chrome trace of --profile_steps '
+                             '(default: <profile>.trace.json)')
     parser.add_argument('--dataset_dir', type=str,
-                        help='directory with lfw dataset'
+                        help='directory with lfw dataset, or an '
+                             'uncompressed tar or zip archive of it'
                              ' (default: $HOME/datasets/lfw)')
     parser.add_argument('--weights', type=str,
                         help='pretrained weights to load '
@@ -236,12 +677,32 @@ if __name__ == '__main__':
     parser.add_argument('--roc', type=str,
                         help='path of roc.png to generated '
                              '(default: $DATASET_DIR/roc.png)')
+    parser.add_argument('--stream_metrics', action='store_true',
+                        help='only keep distance histograms during '
+                             'evaluation, for pair lists too large for RAM')
+    parser.add_argument('--flip_tta', action='store_true',
+                        help='evaluate on the mean embedding of every '
+                             'image and its mirror')
+    parser.add_argument('--far', type=float, nargs='+',
+                        default=[1e-3, 1e-4, 1e-5, 1e-6],
+                        help='FAR operating points to report TAR at '
+                             '(default: 1e-3 1e-4 1e-5 1e-6)')
     parser.add_argument('--verify-model', type=str,
                         help='verify 2 images of face belong to one person,'
                              'the param is the model to use')
     parser.add_argument('--verify-images', type=str,
                         help='verify 2 images of face belong to one person,'
                              'split image pathes by comma')
+    parser.add_argument('--verify-pairs', type=str,
+                        help='file with one pair of images per line, or - '
+                             'for stdin, to verify with --verify-model')
+    parser.add_argument('--verify-output', type=str,
+                        help='tab separated image_a, image_b, distance and '
+                             'match per pair, resumed if it already exists '
+                             '(default: stdout)')
+    parser.add_argument('--threshold', type=float, default=1.1,
+                        help='pairs closer than this are a match '
+                             '(default: 1.1)')
     parser.add_argument('--af', type=int,default=0,
                         help='how many blacks you want')
     parser.add_argument('--sa', type=int,default=0,
@@ -255,13 +716,71 @@ if __name__ == '__main__':
     parser.add_argument('--num_workers',default = 6,type=int,
                         help= 'workers')
     parser.add_argument('--race',type=str,
-                        help= 'Black,White,south asain, asian')
+                        help= 'race to evaluate on, a comma separated list '
+                              'of races or all')
+    parser.add_argument('--report', type=str,
+                        help='path of a json report of the evaluation')
+    parser.add_argument('--seed', type=int,
+                        help='seed for selecting the people of each race')
+    parser.add_argument('--refresh_manifest', action='store_true',
+                        help='check every person directory for changes '
+                             'instead of trusting the cached manifest')
+    parser.add_argument('--shard', type=str,
+                        help='packed image shard to train from, created from '
+                             'the selected images if it does not exist')
     parser.add_argument('--num_samples',default = 6,type=int,
                         help= 'samples')
-    
- 
-                   
-                             
+    parser.add_argument('--identify', type=str,
+                        help='find the closest gallery identities of the '
+                             '--probes images, the param is the model to use')
+    parser.add_argument('--gallery', type=str,
+                        help='directory with one sub directory of images '
+                             'per identity, or a saved gallery')
+    parser.add_argument('--gallery_cache', type=str,
+                        help='save the gallery built from a directory here')
+    parser.add_argument('--probes', type=str,
+                        help='images to identify, split image pathes by comma')
+    parser.add_argument('--top_k', type=int, default=5,
+                        help='identities to report per probe (default: 5)')
+    parser.add_argument('--ivf_lists', type=int, default=0,
+                        help='cluster the gallery into N lists for '
+                             'approximate search (default: 0, exact)')
+    parser.add_argument('--ivf_probes', type=int, default=8,
+                        help='lists searched per probe with an approximate '
+                             'index (default: 8)')
+    parser.add_argument('--serve', type=str,
+                        help='serve embed/verify requests over http, the '
+                             'param is the model to use, --batch_size is '
+                             'the largest batch requests are merged into')
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='address to serve on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='port to serve on (default: 8000)')
+    parser.add_argument('--max_latency_ms', type=float, default=5,
+                        help='longest a request waits for its batch to fill '
+                             '(default: 5)')
+    parser.add_argument('--export', type=str,
+                        help='checkpoint to export as an inference model, '
+                             'the accuracy and latency are compared on '
+                             'the pairs of the first --race')
+    parser.add_argument('--export_output', type=str,
+                        help='path of the exported model '
+                             '(default: next to the checkpoint)')
+    parser.add_argument('--export_format', type=str,
+                        default='torchscript', choices=EXPORT_FORMATS,
+                        help='format of the exported model '
+                             '(default: torchscript)')
+    parser.add_argument('--quantize', type=str, default='none',
+                        choices=QUANTIZATIONS,
+                        help='int8 quantization of the exported model, '
+                             'dynamic for the Linear layers only, static '
+                             'for the whole network (default: none)')
+    parser.add_argument('--calibration_batches', type=int, default=10,
+                        help='batches of pairs images observed for static '
+                             'quantization (default: 10)')
+
+    return parser
+
 
-    args = parser.parse_args()
-    main(args)
+if __name__ == '__main__':
+    main(get_parser().parse_args())
@@ -0,0 +1,107 @@
+import os
+import json
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from archive import split_archive_path, list_people
+
+
+MANIFEST_VERSION = 1
+
+
+def manifest_path(dataroot, race):
+    # kept next to the race directory, not inside it, so writing the
+    # manifest does not change the mtime it is validated against
+    return os.path.join(dataroot, '{}.manifest.json'.format(race))
+
+
+def _scan_person(person_dir):
+    images = []
+    with os.scandir(person_dir) as entries:
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                images.append([entry.name, stat.st_size, stat.st_mtime_ns])
+    images.sort()
+    return images
+
+
+def _refresh_person(images_root, name, cached, verify):
+    person_dir = os.path.join(images_root, name)
+    if cached is not None and not verify:
+        return cached
+    mtime = os.stat(person_dir).st_mtime_ns
+    if cached is not None and cached['mtime'] == mtime:
+        return cached
+    return {'mtime': mtime, 'images': _scan_person(person_dir)}
+
+
+def _read_manifest(manifest_file):
+    try:
+        with open(manifest_file, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def _write_manifest(manifest_file, manifest):
+    temp_file = '{}.{}.tmp'.format(manifest_file, os.getpid())
+    try:
+        with open(temp_file, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(temp_file, manifest_file)
+    except OSError:
+        # a read-only dataset still works, it is just listed every run
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+
+def load_manifest(images_root, manifest_file, verify=False, workers=32):
+    # returns {person name: {'mtime': ..., 'images': [(image, size, mtime)]}}.
+    # When the race directory itself is unchanged the cached manifest is
+    # served as is. Otherwise only new person directories are scanned, and
+    # with verify=True every person directory is stat-ed and rescanned if
+    # its mtime changed. Inside an archive the listing comes from its
+    # index, there is nothing to cache.
+    if split_archive_path(images_root) is not None:
+        return list_people(images_root)
+
+    root_mtime = os.stat(images_root).st_mtime_ns
+    manifest = _read_manifest(manifest_file)
+    if manifest is not None and manifest['mtime'] == root_mtime \
+            and not verify:
+        return manifest['people']
+
+    cached_people = manifest['people'] if manifest is not None else {}
+    with os.scandir(images_root) as entries:
+        names = [entry.name for entry in entries if entry.is_dir()]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        refreshed = executor.map(
+            lambda name: _refresh_person(
+                images_root, name, cached_people.get(name), verify),
+            names)
+        people = dict(zip(names, refreshed))
+
+    if manifest is None or manifest['mtime'] != root_mtime or \
+            people != cached_people:
+        _write_manifest(manifest_file, {
+            'version': MANIFEST_VERSION,
+            'mtime': root_mtime,
+            'people': people
+        })
+    return people
+
+
+def select_people(people, number_of_people, seed=None):
+    # a given seed always picks the same people, whatever order the
+    # filesystem lists them in
+    names = sorted(people)
+    if seed is None:
+        random.shuffle(names)
+    else:
+        random.Random(seed).shuffle(names)
+    return names[:number_of_people]
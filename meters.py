@@ -0,0 +1,69 @@
+import torch
+
+
+class LossMeter(object):
+    # Accumulates detached per-batch losses and top-k match counts on the
+    # device they were computed on. Nothing is copied to the host until the
+    # averages are read, so reading only every few batches keeps the
+    # training loop free of syncs.
+
+    FIELDS = ('cross_entropy', 'center', 'together', 'top1', 'top3')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.sums = None
+        self.batches = 0
+        self.samples = 0
+
+    def update(self, batch_size, cross_entropy, center, together, top1,
+               top3):
+        values = torch.stack([
+            cross_entropy.detach().float(), center.detach().float(),
+            together.detach().float(), top1.float(), top3.float()])
+        self.sums = values if self.sums is None else self.sums + values
+        self.batches += 1
+        self.samples += batch_size
+
+    def read(self):
+        # the only host sync: losses are averaged per batch, accuracies per
+        # sample, like the epoch records always were
+        if self.sums is None:
+            return {field: 0.0 for field in self.FIELDS}
+        sums = self.sums.tolist()
+        values = dict(zip(self.FIELDS, sums))
+        for field in ('cross_entropy', 'center', 'together'):
+            values[field] /= self.batches
+        for field in ('top1', 'top3'):
+            values[field] /= self.samples
+        return values
+
+
+    def all_reduce(self):
+        # sums over the processes of a distributed run, see distributed.py
+        import torch.distributed as dist
+
+        sums = self.sums if self.sums is not None else \
+            torch.zeros(len(self.FIELDS))
+        values = torch.cat([sums.double(), torch.tensor(
+            [self.batches, self.samples], dtype=torch.float64,
+            device=sums.device)])
+        dist.all_reduce(values)
+        self.sums = values[:len(self.FIELDS)].float()
+        self.batches = int(values[-2].item())
+        self.samples = int(values[-1].item())
+
+    def state_dict(self):
+        return {
+            'sums': None if self.sums is None else self.sums.cpu(),
+            'batches': self.batches,
+            'samples': self.samples
+        }
+
+    def load_state_dict(self, state, device=None):
+        self.sums = state['sums']
+        if self.sums is not None and device is not None:
+            self.sums = self.sums.to(device)
+        self.batches = state['batches']
+        self.samples = state['samples']
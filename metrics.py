@@ -1,24 +1,44 @@
-from sklearn.model_selection import KFold
 import numpy as np
 import torch
 
 
-def select_threshold(distances, matches, thresholds):
-    best_threshold_true_predicts = 0
-    best_threshold = 0
-    for threshold in thresholds:
-        true_predicts = torch.sum((
-            distances < threshold
-        ) == matches)
+def _confusion_counts(distances, matches, thresholds):
+    # sort once, then every threshold is a searchsorted + cumulative sum
+    # lookup instead of a full pass over the distances
+    distances = torch.as_tensor(distances).flatten()
+    matches = torch.as_tensor(matches).flatten().bool()
+    thresholds = torch.as_tensor(np.asarray(thresholds)).to(
+        device=distances.device, dtype=distances.dtype)
+
+    sorted_distances, order = torch.sort(distances)
+    matches_cumsum = torch.cumsum(matches[order].long(), dim=0)
+    matches_cumsum = torch.cat(
+        [matches_cumsum.new_zeros(1), matches_cumsum])
+
+    # number of pairs predicted as a match, i.e. distance < threshold
+    predicted = torch.searchsorted(sorted_distances, thresholds, right=False)
+    positives = matches_cumsum[-1]
+    negatives = len(distances) - positives
 
-        if true_predicts > best_threshold_true_predicts:
-            best_threshold_true_predicts = true_predicts
-            best_threshold = threshold
+    tp = matches_cumsum[predicted]
+    fp = predicted - tp
+    fn = positives - tp
+    tn = negatives - fp
+    return tp, fp, tn, fn
 
-    return best_threshold
+
+def select_threshold(distances, matches, thresholds):
+    tp, fp, tn, fn = _confusion_counts(distances, matches, thresholds)
+    true_predicts = tp + tn
+    best_index = torch.argmax(true_predicts).item()
+    if true_predicts[best_index] == 0:
+        return 0
+    return thresholds[best_index]
 
 
 def compute_roc(distances, matches, thresholds, fold_size=10):
+    from sklearn.model_selection import KFold
+
     assert(len(distances) == len(matches))
 
     kf = KFold(n_splits=fold_size, shuffle=False)
@@ -31,36 +51,22 @@ def compute_roc(distances, matches, thresholds, fold_size=10):
     for fold_index, (training_indices, val_indices) \
             in enumerate(kf.split(range(len(distances)))):
 
-        training_distances = distances[training_indices]
-        training_matches = matches[training_indices]
-
         # 1. find the best threshold for this fold using training set
-        best_threshold_true_predicts = 0
-        for threshold_index, threshold in enumerate(thresholds):
-            true_predicts = torch.sum((
-                training_distances < threshold
-            ) == training_matches)
-
-            if true_predicts > best_threshold_true_predicts:
-                best_threshold = threshold
-                best_threshold_true_predicts = true_predicts
+        tp, fp, tn, fn = _confusion_counts(
+            distances[training_indices], matches[training_indices],
+            thresholds)
+        true_predicts = tp + tn
+        best_index = torch.argmax(true_predicts).item()
+        best_threshold = thresholds[best_index]
 
         # 2. calculate tpr, fpr on validation set
-        val_distances = distances[val_indices]
-        val_matches = matches[val_indices]
-        for threshold_index, threshold in enumerate(thresholds):
-            predicts = val_distances < threshold
-
-            tp = torch.sum((1*predicts) & val_matches).item()
-            fp = torch.sum((1*predicts) & ~val_matches).item()
-            tn = torch.sum((1*~predicts) & ~val_matches).item()
-            fn = torch.sum((1*~predicts) & val_matches).item()
-
-            tpr[fold_index][threshold_index] = float(tp) / (tp + fn)
-            fpr[fold_index][threshold_index] = float(fp) / (fp + tn)
+        tp, fp, tn, fn = _confusion_counts(
+            distances[val_indices], matches[val_indices], thresholds)
+        tpr[fold_index] = (tp.double() / (tp + fn).double()).float()
+        fpr[fold_index] = (fp.double() / (fp + tn).double()).float()
 
         best_thresholds.append(best_threshold)
-        accuracy[fold_index] = best_threshold_true_predicts.item() / float(
+        accuracy[fold_index] = true_predicts[best_index].item() / float(
             len(training_indices))
 
     # average fold
@@ -69,3 +75,121 @@ def compute_roc(distances, matches, thresholds, fold_size=10):
     accuracy = torch.mean(accuracy, dim=0).item()
 
     return tpr, fpr, accuracy, best_thresholds
+
+
+class RocAccumulator(object):
+    # Streaming ROC over an unbounded number of pairs. Distances are binned
+    # into genuine/impostor histograms over [0, max_distance), so memory is
+    # fixed by the bin count. Every metric is exact for thresholds on a bin
+    # edge; the resolution of the threshold grid is max_distance / bins.
+
+    def __init__(self, bins=2 ** 20, max_distance=4.0):
+        self.bins = bins
+        self.max_distance = max_distance
+        self.resolution = max_distance / bins
+        # the last bin collects every distance >= max_distance
+        self.genuine = torch.zeros(bins + 1, dtype=torch.long)
+        self.impostor = torch.zeros(bins + 1, dtype=torch.long)
+
+    def update(self, distances, matches):
+        distances = torch.as_tensor(distances).detach().flatten().cpu()
+        matches = torch.as_tensor(matches).detach().flatten().cpu().bool()
+        assert(len(distances) == len(matches))
+
+        indices = torch.floor(distances.double() / self.resolution) \
+            .long().clamp_(0, self.bins)
+        self.genuine += torch.bincount(
+            indices[matches], minlength=self.bins + 1)
+        self.impostor += torch.bincount(
+            indices[~matches], minlength=self.bins + 1)
+
+    def merge(self, other):
+        assert(self.bins == other.bins and
+               self.max_distance == other.max_distance)
+        self.genuine += other.genuine
+        self.impostor += other.impostor
+        return self
+
+    @property
+    def num_pairs(self):
+        return self.genuine.sum().item() + self.impostor.sum().item()
+
+    def _rates(self):
+        # threshold k * resolution accepts bins [0, k), k = 0 .. bins + 1
+        zero = torch.zeros(1, dtype=torch.long)
+        tp = torch.cat([zero, torch.cumsum(self.genuine, dim=0)])
+        fp = torch.cat([zero, torch.cumsum(self.impostor, dim=0)])
+        tar = tp.double() / max(tp[-1].item(), 1)
+        far = fp.double() / max(fp[-1].item(), 1)
+        return tar, far
+
+    def _threshold(self, index):
+        if index > self.bins:
+            return float('inf')
+        return index * self.resolution
+
+    def tar_at_far(self, far_target):
+        # returns (tar, threshold, tar_upper_bound). tar is exact for the
+        # returned threshold; no threshold with FAR <= far_target can reach
+        # more than tar_upper_bound.
+        tar, far = self._rates()
+        index = torch.searchsorted(
+            far, torch.tensor([far_target], dtype=torch.double),
+            right=True).item() - 1
+        upper_bound = tar[min(index + 1, len(tar) - 1)].item()
+        return tar[index].item(), self._threshold(index), upper_bound
+
+    def eer(self):
+        tar, far = self._rates()
+        frr = 1 - tar
+        index = torch.nonzero(far >= frr)[0].item()
+        if index == 0:
+            return far[0].item(), self._threshold(0)
+
+        # linear interpolation between the two edges around the crossing
+        before = (frr[index - 1] - far[index - 1]).item()
+        after = (far[index] - frr[index]).item()
+        weight = before / (before + after) if before + after else 0.0
+        eer = far[index - 1].item() + weight * (
+            far[index].item() - far[index - 1].item())
+        threshold = min(
+            (index - 1 + weight) * self.resolution, self.max_distance)
+        return eer, threshold
+
+    def auc(self):
+        tar, far = self._rates()
+        return torch.trapezoid(tar, far).item()
+
+    def best_accuracy(self):
+        zero = torch.zeros(1, dtype=torch.long)
+        tp = torch.cat([zero, torch.cumsum(self.genuine, dim=0)])
+        fp = torch.cat([zero, torch.cumsum(self.impostor, dim=0)])
+        tn = fp[-1] - fp
+        true_predicts = tp + tn
+        index = torch.argmax(true_predicts).item()
+        return true_predicts[index].item() / float(
+            max(self.num_pairs, 1)), self._threshold(index)
+
+    def roc(self):
+        # only keep the edges where the curve actually moves
+        tar, far = self._rates()
+        occupied = torch.nonzero(self.genuine + self.impostor).flatten()
+        keep = torch.unique(torch.cat([
+            torch.tensor([0, len(tar) - 1]), occupied, occupied + 1]))
+        return far[keep].numpy(), tar[keep].numpy()
+
+    def summary(self, fars=(1e-3, 1e-4, 1e-5, 1e-6)):
+        accuracy, accuracy_threshold = self.best_accuracy()
+        eer, eer_threshold = self.eer()
+        result = {
+            'pairs': self.num_pairs,
+            'accuracy': accuracy,
+            'accuracy_threshold': accuracy_threshold,
+            'eer': eer,
+            'eer_threshold': eer_threshold,
+            'auc': self.auc(),
+            'tar_at_far': {}
+        }
+        for far in fars:
+            result['tar_at_far'][far] = self.tar_at_far(far)
+        return result
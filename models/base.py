@@ -1,17 +1,70 @@
+import math
+
 import torch
 from torch import nn
+from torch.nn import functional
 
 from device import device
 
 
 class FaceModel(nn.Module):
+    # The centers, like the sampled classifier's weights, are only ever
+    # indexed by the classes of a batch, see loss.update_centers_, so a
+    # step touches as many rows as the batch has classes.
 
-    def __init__(self, num_classes, feature_dim):
+    def __init__(self, num_classes, feature_dim, sampled_classes=None):
         super().__init__()
         self.num_classes = num_classes
         self.feature_dim = feature_dim
+        self.sampled_classes = sampled_classes
 
         if num_classes:
             self.register_buffer('centers', (
                 torch.rand(num_classes, feature_dim).to(device) - 0.5) * 2)
-            self.classifier = nn.Linear(self.feature_dim, num_classes)
+            if sampled_classes:
+                self.classifier = SampledClassifier(
+                    self.feature_dim, num_classes, sampled_classes)
+            else:
+                self.classifier = nn.Linear(self.feature_dim, num_classes)
+
+
+class SampledClassifier(nn.Embedding):
+    # Partial FC: the softmax of a training batch runs over its own classes
+    # and randomly drawn negatives, sampled_classes columns in total, so
+    # its cost does not grow with the number of classes. The columns are
+    # the batch's classes in ascending order, torch.unique(targets,
+    # return_inverse=True)[1] are the targets of the logits, followed by
+    # the negatives. The weights get sparse gradients of the sampled rows,
+    # which the optimizer must take without momentum and weight decay. An
+    # Embedding, so DDP expects the sparse gradients. Without targets the
+    # logits of every class are returned.
+
+    def __init__(self, feature_dim, num_classes, sampled_classes):
+        super().__init__(num_classes, feature_dim, sparse=True)
+        self.num_classes = num_classes
+        self.sampled_classes = sampled_classes
+        # the initialization of nn.Linear, without the bias
+        bound = 1 / math.sqrt(feature_dim)
+        with torch.no_grad():
+            self.weight.uniform_(-bound, bound)
+
+    def forward(self, features, targets=None):
+        if targets is None:
+            return features.matmul(self.weight.t())
+
+        positives = torch.unique(targets)
+        negatives = torch.randint(
+            self.num_classes,
+            (max(self.sampled_classes - len(positives), 0),),
+            device=targets.device)
+        weight = functional.embedding(
+            torch.cat([positives, negatives]), self.weight, sparse=self.sparse)
+        logits = features.matmul(weight.t())
+
+        # drawn with replacement, a negative may be one of the positives
+        collisions = (negatives.unsqueeze(1) == positives.unsqueeze(0)) \
+            .any(dim=1)
+        return torch.cat([
+            logits[:, :len(positives)],
+            logits[:, len(positives):].masked_fill(collisions, float('-inf'))
+        ], dim=1)
@@ -10,16 +10,23 @@ class ResnetFaceModel(FaceModel):
 
     IMAGE_SHAPE = (96, 128)
 
-    def __init__(self, num_classes, feature_dim):
-        super().__init__(num_classes, feature_dim)
+    def __init__(self, num_classes, feature_dim, sampled_classes=None):
+        super().__init__(num_classes, feature_dim, sampled_classes)
 
         self.extract_feature = nn.Linear(
             self.feature_dim*4*3, self.feature_dim)
-        self.num_classes = num_classes
-        if self.num_classes:
-            self.classifier = nn.Linear(self.feature_dim, num_classes)
-
-    def forward(self, x):
+        self.backbone_frozen = False
+
+    def forward(self, x, targets=None):
+        # x is a batch of images, or of cached backbone outputs (N, D) when
+        # only the head is trained, see featurecache.py. The targets are
+        # only needed by a sampled classifier.
+        if x.dim() != 2:
+            x = self.backbone(x)
+        return self.head(x, targets)
+
+    def backbone(self, x):
+        # the flattened layer4 output, the features a frozen backbone caches
         x = self.base.conv1(x)
         x = self.base.bn1(x)
         x = self.base.relu(x)
@@ -28,30 +35,56 @@ class ResnetFaceModel(FaceModel):
         x = self.base.layer2(x)
         x = self.base.layer3(x)
         x = self.base.layer4(x)
+        return x.view(x.size(0), -1)
 
-        x = x.view(x.size(0), -1)
+    def head(self, x, targets=None):
         feature = self.extract_feature(x)
-        logits = self.classifier(feature) if self.num_classes else None
+        if not self.num_classes:
+            logits = None
+        elif self.sampled_classes:
+            logits = self.classifier(feature, targets)
+        else:
+            logits = self.classifier(feature)
 
         feature_normed = feature.div(
             torch.norm(feature, p=2, dim=1, keepdim=True).expand_as(feature))
 
         return logits, feature_normed
 
+    def freeze_backbone(self, frozen=True):
+        # only extract_feature, the classifier and the centers are trained,
+        # the backbone's batch norms keep their statistics as well
+        self.backbone_frozen = frozen
+        for name, param in self.base.named_parameters():
+            param.requires_grad = not frozen and not name.startswith('fc.')
+        return self.train(self.training)
+
+    def train(self, mode=True):
+        super().train(mode)
+        if self.backbone_frozen:
+            self.base.eval()
+        return self
+
 
 class Resnet18FaceModel(ResnetFaceModel):
 
     FEATURE_DIM = 512
 
-    def __init__(self, num_classes):
-        super().__init__(num_classes, self.FEATURE_DIM)
-        self.base = resnet18(pretrained=True)
+    def __init__(self, num_classes, pretrained=True, sampled_classes=None):
+        super().__init__(num_classes, self.FEATURE_DIM, sampled_classes)
+        self.base = resnet18(pretrained=pretrained)
+        # the ImageNet classifier is never used, DDP must not expect
+        # gradients for it
+        self.base.fc.requires_grad_(False)
 
 
 class Resnet50FaceModel(ResnetFaceModel):
 
     FEATURE_DIM = 2048
 
-    def __init__(self, num_classes):
-        super().__init__(num_classes, self.FEATURE_DIM)
-        self.base = resnet50(pretrained=True)
\ No newline at end of file
+    def __init__(self, num_classes, pretrained=True, sampled_classes=None):
+        super().__init__(num_classes, self.FEATURE_DIM, sampled_classes)
+        self.base = resnet50(pretrained=pretrained)
+        # the ImageNet classifier is never used, DDP must not expect
+        # gradients for it
+        self.base.fc.requires_grad_(False)
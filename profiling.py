@@ -0,0 +1,145 @@
+import time
+from contextlib import contextmanager
+
+import torch
+
+from device import device
+from eventlog import EventLog
+
+
+class StepProfiler(object):
+    # Opt-in timing of the Trainer loop. The wall time of every step is
+    # split into the phases the loop marks, the time spent waiting for the
+    # batch being 'data', and written with the throughput to a JSONL file.
+    # Each epoch ends with a summary including the stall ratio, the share
+    # of the time the model waited for data. On CUDA every mark
+    # synchronizes, which makes the split exact but slows the run down.
+    #
+    # profile_steps=(first, last) additionally records those training
+    # steps, counted from 1 over the whole run, with torch.profiler into
+    # a chrome trace at trace_path.
+    #
+    # Without a path every method returns right away.
+
+    PHASES = ('data', 'forward', 'backward', 'optimizer', 'center_update',
+              'metrics', 'checkpoint', 'other')
+
+    def __init__(self, path=None, profile_steps=None, trace_path=None):
+        self.log = EventLog(path) if path else None
+        self.profile_steps = profile_steps
+        self.trace_path = trace_path if trace_path else \
+            '{}.trace.json'.format(path)
+        self.training_steps = 0
+        self.torch_profiler = None
+
+    def _now(self):
+        if device == 'cuda':
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def start_epoch(self, mode, epoch):
+        if not self.log:
+            return
+        self.mode = mode
+        self.epoch = epoch
+        self.steps = 0
+        self.images = 0
+        self.epoch_times = dict.fromkeys(self.PHASES, 0.0)
+        self.step_times = dict.fromkeys(self.PHASES, 0.0)
+        if mode == 'train' and self.profile_steps and \
+                self.torch_profiler is None:
+            self._start_torch_profiler()
+        self.last = self._now()
+
+    def mark(self, phase):
+        # the time since the previous mark is spent in phase
+        if not self.log:
+            return
+        now = self._now()
+        self.step_times[phase] += now - self.last
+        self.last = now
+
+    def end_step(self, images):
+        if not self.log:
+            return
+        self.mark('other')
+        seconds = sum(self.step_times.values())
+        self.steps += 1
+        self.images += images
+        self.log.write(
+            'step', mode=self.mode, epoch=self.epoch, step=self.steps,
+            images=images, seconds=seconds,
+            images_per_sec=images / seconds if seconds else 0.0,
+            **self.step_times)
+        for phase, phase_seconds in self.step_times.items():
+            self.epoch_times[phase] += phase_seconds
+            self.step_times[phase] = 0.0
+
+        if self.mode == 'train':
+            self.training_steps += 1
+            if self.torch_profiler is not None:
+                self.torch_profiler.step()
+
+    def end_epoch(self):
+        if not self.log:
+            return
+        seconds = sum(self.epoch_times.values())
+        summary = {
+            'mode': self.mode,
+            'epoch': self.epoch,
+            'steps': self.steps,
+            'images': self.images,
+            'seconds': seconds,
+            'images_per_sec': self.images / seconds if seconds else 0.0,
+            'stall_ratio': self.epoch_times['data'] / seconds
+            if seconds else 0.0
+        }
+        summary.update(self.epoch_times)
+        self.log.write('epoch_profile', **summary)
+        print("[{}:{}] profile: {:.1f} images/sec - stall ratio: {:.4f} - "
+              "{}".format(
+                  self.mode, self.epoch, summary['images_per_sec'],
+                  summary['stall_ratio'], ' - '.join(
+                      '{}: {:.3f}s'.format(phase, self.epoch_times[phase])
+                      for phase in self.PHASES)))
+        return summary
+
+    @contextmanager
+    def timed(self, event):
+        # times work outside the steps, e.g. writing a checkpoint
+        if not self.log:
+            yield
+            return
+        start = self._now()
+        yield
+        self.log.write(event, seconds=self._now() - start)
+
+    def close(self):
+        if self.torch_profiler is not None:
+            self.torch_profiler.__exit__(None, None, None)
+            self.torch_profiler = None
+        if self.log:
+            self.log.close()
+            self.log = None
+
+    def _start_torch_profiler(self):
+        first, last = self.profile_steps
+        # one warm-up step ahead of the window when there is one
+        warmup = 1 if first > 1 else 0
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if device == 'cuda':
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.torch_profiler = torch.profiler.profile(
+            activities=activities,
+            schedule=torch.profiler.schedule(
+                wait=first - 1 - warmup, warmup=warmup,
+                active=last - first + 1,
+                repeat=1),
+            on_trace_ready=self._export_trace,
+            record_shapes=True)
+        self.torch_profiler.__enter__()
+
+    def _export_trace(self, profiler):
+        profiler.export_chrome_trace(self.trace_path)
+        self.log.write('trace', path=self.trace_path,
+                       steps=list(self.profile_steps))
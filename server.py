@@ -0,0 +1,180 @@
+import json
+import time
+import threading
+import queue
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+
+from device import device
+from utils import image_loader
+
+
+class DynamicBatcher(object):
+    # Coalesces the images of concurrent requests into one forward pass. A
+    # batch is run as soon as it holds max_batch_size images or its oldest
+    # request has waited max_latency seconds, whichever comes first.
+
+    def __init__(self, model, max_batch_size=64, max_latency=0.005):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.images = 0
+        self.batches = 0
+        self.latencies = deque(maxlen=10000)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, images):
+        future = Future()
+        self.queue.put((images, future, time.time()))
+        return future
+
+    def embed(self, images):
+        return self.submit(images).result()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def stats(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats = {
+                'requests': self.requests,
+                'images': self.images,
+                'batches': self.batches,
+                'mean_batch_size': self.images / float(self.batches)
+                if self.batches else 0.0
+            }
+        for name, quantile in (('p50', 0.5), ('p99', 0.99)):
+            stats['latency_{}_ms'.format(name)] = \
+                latencies[int(quantile * (len(latencies) - 1))] * 1000 \
+                if latencies else 0.0
+        return stats
+
+    def _run(self):
+        pending = None
+        stop = False
+        while not stop:
+            item = pending if pending is not None else self.queue.get()
+            pending = None
+            if item is None:
+                return
+
+            batch = [item]
+            size = len(item[0])
+            deadline = item[2] + self.max_latency
+            while size < self.max_batch_size:
+                try:
+                    item = self.queue.get(
+                        timeout=max(deadline - time.time(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                if size + len(item[0]) > self.max_batch_size:
+                    # does not fit, it starts the next batch
+                    pending = item
+                    break
+                batch.append(item)
+                size += len(item[0])
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        try:
+            images = torch.cat([images for images, _, _ in batch]).to(device)
+            with torch.no_grad():
+                _, embeddings = self.model(images)
+            embeddings = embeddings.cpu()
+        except Exception as error:
+            for _, future, _ in batch:
+                future.set_exception(error)
+            return
+
+        now = time.time()
+        start = 0
+        with self.lock:
+            self.batches += 1
+            for images, future, arrival in batch:
+                self.requests += 1
+                self.images += len(images)
+                self.latencies.append(now - arrival)
+        for images, future, _ in batch:
+            future.set_result(embeddings[start:start + len(images)])
+            start += len(images)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != '/stats':
+            return self._reply(404, {'error': 'not found'})
+        self._reply(200, self.server.batcher.stats())
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            if self.path == '/embed':
+                embeddings = self.server.embed(request['images'])
+                return self._reply(200, {'embeddings': embeddings.tolist()})
+            if self.path == '/verify':
+                embeddings = self.server.embed(
+                    [request['image_a'], request['image_b']])
+                distance = torch.sum(torch.pow(
+                    embeddings[0] - embeddings[1], 2)).item()
+                return self._reply(200, {'distance': distance})
+            self._reply(404, {'error': 'not found'})
+        except (KeyError, ValueError, TypeError) as error:
+            self._reply(400, {'error': str(error)})
+        except Exception as error:
+            self._reply(500, {'error': str(error)})
+
+    def _reply(self, status, body):
+        body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class EmbeddingServer(ThreadingHTTPServer):
+    # Keeps the model resident and answers
+    #   POST /embed  {"images": [path, ...]}     -> {"embeddings": [...]}
+    #   POST /verify {"image_a": .., "image_b": ..} -> {"distance": ..}
+    #   GET  /stats                               -> throughput and latency
+    # Images are decoded on the request threads, the forward passes of all
+    # requests go through one DynamicBatcher.
+
+    daemon_threads = True
+
+    def __init__(self, model, transform, address=('127.0.0.1', 8000),
+                 loader=None, max_batch_size=64, max_latency=0.005):
+        super().__init__(address, _RequestHandler)
+        self.transform = transform
+        self.loader = loader if loader else image_loader
+        self.batcher = DynamicBatcher(model, max_batch_size, max_latency)
+
+    def embed(self, image_paths):
+        # bad input of the client, answered with 400
+        if not isinstance(image_paths, list) or not image_paths:
+            raise ValueError('images must be a non-empty list of paths')
+        images = torch.stack([
+            self.transform(self.loader(image_path))
+            for image_path in image_paths])
+        return self.batcher.embed(images)
+
+    def server_close(self):
+        super().server_close()
+        self.batcher.close()
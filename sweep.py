@@ -0,0 +1,272 @@
+import os
+import sys
+import copy
+import json
+import random
+import hashlib
+import itertools
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import main
+import grap
+from crossval import init_worker, prepare_caches
+
+# Hyperparameter sweeps of main.py train. A spec is a JSON file
+#
+#   {"method": "grid", "parameters": {"lr": [0.001, 0.01],
+#                                     "lamda": [0.003, 0.03]}}
+#   {"method": "random", "trials": 20, "seed": 0,
+#    "parameters": {"lr": {"log_uniform": [0.0001, 0.01]},
+#                   "alpha": {"uniform": [0.1, 0.9]},
+#                   "arch": ["resnet18", "resnet50"]}}
+#
+# whose parameters are main.py options. Trials selecting the same images
+# share one shard (and backbone feature cache), built before the trials
+# start, and the trials run side by side on the given cores. A trial whose
+# best validation metric is worse than the median of the other trials at
+# the same epoch is stopped once the grace epochs are over.
+
+METRICS = {'cross_entropy': min, 'together': min, 'top1': max}
+# the options deciding which images a trial trains on
+DATA_OPTIONS = ('dataset_dir', 'w', 'sa', 'ai', 'af', 'seed')
+
+
+def load_spec(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def generate_trials(spec):
+    # the parameter dict of every trial
+    parameters = spec['parameters']
+    method = spec.get('method', 'grid')
+    if method == 'grid':
+        names = sorted(parameters)
+        for name in names:
+            if not isinstance(parameters[name], list):
+                raise ValueError(
+                    'grid parameter {} needs a list of values'.format(name))
+        return [dict(zip(names, values)) for values in
+                itertools.product(*(parameters[name] for name in names))]
+    if method != 'random':
+        raise ValueError('unknown sweep method {}'.format(method))
+
+    random_state = random.Random(spec.get('seed'))
+    trials = []
+    for _ in range(spec['trials']):
+        trial = {}
+        for name in sorted(parameters):
+            values = parameters[name]
+            if isinstance(values, list):
+                trial[name] = random_state.choice(values)
+            elif 'uniform' in values:
+                trial[name] = random_state.uniform(*values['uniform'])
+            elif 'log_uniform' in values:
+                low, high = np.log(values['log_uniform'])
+                trial[name] = float(np.exp(random_state.uniform(low, high)))
+            else:
+                raise ValueError(
+                    'unknown distribution of parameter {}'.format(name))
+        trials.append(trial)
+    return trials
+
+
+def data_key(args, *options):
+    # short hash of the options a cache depends on
+    values = [getattr(args, option) for option in DATA_OPTIONS + options]
+    values.append(main.get_model_class(args).IMAGE_SHAPE)
+    return hashlib.sha1(repr(values).encode()).hexdigest()[:10]
+
+
+def trial_args(args, name, parameters, sweep_dir):
+    args = copy.copy(args)
+    for option, value in parameters.items():
+        setattr(args, option, value)
+    args.save_file_name = name
+    args.log_dir = sweep_dir
+    args.events = os.path.join(sweep_dir, '{}.events.jsonl'.format(name))
+    args.shard = os.path.join(
+        sweep_dir, 'data_{}.shard'.format(data_key(args)))
+    if args.frozen_backbone:
+        args.frozen_backbone = os.path.join(
+            sweep_dir, 'features_{}.cache'.format(
+                data_key(args, 'arch', 'warm_start')))
+    return args
+
+
+class MedianStopping(object):
+    # Trainer epoch_callback stopping a trial whose best validation metric
+    # so far is worse than the median of the other trials' at this epoch.
+    # The trials run in other processes, their events files are the
+    # shared state.
+
+    def __init__(self, events, metric='cross_entropy', grace_epochs=5,
+                 min_trials=3):
+        self.events = events
+        self.metric = metric
+        self.grace_epochs = grace_epochs
+        self.min_trials = min_trials
+
+    def __call__(self, trainer):
+        epoch = trainer.current_epoch
+        if epoch < self.grace_epochs:
+            return False
+        own = trainer.events.path if trainer.events else None
+        values = {}
+        for path in self.events:
+            if os.path.isfile(path):
+                value = self.best_until(path, epoch)
+                if value is not None:
+                    values[path] = value
+        if own not in values:
+            return False
+        others = [value for path, value in values.items() if path != own]
+        if len(others) < self.min_trials:
+            return False
+        median = float(np.median(others))
+        if METRICS[self.metric] is min:
+            return values[own] > median
+        return values[own] < median
+
+    def best_until(self, path, epoch):
+        # None until the trial validated this epoch
+        validate = grap.summarize_log(path)['epochs'].get('validate', {})
+        if epoch not in validate:
+            return None
+        values = [values[self.metric] for trial_epoch, values in
+                  validate.items() if trial_epoch <= epoch and
+                  values.get(self.metric) is not None]
+        return METRICS[self.metric](values) if values else None
+
+
+def run_trial(args, stopper):
+    # 'finished' or 'stopped', the printed output goes next to the events
+    # like in crossval.py
+    stopped = []
+
+    def epoch_callback(trainer):
+        if stopper and stopper(trainer):
+            stopped.append(trainer.current_epoch)
+            return True
+        return False
+
+    log_file = os.path.join(
+        args.log_dir, '{}.out'.format(args.save_file_name))
+    with open(log_file, 'w', buffering=1) as f, \
+            contextlib.redirect_stdout(f):
+        main.train(args, epoch_callback=epoch_callback)
+    return 'stopped' if stopped else 'finished'
+
+
+def trial_report(name, parameters, args, metric, status):
+    run = grap.summarize_log(args.events) if os.path.isfile(args.events) \
+        else {'run': name, 'intervals': 0, 'epochs': {}}
+    row = grap.summary_row(run)
+    validate = run['epochs'].get('validate', {})
+    values = [values[metric] for values in validate.values()
+              if values.get(metric) is not None]
+    row.update({
+        'status': status,
+        'best_validate_' + metric: METRICS[metric](values)
+        if values else None
+    })
+    row.update(parameters)
+    return row
+
+
+def sweep(args):
+    spec = load_spec(args.spec)
+    trials = generate_trials(spec)
+    sweep_dir = main.get_log_dir(args)
+    cores = args.cores if args.cores else os.cpu_count() or 1
+    # a trial keeps its torch threads and loader workers busy
+    jobs = max(1, cores // (args.threads + args.num_workers))
+    metric = args.metric
+
+    for option in sorted(spec['parameters']):
+        if not hasattr(args, option):
+            raise ValueError('{} is not a main.py option'.format(option))
+    names = ['trial{:03d}'.format(index) for index in range(len(trials))]
+    trial_arguments = [trial_args(args, name, parameters, sweep_dir)
+                       for name, parameters in zip(names, trials)]
+    stopper = MedianStopping(
+        [trial.events for trial in trial_arguments], metric,
+        args.grace_epochs, args.min_trials) if args.grace_epochs else None
+
+    # the shards, and feature caches, are built once, before any trial.
+    # The events of an earlier sweep in this directory would count as
+    # other trials.
+    prepared = set()
+    for trial in trial_arguments:
+        if os.path.isfile(trial.events):
+            os.remove(trial.events)
+        caches = (trial.shard, trial.frozen_backbone)
+        if caches not in prepared:
+            prepare_caches(trial)
+            prepared.add(caches)
+
+    print('{} trials, {} at a time with {} threads each'.format(
+        len(trials), jobs, args.threads))
+    statuses = {}
+    with ProcessPoolExecutor(
+            jobs, mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker, initargs=(args.threads,)) as executor:
+        futures = {executor.submit(run_trial, trial, stopper): trial
+                   for trial in trial_arguments}
+        for future in as_completed(futures):
+            name = futures[future].save_file_name
+            try:
+                statuses[name] = future.result()
+            except Exception as e:
+                statuses[name] = 'failed: {}'.format(e)
+            print('{} {}'.format(name, statuses[name]))
+
+    rows = [trial_report(name, parameters, trial, metric, statuses[name])
+            for name, parameters, trial in
+            zip(names, trials, trial_arguments)]
+    key = 'best_validate_' + metric
+    rows = sorted(
+        [row for row in rows if row[key] is not None],
+        key=lambda row: row[key], reverse=METRICS[metric] is max) + \
+        [row for row in rows if row[key] is None]
+
+    columns = ['run', 'status', key] + sorted(spec['parameters']) + \
+        ['epochs', 'train_images_per_sec']
+    grap.print_table(rows, columns, sys.stdout)
+    report_file = args.report if args.report else os.path.join(
+        sweep_dir, 'sweep.json')
+    with open(report_file, 'w') as f:
+        json.dump({'spec': spec, 'metric': metric, 'trials': rows}, f,
+                  indent=2)
+    print('Report written to {}'.format(report_file))
+
+
+if __name__ == '__main__':
+    parser = main.get_parser()
+    parser.description = 'hyperparameter sweep of main.py train'
+    parser.add_argument('--spec', type=str, required=True,
+                        help='JSON sweep spec, see sweep.py')
+    parser.add_argument('--cores', type=int,
+                        help='cores the trials are packed on (default: all)')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='torch threads of every trial, which also '
+                             'occupies --num_workers cores with its loader '
+                             'workers (default: 1)')
+    parser.add_argument('--metric', type=str, default='cross_entropy',
+                        choices=sorted(METRICS),
+                        help='validation metric the trials are compared '
+                             'by (default: cross_entropy)')
+    parser.add_argument('--grace_epochs', type=int, default=5,
+                        help='epochs before a trial can be stopped, 0 never '
+                             'stops one (default: 5)')
+    parser.add_argument('--min_trials', type=int, default=3,
+                        help='other trials that must have reached an epoch '
+                             'to compare against (default: 3)')
+    parser.set_defaults(log_dir='sweep', num_workers=1)
+    main_args = parser.parse_args()
+    main_args.log_dir = os.path.abspath(main_args.log_dir)
+    sweep(main_args)
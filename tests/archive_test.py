@@ -0,0 +1,104 @@
+import os
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from archive import split_archive_path, open_archive, index_path
+from dataset import create_datasetsR, LFWPairedDataset
+from utils import image_loader, ReducedImageLoader
+
+
+class ArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.dataroot = os.path.join(self.root, 'data')
+        random_state = np.random.RandomState(0)
+        for person in ('alice', 'bob', 'carol'):
+            person_dir = os.path.join(self.dataroot, 'Asian', person)
+            os.makedirs(person_dir)
+            for index in range(1, 3):
+                cv2.imwrite(
+                    os.path.join(person_dir, '{}_{:04d}.jpg'.format(
+                        person, index)),
+                    random_state.randint(0, 256, (64, 48, 3))
+                    .astype(np.uint8))
+
+        self.tar_path = os.path.join(self.root, 'data.tar')
+        with tarfile.open(self.tar_path, 'w') as archive:
+            archive.add(os.path.join(self.dataroot, 'Asian'), 'Asian')
+        self.zip_path = os.path.join(self.root, 'data.zip')
+        with zipfile.ZipFile(self.zip_path, 'w') as archive:
+            for index, (directory, _, files) in enumerate(
+                    os.walk(self.dataroot)):
+                for name in files:
+                    path = os.path.join(directory, name)
+                    # both stored and deflated members
+                    archive.write(
+                        path, os.path.relpath(path, self.dataroot),
+                        zipfile.ZIP_DEFLATED if index % 2
+                        else zipfile.ZIP_STORED)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_split_archive_path(self):
+        self.assertEqual((self.tar_path, 'Asian/alice/alice_0001.jpg'),
+                         split_archive_path(os.path.join(
+                             self.tar_path, 'Asian', 'alice',
+                             'alice_0001.jpg')))
+        self.assertEqual((self.zip_path, ''),
+                         split_archive_path(self.zip_path))
+        self.assertIsNone(split_archive_path(self.dataroot))
+        self.assertIsNone(split_archive_path(
+            os.path.join(self.root, 'missing.tar', 'a.jpg')))
+
+    def test_reads_match_files(self):
+        for archive_path in (self.tar_path, self.zip_path):
+            for person in ('alice', 'bob', 'carol'):
+                member = os.path.join('Asian', person,
+                                      '{}_0002.jpg'.format(person))
+                file_path = os.path.join(self.dataroot, member)
+                with open(file_path, 'rb') as f:
+                    self.assertEqual(
+                        f.read(), open_archive(archive_path).read(member))
+                np.testing.assert_array_equal(
+                    image_loader(file_path),
+                    image_loader(os.path.join(archive_path, member)))
+                np.testing.assert_array_equal(
+                    ReducedImageLoader((16, 12))(file_path),
+                    ReducedImageLoader((16, 12))(
+                        os.path.join(archive_path, member)))
+            self.assertTrue(os.path.isfile(index_path(archive_path)))
+
+    def test_datasets_from_archive(self):
+        expected, num_classes = create_datasetsR(
+            'Asian', 2, self.dataroot, seed=1)
+        for archive_path in (self.tar_path, self.zip_path):
+            whole_set, archive_classes = create_datasetsR(
+                'Asian', 2, archive_path, seed=1)
+            self.assertEqual(num_classes, archive_classes)
+            self.assertEqual(
+                [(os.path.relpath(path, self.dataroot), klass, name)
+                 for path, klass, name in expected],
+                [(os.path.relpath(path, archive_path), klass, name)
+                 for path, klass, name in whole_set])
+
+        pairs_path = os.path.join(self.root, 'pairs.txt')
+        with open(pairs_path, 'w') as f:
+            f.write('alice 1 2\nalice 1 bob 2\n')
+        dataset = LFWPairedDataset(
+            os.path.join(self.tar_path, 'Asian'), pairs_path,
+            lambda image: image.shape)
+        self.assertEqual([((64, 48, 3), (64, 48, 3), True),
+                          ((64, 48, 3), (64, 48, 3), False)],
+                         [dataset[index] for index in range(len(dataset))])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,7 @@ import unittest
 import torch
 import numpy
 
-from loss import get_center_delta, compute_center_loss
+from loss import get_center_delta, compute_center_loss, update_centers_
 from device import device
 
 
@@ -41,6 +41,16 @@ class CenterLossTest(unittest.TestCase):
         sum_others = torch.sum(result[(0, 2), :]).item()
         self.assertEqual(0, sum_others)
 
+    def test_update_centers_(self):
+        expected = self.centers - get_center_delta(
+            self.features, self.centers, self.targets, self.alpha)
+        centers = self.centers.clone()
+        result = update_centers_(
+            self.features, centers, self.targets, self.alpha)
+        # updated in place
+        self.assertEqual(centers.data_ptr(), result.data_ptr())
+        self.assertTrue(torch.equal(expected, centers))
+
     def test_compute_center_loss(self):
 
         loss = torch.mean(
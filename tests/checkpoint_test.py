@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import torch
+
+from checkpoint import CheckpointWriter
+
+
+class CheckpointWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.model_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.model_dir)
+
+    def _path(self, epoch):
+        return os.path.join(self.model_dir, 'epoch_{}.pth.tar'.format(epoch))
+
+    def test_snapshot_is_taken_at_save_time(self):
+        writer = CheckpointWriter()
+        weights = torch.zeros(3)
+        writer.save({'epoch': 1, 'weights': weights}, self._path(1))
+        weights += 1
+        writer.close()
+
+        state = torch.load(self._path(1))
+        self.assertEqual(1, state['epoch'])
+        self.assertTrue(torch.equal(torch.zeros(3), state['weights']))
+        self.assertEqual(['epoch_1.pth.tar'], os.listdir(self.model_dir))
+
+    def test_retention(self):
+        writer = CheckpointWriter(keep_last=2, keep_best=True)
+        for epoch, metric in ((1, 3.0), (2, 1.0), (3, 2.0), (4, 4.0),
+                              (5, 5.0)):
+            writer.save({'epoch': epoch}, self._path(epoch), metric)
+        writer.close()
+
+        self.assertEqual(
+            ['epoch_2.pth.tar', 'epoch_4.pth.tar', 'epoch_5.pth.tar'],
+            sorted(os.listdir(self.model_dir)))
+
+    def test_tracked_checkpoints(self):
+        for epoch in (1, 2, 3):
+            torch.save({'epoch': epoch}, self._path(epoch))
+        # a resumed run, whose best checkpoint is the first
+        writer = CheckpointWriter(keep_last=1, keep_best=True)
+        for epoch, metric in ((1, 1.0), (2, 3.0), (3, 2.0)):
+            writer.track(self._path(epoch), metric)
+        self.assertEqual(['epoch_1.pth.tar', 'epoch_3.pth.tar'],
+                         sorted(os.listdir(self.model_dir)))
+        writer.save({'epoch': 4}, self._path(4), 1.5)
+        writer.close()
+
+        self.assertEqual(['epoch_1.pth.tar', 'epoch_4.pth.tar'],
+                         sorted(os.listdir(self.model_dir)))
+
+    def test_error_is_raised(self):
+        writer = CheckpointWriter()
+        writer.save({'epoch': 1}, os.path.join(
+            self.model_dir, 'missing', 'epoch_1.pth.tar'))
+        with self.assertRaises(RuntimeError):
+            writer.close()
+
+    def test_save_after_close_raises(self):
+        writer = CheckpointWriter()
+        writer.save({'epoch': 1}, self._path(1))
+        writer.close()
+        with self.assertRaises(RuntimeError):
+            writer.save({'epoch': 2}, self._path(2))
+        writer.wait()
+        writer.close()
+        self.assertEqual(['epoch_1.pth.tar'], os.listdir(self.model_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
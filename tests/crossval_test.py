@@ -0,0 +1,42 @@
+import unittest
+from argparse import Namespace
+
+from crossval import fold_args, summarize
+from dataset import fold
+
+
+class CrossvalTest(unittest.TestCase):
+
+    def test_fold_args(self):
+        args = Namespace(fold=0, save_file_name='cv', events='logs/cv.jsonl')
+        fold_3 = fold_args(args, 3)
+        self.assertEqual((3, 'cv_fold3', 'logs/cv_fold3.jsonl'),
+                         (fold_3.fold, fold_3.save_file_name, fold_3.events))
+        self.assertEqual((0, 'cv'), (args.fold, args.save_file_name))
+
+    def test_folds_validate_on_a_tenth(self):
+        samples = list(range(100))
+        validated = []
+        for validation_set, training_set in fold(10, samples):
+            self.assertEqual((10, 90), (len(validation_set),
+                                        len(training_set)))
+            validation = [validation_set[i]
+                          for i in range(len(validation_set))]
+            training = [training_set[i] for i in range(len(training_set))]
+            self.assertEqual(samples, sorted(validation + training))
+            validated.extend(validation)
+        self.assertEqual(samples, sorted(validated))
+
+    def test_summarize(self):
+        races = summarize({
+            0: {'Asian': 0.8, 'African': 0.7},
+            1: {'Asian': 0.9, 'African': 0.7}
+        })
+        self.assertAlmostEqual(0.85, races['Asian']['mean'])
+        self.assertAlmostEqual(0.05, races['Asian']['std'])
+        self.assertEqual(
+            {'mean': 0.7, 'std': 0.0, 'folds': 2}, races['African'])
+
+
+if __name__ == '__main__':
+    unittest.main()
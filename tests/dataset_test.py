@@ -0,0 +1,151 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from dataset import Dataset, ShardDataset, pack_shard, load_shard
+from dataset import create_datasetsR, LFWPairedDataset
+from manifest import load_manifest, manifest_path
+from imageaug import transform_for_packing
+
+
+class ShardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        random_state = np.random.RandomState(0)
+        self.datasets = []
+        for klass, name in enumerate(('alice', 'bob')):
+            os.mkdir(os.path.join(self.root, name))
+            for index in range(3):
+                image_path = os.path.join(
+                    self.root, name, '{}_{:04d}.png'.format(name, index))
+                cv2.imwrite(image_path, random_state.randint(
+                    0, 256, (40, 30, 3)).astype(np.uint8))
+                self.datasets.append((image_path, klass, name))
+        self.image_shape = (16, 12)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_pack_and_load(self):
+        shard_path = os.path.join(self.root, 'images.shard')
+        entries = pack_shard(self.datasets, shard_path, self.image_shape)
+        loaded_entries, image_shape = load_shard(shard_path)
+
+        self.assertEqual(entries, loaded_entries)
+        self.assertEqual((16, 12, 3), image_shape)
+        self.assertEqual([(klass, name) for _, klass, name in self.datasets],
+                         [(klass, name) for _, klass, name in entries])
+
+        expected = Dataset(
+            self.datasets, transform_for_packing(self.image_shape))
+        shard_dataset = ShardDataset(entries, shard_path, image_shape)
+        self.assertEqual(len(expected), len(shard_dataset))
+        for index in range(len(expected)):
+            expected_image, klass, name = expected[index]
+            image, shard_klass, shard_name = shard_dataset[index]
+            np.testing.assert_array_equal(expected_image, image)
+            self.assertEqual((klass, name), (shard_klass, shard_name))
+
+    def test_other_selection_is_not_loaded(self):
+        shard_path = os.path.join(self.root, 'images.shard')
+        selection = {'dataset_dir': self.root, 'pics': [3, 3], 'seed': 1}
+        entries = pack_shard(self.datasets, shard_path, self.image_shape,
+                             selection=selection)
+
+        self.assertEqual((entries, (16, 12, 3)),
+                         load_shard(shard_path, dict(selection)))
+        self.assertIsNone(load_shard(shard_path, dict(selection, seed=2)))
+        self.assertIsNone(load_shard(shard_path, dict(selection, pics=[3, 2])))
+        self.assertIsNone(load_shard(
+            os.path.join(self.root, 'missing.shard'), selection))
+
+
+class ManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dataroot = tempfile.mkdtemp()
+        self.images_root = os.path.join(self.dataroot, 'Asian')
+        os.mkdir(self.images_root)
+        for person in range(6):
+            self._add_image('person_{}'.format(person), 0)
+        self.manifest_file = manifest_path(self.dataroot, 'Asian')
+
+    def tearDown(self):
+        shutil.rmtree(self.dataroot)
+
+    def _add_image(self, name, index):
+        person_dir = os.path.join(self.images_root, name)
+        if not os.path.isdir(person_dir):
+            os.mkdir(person_dir)
+        with open(os.path.join(
+                person_dir, '{}_{:04d}.jpg'.format(name, index)), 'w') as f:
+            f.write('x' * (index + 1))
+
+    def test_manifest_is_cached_and_refreshed(self):
+        people = load_manifest(self.images_root, self.manifest_file)
+        self.assertTrue(os.path.isfile(self.manifest_file))
+        self.assertEqual(6, len(people))
+        self.assertEqual(
+            ['person_0_0000.jpg', 1],
+            people['person_0']['images'][0][:2])
+
+        # a new person changes the race directory and is picked up
+        self._add_image('person_6', 0)
+        people = load_manifest(self.images_root, self.manifest_file)
+        self.assertEqual(7, len(people))
+
+        # a new image of a known person needs the per-directory check
+        self._add_image('person_0', 1)
+        os.utime(os.path.join(self.images_root, 'person_0'),
+                 ns=(0, 10 ** 18))
+        people = load_manifest(
+            self.images_root, self.manifest_file, verify=True)
+        self.assertEqual(2, len(people['person_0']['images']))
+        self.assertEqual(2, len(load_manifest(
+            self.images_root, self.manifest_file)['person_0']['images']))
+
+    def test_seeded_selection(self):
+        first, num_classes = create_datasetsR(
+            'Asian', 3, self.dataroot, seed=7)
+        second, _ = create_datasetsR('Asian', 3, self.dataroot, seed=7)
+        self.assertEqual(3, num_classes)
+        self.assertEqual(first, second)
+        self.assertEqual(
+            [0, 1, 2], sorted(set(klass for _, klass, _ in first)))
+        for image_path, _, name in first:
+            self.assertTrue(os.path.isfile(image_path))
+            self.assertEqual(name, os.path.basename(
+                os.path.dirname(image_path)))
+
+
+class PairedDatasetTest(unittest.TestCase):
+
+    def test_unique_images(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        pairs_path = os.path.join(root, 'pairs.txt')
+        with open(pairs_path, 'w') as f:
+            f.write('alice 1 2\n')
+            f.write('alice 1 bob 1\n')
+            f.write('bob 1 2\n')
+            f.write('alice 2 bob 2\n')
+
+        dataset = LFWPairedDataset(root, pairs_path)
+        image_paths, indices_a, indices_b = dataset.unique_images()
+
+        self.assertEqual(4, len(image_paths))
+        self.assertEqual(len(dataset), len(indices_a))
+        for index in range(len(dataset)):
+            self.assertEqual(
+                dataset.image_names_a[index], image_paths[indices_a[index]])
+            self.assertEqual(
+                dataset.image_names_b[index], image_paths[indices_b[index]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+
+import torch
+from torch.utils import data
+
+from device import device, DevicePrefetcher
+
+
+class DevicePrefetcherTest(unittest.TestCase):
+
+    def test_batches_and_attributes(self):
+        dataset = data.TensorDataset(
+            torch.arange(10).float(), torch.arange(10))
+        dataloader = data.DataLoader(dataset, batch_size=3)
+        prefetcher = DevicePrefetcher(dataloader)
+
+        self.assertEqual(4, len(prefetcher))
+        self.assertEqual(3, prefetcher.batch_size)
+        self.assertIs(dataloader.sampler, prefetcher.sampler)
+        for _ in range(2):
+            batches = list(prefetcher)
+            self.assertEqual(4, len(batches))
+            for (images, targets), (expected_images, expected_targets) in \
+                    zip(batches, dataloader):
+                self.assertEqual(torch.device(device).type,
+                                 images.device.type)
+                self.assertTrue(torch.equal(
+                    expected_images, images.cpu()))
+                self.assertTrue(torch.equal(
+                    expected_targets, targets.cpu()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from dataset import ResumableSampler
+from distributed import all_gather, broadcast_flag
+from loss import update_centers_
+from meters import LossMeter
+
+
+def _batch(rank):
+    generator = torch.Generator().manual_seed(rank)
+    return (torch.randn(6, 4, generator=generator),
+            torch.randint(5, (6,), generator=generator))
+
+
+def _update_centers(rank, world_size, init_file, result_dir):
+    dist.init_process_group(
+        'gloo', init_method='file://' + init_file, rank=rank,
+        world_size=world_size)
+    try:
+        centers = torch.ones(5, 4)
+        features, targets = _batch(rank)
+        update_centers_(all_gather(features), centers, all_gather(targets),
+                        0.5)
+
+        meter = LossMeter()
+        meter.update(len(targets), torch.tensor(rank + 1.0),
+                     torch.tensor(0.0), torch.tensor(0.0),
+                     torch.tensor(rank), torch.tensor(6))
+        meter.all_reduce()
+
+        torch.save({
+            'centers': centers,
+            'meter': meter.read(),
+            'stop': broadcast_flag(rank == 0)
+        }, os.path.join(result_dir, '{}.pt'.format(rank)))
+    finally:
+        dist.destroy_process_group()
+
+
+class DistributedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_centers_stay_in_sync(self):
+        world_size = 3
+        mp.spawn(_update_centers, nprocs=world_size, args=(
+            world_size, os.path.join(self.root, 'init'), self.root))
+
+        # one process updating with the whole distributed batch
+        batches = [_batch(rank) for rank in range(world_size)]
+        expected = update_centers_(
+            torch.cat([features for features, _ in batches]),
+            torch.ones(5, 4),
+            torch.cat([targets for _, targets in batches]), 0.5)
+        for rank in range(world_size):
+            result = torch.load(os.path.join(
+                self.root, '{}.pt'.format(rank)))
+            self.assertTrue(torch.allclose(expected, result['centers']))
+            # per batch losses of 1, 2 and 3, 3 top1 matches in 18 samples
+            self.assertAlmostEqual(2.0, result['meter']['cross_entropy'])
+            self.assertAlmostEqual(3 / 18, result['meter']['top1'])
+            self.assertTrue(result['stop'])
+
+    def test_sampler_shards(self):
+        data_source = list(range(10))
+        samplers = [ResumableSampler(data_source, shuffle=True, seed=1,
+                                     num_replicas=3, rank=rank)
+                    for rank in range(3)]
+        shards = []
+        for sampler in samplers:
+            sampler.set_epoch(2)
+            shards.append([index for index, _ in sampler])
+            self.assertEqual(4, len(sampler))
+        self.assertEqual(set(data_source),
+                         set(index for shard in shards for index in shard))
+        self.assertEqual(12, sum(len(shard) for shard in shards))
+
+        # the order and seeds of a single process dealt out, wrapping
+        # around to the first samples
+        single = ResumableSampler(data_source, shuffle=True, seed=1)
+        single.set_epoch(2)
+        samples = list(single)
+        expected = [samples[position % 10] for position in range(1, 12, 3)]
+        self.assertEqual(expected, list(samplers[1]))
+
+        samplers[1].set_epoch(2, start=2)
+        self.assertEqual(expected[2:], list(samplers[1]))
+
+        # not padded, every sample once
+        samplers = [ResumableSampler(data_source, shuffle=True, seed=1,
+                                     num_replicas=3, rank=rank, pad=False)
+                    for rank in range(3)]
+        for sampler in samplers:
+            sampler.set_epoch(2)
+        self.assertEqual([4, 3, 3], [len(sampler) for sampler in samplers])
+        self.assertEqual(sorted(samples), sorted(
+            sample for sampler in samplers for sample in sampler))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import torch
+from torch import nn
+
+from models import Resnet18FaceModel
+from export import InferenceModel, ExportedModel, is_exported
+from export import load_exported, quantize_dynamic, save_torchscript
+
+
+class ExportTest(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model = Resnet18FaceModel(False, pretrained=False)
+        # non trivial statistics, so folding them has an effect
+        for module in self.model.modules():
+            if isinstance(module, nn.BatchNorm2d):
+                module.running_mean.uniform_(-0.1, 0.1)
+                module.running_var.uniform_(0.5, 1.5)
+                module.weight.data.uniform_(0.5, 1.5)
+        self.model.eval()
+        self.images = torch.randn(2, 3, *Resnet18FaceModel.IMAGE_SHAPE)
+        with torch.no_grad():
+            _, self.features = self.model(self.images)
+        self.meta = {
+            'arch': 'resnet18',
+            'feature_dim': Resnet18FaceModel.FEATURE_DIM,
+            'image_shape': list(Resnet18FaceModel.IMAGE_SHAPE),
+            'quantize': 'none'
+        }
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_folded_model_matches(self):
+        inference_model = InferenceModel(self.model)
+        self.assertFalse(any(isinstance(module, nn.BatchNorm2d)
+                             for module in inference_model.modules()))
+        with torch.no_grad():
+            features = inference_model(self.images)
+        self.assertTrue(torch.allclose(self.features, features, atol=1e-5))
+
+    def test_dynamic_quantization_is_close(self):
+        quantized = quantize_dynamic(InferenceModel(self.model))
+        with torch.no_grad():
+            features = quantized(self.images)
+        self.assertLess((self.features - features).abs().max().item(), 0.05)
+
+    def test_torchscript_round_trip(self):
+        path = os.path.join(self.root, 'model.pt')
+        checkpoint_path = os.path.join(self.root, 'checkpoint.pth.tar')
+        torch.save({'state_dict': self.model.state_dict()}, checkpoint_path)
+        save_torchscript(InferenceModel(self.model), (self.images,), path,
+                         self.meta)
+        self.assertTrue(is_exported(path))
+        self.assertFalse(is_exported(checkpoint_path))
+
+        exported = load_exported(path)
+        self.assertIsInstance(exported, ExportedModel)
+        self.assertEqual(self.meta, exported.meta)
+        self.assertEqual(Resnet18FaceModel.FEATURE_DIM, exported.FEATURE_DIM)
+        with torch.no_grad():
+            logits, features = exported(self.images)
+        self.assertIsNone(logits)
+        self.assertTrue(torch.allclose(self.features, features, atol=1e-5))
+
+
+if __name__ == '__main__':
+    unittest.main()
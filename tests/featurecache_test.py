@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+import torch
+
+from models import Resnet18FaceModel
+from dataset import Dataset
+from featurecache import FeatureCacheDataset, backbone_signature
+from featurecache import build_feature_cache, load_feature_cache
+from imageaug import transform_for_infer, transform_for_loading
+
+
+class FeatureCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.root = tempfile.mkdtemp()
+        random_state = np.random.RandomState(0)
+        self.datasets = []
+        self.images = []
+        for klass, name in enumerate(('alice', 'bob')):
+            for index in range(3):
+                image = random_state.randint(
+                    0, 256, (140, 110, 3)).astype(np.uint8)
+                image_path = os.path.join(
+                    self.root, '{}_{:04d}.png'.format(name, index))
+                cv2.imwrite(image_path, image)
+                self.datasets.append((image_path, klass, name))
+                self.images.append(image)
+        self.model = Resnet18FaceModel(2, pretrained=False).eval()
+        self.cache_path = os.path.join(self.root, 'features.cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_cached_features_match_backbone(self):
+        image_shape = Resnet18FaceModel.IMAGE_SHAPE
+        signature = backbone_signature(
+            self.model, [path for path, _, _ in self.datasets])
+        entries = build_feature_cache(
+            self.model,
+            Dataset(self.datasets, transform_for_loading(image_shape)),
+            self.cache_path, signature, batch_size=4)
+        self.assertEqual([(klass, name) for _, klass, name in self.datasets],
+                         [(klass, name) for _, klass, name in entries])
+        self.assertEqual((entries, 512 * 4 * 3),
+                         load_feature_cache(self.cache_path, signature))
+
+        transform = transform_for_infer(image_shape)
+        images = torch.stack([transform(image) for image in self.images])
+        dataset = FeatureCacheDataset(entries, self.cache_path, 512 * 4 * 3)
+        features = torch.stack([dataset[index][0]
+                                for index in range(len(dataset))])
+        with torch.no_grad():
+            self.assertTrue(torch.allclose(
+                self.model.backbone(images), features, rtol=1e-2, atol=1e-2))
+            _, expected = self.model(images)
+            _, cached = self.model(features)
+        self.assertTrue(torch.allclose(expected, cached, atol=1e-3))
+
+        # other backbone weights need another cache
+        with torch.no_grad():
+            self.model.base.conv1.weight.add_(1)
+        self.assertIsNone(load_feature_cache(
+            self.cache_path, backbone_signature(
+                self.model, [path for path, _, _ in self.datasets])))
+
+    def test_freeze_backbone(self):
+        self.model.freeze_backbone().train()
+        trainables = [name for name, param in self.model.named_parameters()
+                      if param.requires_grad]
+        self.assertTrue(trainables)
+        self.assertFalse([name for name in trainables
+                          if name.startswith('base.')])
+        self.assertTrue(self.model.training)
+        self.assertFalse(self.model.base.training)
+
+        self.model.freeze_backbone(False)
+        self.assertTrue(self.model.base.training)
+        self.assertTrue(all(param.requires_grad for name, param in
+                            self.model.named_parameters()
+                            if not name.startswith('base.fc.')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+import torch
+
+from gallery import Gallery
+
+
+class GalleryTest(unittest.TestCase):
+
+    def setUp(self):
+        generator = torch.Generator().manual_seed(0)
+        embeddings = torch.randn(1000, 16, generator=generator)
+        self.embeddings = embeddings / torch.norm(
+            embeddings, p=2, dim=1, keepdim=True)
+        labels = torch.arange(1000) // 4
+        self.gallery = Gallery(
+            self.embeddings, labels,
+            ['person_{}'.format(label) for label in range(250)],
+            ['image_{}.jpg'.format(index) for index in range(1000)])
+        # probes close to some gallery images
+        self.queries = self.embeddings[(3, 500, 998), :] + \
+            0.05 * torch.randn(3, 16, generator=generator)
+        self.queries = self.queries / torch.norm(
+            self.queries, p=2, dim=1, keepdim=True)
+
+    def test_blocked_search_is_exact(self):
+        distances, indices = self.gallery.search(
+            self.queries, k=10, block_size=64)
+        expected = torch.sum(torch.pow(
+            self.queries.unsqueeze(1) - self.embeddings.unsqueeze(0), 2),
+            dim=2)
+        expected_distances, expected_indices = expected.topk(
+            10, dim=1, largest=False)
+        self.assertTrue(torch.equal(expected_indices, indices))
+        self.assertTrue(torch.allclose(
+            expected_distances, distances, atol=1e-5))
+
+    def test_identify(self):
+        results = self.gallery.identify(self.queries, k=3)
+        self.assertEqual(
+            ['person_0', 'person_125', 'person_249'],
+            [matches[0][0] for matches in results])
+        for matches in results:
+            self.assertEqual(3, len(matches))
+            self.assertEqual(3, len(set(match[0] for match in matches)))
+            distances = [match[1] for match in matches]
+            self.assertEqual(sorted(distances), distances)
+
+    def test_ivf_index(self):
+        self.gallery.build_index(num_lists=16)
+        exact = self.gallery.search(self.queries, k=5)
+        # probing every list is an exhaustive search
+        approximate = self.gallery.search(
+            self.queries, k=5, num_probes=16)
+        self.assertTrue(torch.equal(exact[1], approximate[1]))
+
+        results = self.gallery.identify(self.queries, k=1, num_probes=4)
+        self.assertEqual(
+            ['person_0', 'person_125', 'person_249'],
+            [matches[0][0] for matches in results])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+
+from grap import parse_line, summarize_log, summary_row, find_logs
+
+
+LEGACY_LOG = """\
+loading data
+[train:1] cross entropy loss: 9.10000000 - center loss: 0.50000000 - total weighted loss: 9.11500000
+[train:1] finished. cross entropy loss: 9.00000000 - center loss: 0.40000000 - together: 9.40000000 - top1 acc: 1.5000 % - top3 acc: 3.0000 %
+[validate:1] finished. cross entropy loss: 8.00000000 - center loss: 0.30000000 - together: 8.30000000 - top1 acc: 2.0000 % - top3 acc: 4.0000 %
+[train:2] finished. cross entropy loss: 7.00000000 - center loss: 0.20000000 - together: 7.20000000 - top1 acc: 10.0000 % - top3 acc: 20.0000 %
+[validate:2] finished. cross entropy loss: 8.50000000 - center loss: 0.10000000 - together: 8.60000000 - top1 acc: 5.0000 % - top3 acc: 8.0000 %
+"""
+
+
+class GrapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_parse_legacy_and_events(self):
+        lines = LEGACY_LOG.splitlines()
+        self.assertIsNone(parse_line(lines[0]))
+        interval = parse_line(lines[1])
+        self.assertEqual(('interval', 'train', 1),
+                         (interval['event'], interval['mode'],
+                          interval['epoch']))
+        self.assertAlmostEqual(9.115, interval['together'])
+        epoch = parse_line(lines[2])
+        self.assertEqual('epoch', epoch['event'])
+        self.assertAlmostEqual(0.015, epoch['top1'])
+        self.assertAlmostEqual(0.03, epoch['top3'])
+
+        event = {'event': 'epoch', 'mode': 'validate', 'epoch': 3,
+                 'cross_entropy': 1.0, 'center': 0.1, 'together': 1.003,
+                 'top1': 0.5, 'top3': 0.7, 'images_per_sec': 100.0}
+        self.assertEqual(event, parse_line(json.dumps(event)))
+        self.assertIsNone(parse_line(json.dumps({'event': 'step'})))
+        self.assertIsNone(parse_line('{not json'))
+
+    def test_summarize_runs(self):
+        legacy_path = os.path.join(self.root, 'lr_02.out.1234')
+        with open(legacy_path, 'w') as f:
+            f.write(LEGACY_LOG)
+        events_path = os.path.join(self.root, 'lr_01.events.jsonl.gz')
+        with gzip.open(events_path, 'wt') as f:
+            for epoch in (1, 2):
+                for mode in ('train', 'validate'):
+                    f.write(json.dumps({
+                        'event': 'epoch', 'mode': mode, 'epoch': epoch,
+                        'cross_entropy': 3.0 - epoch, 'center': 0.1,
+                        'together': 3.003 - epoch, 'top1': 0.1 * epoch,
+                        'top3': 0.2 * epoch, 'images_per_sec': 50.0}) + '\n')
+        with open(os.path.join(self.root, 'notes.txt'), 'w') as f:
+            f.write('not a log\n')
+
+        paths = sorted(find_logs([self.root]))
+        self.assertEqual(sorted([legacy_path, events_path]), paths)
+
+        legacy = summary_row(summarize_log(legacy_path))
+        self.assertEqual('lr_02.out.1234', legacy['run'])
+        self.assertEqual(2, legacy['epochs'])
+        self.assertEqual(1, legacy['intervals'])
+        self.assertAlmostEqual(8.3, legacy['best_validate_together'])
+        self.assertEqual(1, legacy['best_validate_together_epoch'])
+        self.assertAlmostEqual(0.05, legacy['best_validate_top1'])
+        self.assertEqual(2, legacy['best_validate_top1_epoch'])
+        self.assertIsNone(legacy['train_images_per_sec'])
+
+        events = summary_row(summarize_log(events_path))
+        self.assertEqual('lr_01', events['run'])
+        self.assertAlmostEqual(1.0, events['train_cross_entropy'])
+        self.assertEqual(2, events['best_validate_together_epoch'])
+        self.assertAlmostEqual(50.0, events['train_images_per_sec'])
+
+
+if __name__ == '__main__':
+    unittest.main()
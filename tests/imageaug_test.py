@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+import torch
+
+from imageaug import BatchTransform, BatchCollate, merge_flipped
+from imageaug import transform_for_infer, transform_for_loading
+from utils import ReducedImageLoader
+
+
+class ImageaugTest(unittest.TestCase):
+
+    def setUp(self):
+        random_state = np.random.RandomState(0)
+        self.images = [random_state.randint(0, 256, (40, 30, 3))
+                       .astype(np.uint8) for _ in range(3)]
+        self.image_shape = (16, 12)
+
+    def test_infer_is_deterministic(self):
+        transform = transform_for_infer(self.image_shape)
+        image = transform(self.images[0])
+        self.assertEqual((3, 16, 12), tuple(image.shape))
+        self.assertEqual(torch.float32, image.dtype)
+        for _ in range(10):
+            self.assertTrue(torch.equal(image, transform(self.images[0])))
+
+    def test_batched_matches_per_image(self):
+        load = transform_for_loading(self.image_shape)
+        samples = [(load(image), label) for label, image in
+                   enumerate(self.images)]
+        images, labels = BatchCollate(BatchTransform())(samples)
+        self.assertEqual([0, 1, 2], labels.tolist())
+
+        transform = transform_for_infer(self.image_shape)
+        expected = torch.stack([transform(image) for image in self.images])
+        self.assertTrue(torch.equal(expected, images))
+        self.assertGreaterEqual(images.min().item(), -1)
+        self.assertLessEqual(images.max().item(), 1)
+
+    def test_flip_tta(self):
+        load = transform_for_loading(self.image_shape)
+        images = BatchCollate(BatchTransform(flip_tta=True))(
+            [load(image) for image in self.images])
+        self.assertEqual(6, len(images))
+        self.assertTrue(torch.equal(images[:3].flip(-1), images[3:]))
+
+        features = torch.randn(6, 4)
+        merged = merge_flipped(features)
+        self.assertEqual((3, 4), tuple(merged.shape))
+        expected = features[:3] + features[3:]
+        expected = expected / torch.norm(expected, p=2, dim=1, keepdim=True)
+        self.assertTrue(torch.allclose(expected, merged))
+
+
+class ReducedImageLoaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        image = np.random.RandomState(0).randint(
+            0, 256, (400, 400, 3)).astype(np.uint8)
+        for name in ('face.jpg', 'face.png'):
+            cv2.imwrite(os.path.join(self.root, name), image)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_reduced_decode(self):
+        loader = ReducedImageLoader((96, 128))
+        # 1/2 still covers the image shape, 1/4 would not
+        self.assertEqual((200, 200, 3), loader(
+            os.path.join(self.root, 'face.jpg')).shape)
+        self.assertEqual((400, 400, 3), loader(
+            os.path.join(self.root, 'face.png')).shape)
+        self.assertEqual((50, 50, 3), ReducedImageLoader((48, 48))(
+            os.path.join(self.root, 'face.jpg')).shape)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+import torch
+from torch import nn
+
+from inference import read_pairs, count_written_pairs, verify_pairs
+
+
+class TinyEmbedder(nn.Module):
+
+    FEATURE_DIM = 4
+
+    def __init__(self):
+        super().__init__()
+        self.linear = nn.Linear(12, self.FEATURE_DIM)
+
+    def forward(self, x):
+        feature = self.linear(x.view(x.size(0), -1))
+        return None, feature.div(
+            torch.norm(feature, p=2, dim=1, keepdim=True))
+
+
+class VerifyPairsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        random_state = np.random.RandomState(0)
+        self.image_paths = []
+        for index in range(5):
+            image_path = os.path.join(self.root, '{}.png'.format(index))
+            cv2.imwrite(image_path, random_state.randint(
+                0, 256, (2, 2, 3)).astype(np.uint8))
+            self.image_paths.append(image_path)
+        torch.manual_seed(0)
+        self.model = TinyEmbedder().eval()
+        self.transform = lambda image: torch.from_numpy(image).float() / 255
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_read_pairs(self):
+        lines = ['a.jpg,b.jpg\n', '\n', '# comment\n', 'c.jpg d.jpg\n']
+        self.assertEqual([('a.jpg', 'b.jpg'), ('c.jpg', 'd.jpg')],
+                         list(read_pairs(lines)))
+
+    def test_verify_pairs(self):
+        pairs = [(self.image_paths[a], self.image_paths[b])
+                 for a in range(5) for b in range(5)]
+        output = io.StringIO()
+        written = verify_pairs(
+            self.model, self.transform, iter(pairs), output, 1.1,
+            batch_size=2, chunk_size=7, cache_size=2)
+        self.assertEqual(len(pairs), written)
+
+        with torch.no_grad():
+            _, embeddings = self.model(torch.stack([
+                self.transform(cv2.imread(image_path))
+                for image_path in self.image_paths]))
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(pairs), len(lines))
+        for line, (a, b) in zip(lines, [(a, b) for a in range(5)
+                                        for b in range(5)]):
+            image_a, image_b, distance, match = line.split('\t')
+            self.assertEqual(
+                (self.image_paths[a], self.image_paths[b]),
+                (image_a, image_b))
+            expected = torch.sum(torch.pow(
+                embeddings[a] - embeddings[b], 2)).item()
+            self.assertAlmostEqual(expected, float(distance), places=5)
+            self.assertEqual(int(expected < 1.1), int(match))
+
+    def test_one_loader_across_chunks(self):
+        # chunks of cached images only, decoded by loader workers
+        pairs = [(self.image_paths[0], self.image_paths[1])] * 5 + \
+            [(self.image_paths[2], self.image_paths[a]) for a in range(5)]
+        expected = io.StringIO()
+        verify_pairs(self.model, self.transform, iter(pairs), expected, 1.1,
+                     batch_size=2, chunk_size=2, cache_size=3)
+        output = io.StringIO()
+        written = verify_pairs(
+            self.model, self.transform, iter(pairs), output, 1.1,
+            batch_size=2, num_workers=1, chunk_size=2, cache_size=3)
+        self.assertEqual(len(pairs), written)
+        self.assertEqual(expected.getvalue(), output.getvalue())
+        self.assertEqual(len(pairs), len(output.getvalue().splitlines()))
+
+    def test_count_written_pairs(self):
+        output_path = os.path.join(self.root, 'output.tsv')
+        with open(output_path, 'w') as f:
+            f.write('a\tb\t0.1\t1\nc\td\t0.2\t1\ne\tf\t0.')
+        # blocks smaller than a line
+        self.assertEqual(2, count_written_pairs(output_path, block_size=3))
+        with open(output_path, 'r') as f:
+            self.assertEqual('a\tb\t0.1\t1\nc\td\t0.2\t1\n', f.read())
+        self.assertEqual(2, count_written_pairs(output_path))
+
+        with open(output_path, 'w') as f:
+            f.write('a\tb\t0.')
+        self.assertEqual(0, count_written_pairs(output_path, block_size=3))
+        self.assertEqual(0, os.path.getsize(output_path))
+        self.assertEqual(0, count_written_pairs(
+            os.path.join(self.root, 'missing.tsv')))
+
+
+if __name__ == '__main__':
+    unittest.main()
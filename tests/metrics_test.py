@@ -0,0 +1,119 @@
+import unittest
+
+import numpy as np
+import torch
+
+from metrics import compute_roc, select_threshold, RocAccumulator
+
+
+class ComputeRocTest(unittest.TestCase):
+
+    def setUp(self):
+        generator = torch.Generator().manual_seed(0)
+        self.matches = torch.rand(500, generator=generator) > 0.5
+        self.distances = torch.rand(500, generator=generator) * 2 + \
+            (~self.matches).float() * 0.8
+        self.thresholds = np.arange(0, 4, 0.1)
+
+    def _reference_counts(self, distances, matches, threshold):
+        predicts = distances < threshold
+        tp = torch.sum(predicts & matches).item()
+        fp = torch.sum(predicts & ~matches).item()
+        tn = torch.sum(~predicts & ~matches).item()
+        fn = torch.sum(~predicts & matches).item()
+        return tp, fp, tn, fn
+
+    def test_select_threshold(self):
+        best, best_true_predicts = 0, 0
+        for threshold in self.thresholds:
+            true_predicts = torch.sum(
+                (self.distances < threshold) == self.matches).item()
+            if true_predicts > best_true_predicts:
+                best, best_true_predicts = threshold, true_predicts
+
+        self.assertEqual(best, select_threshold(
+            self.distances, self.matches, self.thresholds))
+
+    def test_compute_roc(self):
+        tpr, fpr, accuracy, best_thresholds = compute_roc(
+            self.distances, self.matches, self.thresholds)
+
+        self.assertEqual((len(self.thresholds),), tpr.shape)
+        self.assertEqual((len(self.thresholds),), fpr.shape)
+        self.assertEqual(10, len(best_thresholds))
+        self.assertTrue(0 < accuracy <= 1)
+
+        # first fold validates on the first tenth of the pairs
+        val_distances = self.distances[:50]
+        val_matches = self.matches[:50]
+        expected_tpr = np.zeros(len(self.thresholds))
+        for index, threshold in enumerate(self.thresholds):
+            tp, fp, tn, fn = self._reference_counts(
+                val_distances, val_matches, threshold)
+            expected_tpr[index] = float(tp) / (tp + fn)
+
+        single_fold = compute_roc(
+            self.distances[:50].repeat(10), self.matches[:50].repeat(10),
+            self.thresholds)
+        np.testing.assert_allclose(expected_tpr, single_fold[0], rtol=1e-6)
+
+    def test_uint8_matches(self):
+        result = compute_roc(
+            self.distances, self.matches.to(torch.uint8), self.thresholds)
+        expected = compute_roc(
+            self.distances, self.matches, self.thresholds)
+        np.testing.assert_allclose(expected[0], result[0])
+        self.assertEqual(expected[2], result[2])
+
+
+class RocAccumulatorTest(unittest.TestCase):
+
+    def setUp(self):
+        generator = torch.Generator().manual_seed(0)
+        self.matches = torch.rand(20000, generator=generator) > 0.5
+        self.distances = torch.rand(20000, generator=generator) * 2 + \
+            (~self.matches).float() * 1.2
+        self.accumulator = RocAccumulator()
+        for start in range(0, len(self.distances), 1000):
+            self.accumulator.update(
+                self.distances[start:start + 1000],
+                self.matches[start:start + 1000])
+
+    def test_tar_at_far(self):
+        genuine = self.distances[self.matches]
+        impostor = self.distances[~self.matches]
+        for far_target in (1e-1, 1e-2, 1e-3):
+            tar, threshold, tar_upper_bound = \
+                self.accumulator.tar_at_far(far_target)
+            far = torch.mean((impostor < threshold).double()).item()
+            self.assertLessEqual(far, far_target)
+            self.assertAlmostEqual(
+                torch.mean((genuine < threshold).double()).item(), tar)
+            self.assertLessEqual(tar, tar_upper_bound)
+            self.assertLess(tar_upper_bound - tar, 1e-3)
+
+    def test_auc_and_eer(self):
+        from sklearn.metrics import roc_auc_score
+        expected_auc = roc_auc_score(
+            self.matches.numpy(), -self.distances.numpy())
+        self.assertAlmostEqual(expected_auc, self.accumulator.auc(), places=4)
+
+        eer, threshold = self.accumulator.eer()
+        genuine = self.distances[self.matches]
+        impostor = self.distances[~self.matches]
+        far = torch.mean((impostor < threshold).double()).item()
+        frr = torch.mean((genuine >= threshold).double()).item()
+        self.assertAlmostEqual(far, eer, places=3)
+        self.assertAlmostEqual(frr, eer, places=3)
+
+    def test_merge(self):
+        first, second = RocAccumulator(), RocAccumulator()
+        first.update(self.distances[:5000], self.matches[:5000])
+        second.update(self.distances[5000:], self.matches[5000:])
+        merged = first.merge(second)
+        self.assertEqual(self.accumulator.num_pairs, merged.num_pairs)
+        self.assertEqual(self.accumulator.summary(), merged.summary())
+
+
+if __name__ == '__main__':
+    unittest.main()
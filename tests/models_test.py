@@ -0,0 +1,72 @@
+import unittest
+
+import torch
+
+from models import Resnet18FaceModel
+from models.base import SampledClassifier
+
+
+class SampledClassifierTest(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.classifier = SampledClassifier(4, 1000, 8)
+        self.features = torch.randn(5, 4)
+        self.targets = torch.tensor([7, 3, 7, 900, 3])
+
+    def test_logits(self):
+        logits = self.classifier(self.features, self.targets)
+        self.assertEqual((5, 8), tuple(logits.shape))
+
+        # the batch's classes first, in ascending order
+        positives = torch.tensor([3, 7, 900])
+        self.assertTrue(torch.allclose(
+            self.features.matmul(self.classifier.weight[positives].t()),
+            logits[:, :3]))
+        logit_targets = torch.unique(self.targets, return_inverse=True)[1]
+        self.assertEqual([1, 0, 1, 2, 0], logit_targets.tolist())
+
+        full = self.classifier(self.features)
+        self.assertEqual((5, 1000), tuple(full.shape))
+
+    def test_negatives_never_repeat_a_positive(self):
+        classifier = SampledClassifier(4, 4, 8)
+        torch.manual_seed(1)
+        logits = classifier(
+            self.features, torch.tensor([0, 1, 1, 2, 0])).detach()
+        # the same draw as the classifier's: 5 negatives of the 4 classes
+        torch.manual_seed(1)
+        negatives = torch.randint(4, (5,)).tolist()
+        self.assertIn(3, negatives)
+        self.assertTrue(set(negatives) & {0, 1, 2})
+
+        weight = classifier.weight.detach()
+        for column, klass in enumerate(negatives, 3):
+            if klass in (0, 1, 2):
+                self.assertTrue(torch.all(
+                    torch.isneginf(logits[:, column])), klass)
+            else:
+                self.assertTrue(torch.allclose(
+                    self.features.matmul(weight[klass]), logits[:, column]))
+
+    def test_only_sampled_rows_get_gradients(self):
+        logits = self.classifier(self.features, self.targets)
+        torch.nn.functional.cross_entropy(
+            logits, torch.unique(self.targets, return_inverse=True)[1]) \
+            .backward()
+        gradient = self.classifier.weight.grad
+        self.assertTrue(gradient.is_sparse)
+        rows = set(gradient.coalesce().indices()[0].tolist())
+        self.assertLessEqual(len(rows), 8)
+        self.assertTrue({3, 7, 900} <= rows)
+
+    def test_face_model(self):
+        model = Resnet18FaceModel(1000, pretrained=False, sampled_classes=8)
+        cached = torch.randn(5, 512 * 4 * 3)
+        logits, features = model(cached, self.targets)
+        self.assertEqual((5, 8), tuple(logits.shape))
+        self.assertEqual((5, 512), tuple(features.shape))
+
+
+if __name__ == '__main__':
+    unittest.main()
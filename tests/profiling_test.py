@@ -0,0 +1,64 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+
+from profiling import StepProfiler
+
+
+class StepProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'profile.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_steps_and_epoch_summary(self):
+        profiler = StepProfiler(self.path)
+        profiler.start_epoch('train', 1)
+        for _ in range(3):
+            time.sleep(0.01)
+            profiler.mark('data')
+            time.sleep(0.03)
+            profiler.mark('forward')
+            profiler.end_step(8)
+        summary = profiler.end_epoch()
+        with profiler.timed('persist'):
+            pass
+        profiler.close()
+
+        with open(self.path) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(['step'] * 3 + ['epoch_profile', 'persist'],
+                         [record['event'] for record in records])
+        for record in records[:3]:
+            self.assertEqual(8, record['images'])
+            self.assertAlmostEqual(
+                record['seconds'],
+                sum(record[phase] for phase in StepProfiler.PHASES))
+        self.assertEqual(24, summary['images'])
+        self.assertEqual(3, summary['steps'])
+        self.assertGreater(summary['stall_ratio'], 0.1)
+        self.assertLess(summary['stall_ratio'], 0.5)
+        self.assertAlmostEqual(
+            summary['images'] / summary['seconds'],
+            summary['images_per_sec'])
+
+    def test_disabled(self):
+        profiler = StepProfiler()
+        profiler.start_epoch('train', 1)
+        profiler.mark('data')
+        profiler.end_step(8)
+        self.assertIsNone(profiler.end_epoch())
+        with profiler.timed('persist'):
+            pass
+        profiler.close()
+        self.assertEqual([], os.listdir(self.root))
+
+
+if __name__ == '__main__':
+    unittest.main()
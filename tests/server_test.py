@@ -0,0 +1,96 @@
+import json
+import threading
+import unittest
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import torch
+from torch import nn
+
+from server import EmbeddingServer
+
+
+class TinyEmbedder(nn.Module):
+
+    def __init__(self):
+        super().__init__()
+        self.linear = nn.Linear(3, 4)
+
+    def forward(self, x):
+        feature = self.linear(x)
+        return None, feature.div(
+            torch.norm(feature, p=2, dim=1, keepdim=True))
+
+
+class EmbeddingServerTest(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model = TinyEmbedder().eval()
+        # image "paths" are comma separated pixel values
+        self.server = EmbeddingServer(
+            self.model, lambda image: image, address=('127.0.0.1', 0),
+            loader=lambda path: torch.tensor(
+                [float(value) for value in path.split(',')]),
+            max_batch_size=8, max_latency=0.05)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def _post(self, path, body):
+        request = Request(self.url + path, data=json.dumps(body).encode(),
+                          headers={'Content-Type': 'application/json'})
+        with urlopen(request) as response:
+            return json.loads(response.read().decode())
+
+    def test_embed_and_verify(self):
+        images = ['1,0,0', '0,1,0']
+        embeddings = torch.tensor(
+            self._post('/embed', {'images': images})['embeddings'])
+        with torch.no_grad():
+            _, expected = self.model(torch.tensor([[1., 0, 0], [0, 1., 0]]))
+        self.assertTrue(torch.allclose(expected, embeddings, atol=1e-6))
+
+        distance = self._post(
+            '/verify', {'image_a': images[0], 'image_b': images[1]})
+        self.assertAlmostEqual(torch.sum(torch.pow(
+            expected[0] - expected[1], 2)).item(), distance['distance'],
+            places=5)
+
+    def test_bad_images_are_rejected(self):
+        for images in ([], '1,0,0', None):
+            with self.assertRaises(HTTPError) as context:
+                self._post('/embed', {'images': images})
+            self.assertEqual(400, context.exception.code)
+            context.exception.close()
+
+    def test_concurrent_requests_are_batched(self):
+        results = [None] * 16
+
+        def verify(index):
+            results[index] = self._post('/verify', {
+                'image_a': '{},1,0'.format(index),
+                'image_b': '0,{},1'.format(index)})['distance']
+
+        threads = [threading.Thread(target=verify, args=(index,))
+                   for index in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertTrue(all(result is not None for result in results))
+        with urlopen(self.url + '/stats') as response:
+            stats = json.loads(response.read().decode())
+        self.assertEqual(16, stats['requests'])
+        self.assertEqual(32, stats['images'])
+        self.assertLess(stats['batches'], 16)
+
+
+if __name__ == '__main__':
+    unittest.main()
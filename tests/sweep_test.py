@@ -0,0 +1,82 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from argparse import Namespace
+
+from sweep import generate_trials, MedianStopping
+
+
+class GenerateTrialsTest(unittest.TestCase):
+
+    def test_grid(self):
+        trials = generate_trials({'method': 'grid', 'parameters': {
+            'lr': [0.001, 0.01], 'arch': ['resnet18', 'resnet50'],
+            'lamda': [0.03]}})
+        self.assertEqual(4, len(trials))
+        self.assertIn({'lr': 0.01, 'arch': 'resnet18', 'lamda': 0.03},
+                      trials)
+        with self.assertRaises(ValueError):
+            generate_trials({'parameters': {'lr': {'uniform': [0, 1]}}})
+
+    def test_random(self):
+        spec = {'method': 'random', 'trials': 20, 'seed': 3, 'parameters': {
+            'lr': {'log_uniform': [0.0001, 0.01]},
+            'alpha': {'uniform': [0.1, 0.9]},
+            'w': [1000, 2000]}}
+        trials = generate_trials(spec)
+        self.assertEqual(trials, generate_trials(spec))
+        self.assertEqual(20, len(trials))
+        for trial in trials:
+            self.assertTrue(0.0001 <= trial['lr'] <= 0.01)
+            self.assertTrue(0.1 <= trial['alpha'] <= 0.9)
+            self.assertIn(trial['w'], (1000, 2000))
+
+
+class MedianStoppingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.events = []
+        # validation cross entropy of four trials over three epochs, and a
+        # top1 that is higher the lower it is
+        losses = [[3.0, 2.0, 1.0], [3.0, 2.5, 2.0], [3.0, 2.8, 2.6],
+                  [2.9, 2.9]]
+        for index, trial_losses in enumerate(losses):
+            path = os.path.join(self.root, 'trial{}.events.jsonl'.format(
+                index))
+            with open(path, 'w') as f:
+                for epoch, loss in enumerate(trial_losses, 1):
+                    f.write(json.dumps({
+                        'event': 'epoch', 'mode': 'validate', 'epoch': epoch,
+                        'cross_entropy': loss, 'top1': -loss}) + '\n')
+            self.events.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _trainer(self, index, epoch):
+        return Namespace(current_epoch=epoch, events=Namespace(
+            path=self.events[index]))
+
+    def test_stops_below_median(self):
+        stopper = MedianStopping(self.events, grace_epochs=2, min_trials=2)
+        # the grace epochs are never stopped
+        self.assertFalse(stopper(self._trainer(3, 1)))
+        # 2.9 against the median of 2.0, 2.5 and 2.8
+        self.assertTrue(stopper(self._trainer(3, 2)))
+        self.assertFalse(stopper(self._trainer(0, 2)))
+        # at epoch 3 only two other trials got there, 2.6 > median 1.5
+        self.assertTrue(stopper(self._trainer(2, 3)))
+        self.assertFalse(MedianStopping(
+            self.events, grace_epochs=2, min_trials=3)(self._trainer(2, 3)))
+
+    def test_higher_is_better(self):
+        stopper = MedianStopping(self.events, metric='top1', grace_epochs=2)
+        self.assertTrue(stopper(self._trainer(3, 2)))
+        self.assertFalse(stopper(self._trainer(1, 2)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,237 @@
+import io
+import os
+import json
+import shutil
+import contextlib
+import tempfile
+import unittest
+
+import torch
+from torch import nn
+from torch.utils import data
+
+from grap import parse_line
+from dataset import ResumableSampler, SeededDataset
+from device import DevicePrefetcher
+from imageaug import BatchCollate, BatchTransform
+from models.base import FaceModel
+from trainer import Trainer
+
+
+class TinyFaceModel(FaceModel):
+
+    def __init__(self, num_classes):
+        super().__init__(num_classes, 4)
+        self.extract_feature = nn.Linear(6, self.feature_dim)
+
+    def forward(self, x):
+        feature = self.extract_feature(x)
+        logits = self.classifier(feature)
+        return logits, feature.div(
+            torch.norm(feature, p=2, dim=1, keepdim=True))
+
+
+class TinySampledFaceModel(FaceModel):
+
+    def __init__(self, num_classes, sampled_classes):
+        super().__init__(num_classes, 4, sampled_classes)
+        self.extract_feature = nn.Linear(6, self.feature_dim)
+
+    def forward(self, x, targets=None):
+        feature = self.extract_feature(x)
+        logits = self.classifier(feature, targets)
+        return logits, feature.div(
+            torch.norm(feature, p=2, dim=1, keepdim=True))
+
+
+class NoisyDataset(data.Dataset):
+    # the noise stands in for random augmentation
+
+    def __init__(self, size, num_classes):
+        generator = torch.Generator().manual_seed(1)
+        self.images = torch.randn(size, 6, generator=generator)
+        self.targets = torch.randint(
+            num_classes, (size,), generator=generator)
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, index):
+        image = self.images[index] + 0.1 * torch.randn(6)
+        return image, self.targets[index].item(), str(index)
+
+
+class Preempted(Exception):
+    pass
+
+
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+
+    def _trainer(self, resume=False, preempt_after=None,
+                 epoch_callback=None, log_interval=100, events=None,
+                 persist_stride=100, keep_last=None, keep_best=False):
+        torch.manual_seed(0)
+        model = TinyFaceModel(5)
+        optimizer = torch.optim.SGD(
+            model.parameters(), lr=0.1, momentum=0.9)
+        if preempt_after is not None:
+            step = optimizer.step
+            calls = []
+
+            def preemptible_step(*args, **kwargs):
+                calls.append(1)
+                if len(calls) > preempt_after:
+                    raise Preempted()
+                return step(*args, **kwargs)
+            optimizer.step = preemptible_step
+
+        dataloaders = []
+        for shuffle in (True, False):
+            dataset = NoisyDataset(40, 5)
+            dataloaders.append(data.DataLoader(
+                SeededDataset(dataset), batch_size=6,
+                sampler=ResumableSampler(dataset, shuffle=shuffle, seed=3)))
+        # training goes through the prefetcher without the names, the
+        # validation batches keep them
+        dataloaders[0] = DevicePrefetcher(data.DataLoader(
+            dataloaders[0].dataset, batch_size=6,
+            sampler=dataloaders[0].sampler,
+            collate_fn=BatchCollate(BatchTransform(), fields=(0, 1))))
+
+        return Trainer(
+            'run', optimizer, model, dataloaders[0], dataloaders[1],
+            log_dir=self.log_dir, max_epoch=3, resume=resume,
+            persist_stride=persist_stride, snapshot_interval=2,
+            log_interval=log_interval, epoch_callback=epoch_callback,
+            events=events, keep_last=keep_last, keep_best=keep_best)
+
+    def test_resume_mid_epoch_is_bit_identical(self):
+        uninterrupted = self._trainer()
+        uninterrupted.train('run')
+
+        # 7 batches per epoch, preempted in the middle of the second one
+        preempted = self._trainer(preempt_after=10)
+        with self.assertRaises(Preempted):
+            preempted.train('run')
+        preempted.checkpoint_writer.wait()
+
+        resumed = self._trainer(resume=os.path.join('run', 'snapshot.pth.tar'))
+        self.assertEqual(2, resumed.start_epoch)
+        self.assertEqual(2, resumed.resume_batch)
+        resumed.train('run')
+
+        expected = uninterrupted.model.state_dict()
+        for name, value in resumed.model.state_dict().items():
+            self.assertTrue(torch.equal(expected[name], value), name)
+        self.assertEqual(
+            uninterrupted.training_losses, resumed.training_losses)
+        self.assertEqual(
+            uninterrupted.validation_losses, resumed.validation_losses)
+
+    def test_retention_after_resume(self):
+        preempted = self._trainer(preempt_after=10, persist_stride=1,
+                                  keep_last=1, keep_best=True)
+        with self.assertRaises(Preempted):
+            preempted.train('run')
+        preempted.checkpoint_writer.wait()
+        model_dir = os.path.join(self.log_dir, 'models', 'run')
+        self.assertIn('epoch_1.pth.tar', os.listdir(model_dir))
+
+        resumed = self._trainer(
+            resume=os.path.join('run', 'snapshot.pth.tar'), persist_stride=1,
+            keep_last=1, keep_best=True)
+        resumed.train('run')
+        together = resumed.validation_losses['together']
+        best = together.index(min(together)) + 1
+        self.assertEqual(
+            sorted({'epoch_3.pth.tar', 'epoch_{}.pth.tar'.format(best),
+                    'snapshot.pth.tar'}),
+            sorted(os.listdir(model_dir)))
+
+    def test_epoch_callback_stops_training(self):
+        epochs = []
+
+        def epoch_callback(trainer):
+            epochs.append(trainer.current_epoch)
+            return trainer.current_epoch == 2
+
+        trainer = self._trainer(epoch_callback=epoch_callback)
+        trainer.train('run')
+        self.assertEqual([1, 2], epochs)
+        self.assertEqual(2, len(trainer.validation_losses['together']))
+
+    def test_printed_losses_match_events(self):
+        events = os.path.join(self.log_dir, 'run.events.jsonl')
+        trainer = self._trainer(log_interval=3, events=events)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            trainer.train('run')
+
+        printed = [record for record in map(parse_line,
+                                            output.getvalue().splitlines())
+                   if record]
+        with open(events) as f:
+            written = [record for record in map(json.loads, f)
+                       if record['event'] in ('interval', 'epoch')]
+        self.assertEqual(len(written), len(printed))
+        for expected, record in zip(written, printed):
+            self.assertEqual(
+                (expected['event'], expected['mode'], expected['epoch']),
+                (record['event'], record['mode'], record['epoch']))
+            for field in ('cross_entropy', 'center', 'together'):
+                self.assertAlmostEqual(expected[field], record[field], 6)
+        self.assertEqual(
+            [record['together'] for record in written
+             if record['event'] == 'epoch' and record['mode'] == 'validate'],
+            trainer.validation_losses['together'])
+        # 7 batches per epoch, the last interval has only one
+        self.assertEqual(
+            [3, 6, 7], [record['batch'] for record in written
+                        if record['event'] == 'interval' and
+                        record['mode'] == 'train' and record['epoch'] == 1])
+
+
+class SampledClassifierTrainerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+
+    def test_validation_scores_every_class(self):
+        torch.manual_seed(0)
+        model = TinySampledFaceModel(5, 2)
+        logit_shapes = []
+        model.register_forward_hook(
+            lambda module, inputs, output: logit_shapes.append(
+                tuple(output[0].shape)))
+        dataset = NoisyDataset(12, 5)
+        dataloaders = [data.DataLoader(
+            SeededDataset(dataset), batch_size=4, sampler=ResumableSampler(
+                dataset, shuffle=False, seed=3)) for _ in range(2)]
+        trainer = Trainer(
+            'run', torch.optim.SGD(model.parameters(), lr=0.1), model,
+            dataloaders[0], dataloaders[1], log_dir=self.log_dir,
+            max_epoch=1, persist_stride=100, log_interval=100)
+
+        trainer.run_epoch('train')
+        self.assertTrue(all(shape[1] < 5 for shape in logit_shapes))
+
+        logit_shapes.clear()
+        trainer.run_epoch('validate')
+        trainer.run_epoch('validate')
+        self.assertEqual([(4, 5)] * 6, logit_shapes)
+        # no sampled negatives, the validation losses do not vary
+        self.assertEqual(trainer.validation_losses['cross_entropy'][0],
+                         trainer.validation_losses['cross_entropy'][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,20 @@
 import os
+import re
+import copy
+import time
 import argparse
+import random
 import torch
+import numpy as np
 
 from device import device
-from loss import compute_center_loss, get_center_delta
+from loss import compute_center_loss, update_centers_
+from meters import LossMeter
+from checkpoint import CheckpointWriter
+from dataset import ResumableSampler
+from profiling import StepProfiler
+from eventlog import EventLog
+from distributed import get_rank, get_world_size, all_gather, broadcast_flag
 
 
 class Trainer(object):
@@ -11,11 +22,20 @@ class Trainer(object):
     def __init__(
             self, group_flie, optimizer, model, training_dataloader,
             validation_dataloader, log_dir=False, max_epoch=100, resume=False,
-            persist_stride=5, lamda=0.03, alpha=0.5):
+            persist_stride=5, lamda=0.03, alpha=0.5, log_interval=10,
+            keep_last=None, keep_best=False, snapshot_interval=None,
+            profiler=None, events=None, epoch_callback=None):
 
         self.log_dir = log_dir
         self.optimizer = optimizer
         self.model = model
+        # the model itself when it is wrapped by DistributedDataParallel,
+        # its centers and state are the same in every process
+        self.module = model.module if isinstance(
+            model, torch.nn.parallel.DistributedDataParallel) else model
+        self.world_size = get_world_size()
+        # only the first process of a distributed run writes anything
+        self.is_main = get_rank() == 0
         self.max_epoch = max_epoch
         self.resume = resume
         self.persist_stride = persist_stride
@@ -31,6 +51,19 @@ class Trainer(object):
         self.current_epoch = 1
         self.lamda = lamda
         self.alpha = alpha
+        self.log_interval = log_interval
+        self.checkpoint_writer = CheckpointWriter(keep_last, keep_best)
+        self.snapshot_interval = snapshot_interval
+        # batches of start_epoch already trained before a mid-epoch snapshot
+        self.resume_batch = 0
+        self.resume_meter = None
+        # a disabled profiler unless one is given
+        self.profiler = profiler if profiler else StepProfiler()
+        # JSONL stream of what is printed, plus throughput, see grap.py
+        self.events = EventLog(events) if events else None
+        # called with the trainer after every validation, returning True
+        # stops the training, e.g. the early stopping of sweep.py
+        self.epoch_callback = epoch_callback
 
         if not self.log_dir:
             self.log_dir = os.path.join(os.path.dirname(
@@ -44,21 +77,57 @@ class Trainer(object):
                 raise RuntimeError(
                     "resume file {} is not found".format(state_file))
             print("loading checkpoint {}".format(state_file))
-            checkpoint = torch.load(state_file)
-            self.start_epoch = self.current_epoch = checkpoint['epoch']
-            self.model.load_state_dict(checkpoint['state_dict'], strict=True)
+            checkpoint = torch.load(state_file, weights_only=False)
+            self.module.load_state_dict(checkpoint['state_dict'], strict=True)
             self.optimizer.load_state_dict(checkpoint['optimizer'])
             self.training_losses = checkpoint['training_losses']
             self.validation_losses = checkpoint['validation_losses']
+            if 'batch' in checkpoint:
+                # mid-epoch snapshot, continue right after its last batch
+                self.start_epoch = self.current_epoch = checkpoint['epoch']
+                self.resume_batch = checkpoint['batch']
+                self.resume_meter = checkpoint['meter']
+                self._set_rng_state(checkpoint['rng'])
+                for dataloader in (self.training_dataloader,
+                                   self.validation_dataloader):
+                    if isinstance(dataloader.sampler, ResumableSampler):
+                        dataloader.sampler.seed = checkpoint['sampler_seed']
+            else:
+                # epoch checkpoints are written after validation, the
+                # epoch is complete
+                self.current_epoch = checkpoint['epoch']
+                self.start_epoch = self.current_epoch + 1
             print("loaded checkpoint {} (epoch {})".format(
                 state_file, self.current_epoch))
 
     def train(self,group_flie):
+        self.group_flie = group_flie
+        if self.resume and self.is_main:
+            self._track_checkpoints(
+                os.path.join(self.log_dir, 'models', group_flie))
         for self.current_epoch in range(self.start_epoch, self.max_epoch+1):
             self.run_epoch(mode='train')
             self.run_epoch(mode='validate')
             if not (self.current_epoch % self.persist_stride):
-                self.persist(group_flie)
+                with self.profiler.timed('persist'):
+                    self.persist(group_flie)
+            if self.epoch_callback and self._stop():
+                print('stopped after epoch {}'.format(self.current_epoch))
+                if self.events:
+                    self.events.write('stopped', epoch=self.current_epoch)
+                break
+        # make sure the last checkpoint is on disk before returning
+        with self.profiler.timed('checkpoint_flush'):
+            self.checkpoint_writer.close()
+        self.profiler.close()
+        if self.events:
+            self.events.close()
+
+    def _stop(self):
+        stop = self.is_main and self.epoch_callback(self)
+        if self.world_size > 1:
+            stop = broadcast_flag(stop)
+        return stop
 
     def run_epoch(self, mode):
         if mode == 'train':
@@ -70,61 +139,124 @@ class Trainer(object):
             loss_recorder = self.validation_losses
             self.model.eval()
 
-        total_cross_entropy_loss = 0
-        total_center_loss = 0
-        total_loss = 0
-        total_top1_matches = 0
-        total_top3_matches = 0
+        epoch_meter = LossMeter()
+        interval_meter = LossMeter()
         batch = 0
+        profiler = self.profiler
+
+        if isinstance(dataloader.sampler, ResumableSampler):
+            start = 0
+            if mode == 'train' and self.resume_batch:
+                # skip what the snapshot already trained on
+                batch = self.resume_batch
+                start = batch * dataloader.batch_size
+                # the snapshot's meter holds the sums of all processes
+                if self.is_main:
+                    epoch_meter.load_state_dict(self.resume_meter, device)
+                self.resume_batch = 0
+                self.resume_meter = None
+            dataloader.sampler.set_epoch(self.current_epoch, start)
 
+        profiler.start_epoch(mode, self.current_epoch)
+        # a resumed epoch's meter already holds the samples before the
+        # snapshot, the throughput only counts what this run processed
+        resumed_samples = epoch_meter.samples
+        epoch_start = interval_start = time.time()
         with torch.set_grad_enabled(mode == 'train'):
-            for images, targets, names in dataloader:
-                batch += 1
-                targets = torch.tensor(targets).to(device)
-                images = images.to(device)
-                centers = self.model.centers
+            for batch_data in dataloader:
+                profiler.mark('data')
+                # (images, targets), or (images, targets, names)
+                images = batch_data[0].to(device, non_blocking=True)
+                targets = torch.as_tensor(batch_data[1]).to(
+                    device, non_blocking=True)
+                centers = self.module.centers
 
-                logits, features = self.model(images)
+                if self.module.sampled_classes and mode == 'train':
+                    # logits of the batch's classes in ascending order and
+                    # sampled negatives, see models.base.SampledClassifier.
+                    # Validation scores the logits of every class.
+                    logits, features = self.model(images, targets)
+                    logit_targets = torch.unique(
+                        targets, return_inverse=True)[1]
+                else:
+                    logits, features = self.model(images)
+                    logit_targets = targets
 
                 cross_entropy_loss = torch.nn.functional.cross_entropy(
-                    logits, targets)
+                    logits, logit_targets)
                 center_loss = compute_center_loss(features, centers, targets)
                 loss = self.lamda * center_loss + cross_entropy_loss
-
-                print("[{}:{}] cross entropy loss: {:.8f} - center loss: "
-                      "{:.8f} - total weighted loss: {:.8f}".format(
-                          mode, self.current_epoch,
-                          cross_entropy_loss.item(),
-                          center_loss.item(), loss.item()))
-
-                total_cross_entropy_loss += cross_entropy_loss
-                total_center_loss += center_loss
-                total_loss += loss
+                profiler.mark('forward')
 
                 if mode == 'train':
                     self.optimizer.zero_grad()
                     loss.backward()
+                    profiler.mark('backward')
                     self.optimizer.step()
+                    profiler.mark('optimizer')
 
                     # make features untrack by autograd, or there will be
                     # a memory leak when updating the centers
-                    center_deltas = get_center_delta(
-                        features.data, centers, targets, self.alpha)
-                    self.model.centers = centers - center_deltas
-
-                # compute acc here
-                total_top1_matches += self._get_matches(targets, logits, 1)
-                total_top3_matches += self._get_matches(targets, logits, 3)
-                
-            center_loss = total_center_loss / batch
-            cross_entropy_loss = total_cross_entropy_loss / batch
-            loss = center_loss + cross_entropy_loss
-            top1_acc = total_top1_matches / len(dataloader.dataset)
-            top3_acc = total_top3_matches / len(dataloader.dataset)
-           
-            loss_recorder['center'].append(total_center_loss/batch)
+                    update_features = features.data
+                    update_targets = targets
+                    if self.world_size > 1:
+                        # the update of the whole distributed batch
+                        update_features = all_gather(update_features)
+                        update_targets = all_gather(update_targets)
+                    update_centers_(
+                        update_features, centers, update_targets, self.alpha)
+                    profiler.mark('center_update')
+
+                # compute acc here, the meters only keep detached sums so
+                # no graph outlives its batch
+                top1_matches = self._get_matches(logit_targets, logits, 1)
+                top3_matches = self._get_matches(logit_targets, logits, 3)
+                for meter in (epoch_meter, interval_meter):
+                    meter.update(
+                        len(targets), cross_entropy_loss, center_loss, loss,
+                        top1_matches, top3_matches)
+                profiler.mark('metrics')
+
+                batch += 1
+                if mode == 'train' and self.snapshot_interval and \
+                        not (batch % self.snapshot_interval):
+                    self.snapshot(batch, epoch_meter)
+                    profiler.mark('checkpoint')
+
+                if interval_meter.batches == self.log_interval:
+                    interval_start = self._log_interval(
+                        mode, batch, interval_meter, interval_start)
+                profiler.end_step(len(targets))
+            profiler.end_epoch()
+
+            # the batches after the last full interval
+            if interval_meter.batches:
+                self._log_interval(
+                    mode, batch, interval_meter, interval_start)
+
+            if mode == 'train' and self.snapshot_interval and \
+                    batch % self.snapshot_interval:
+                # a preemption during validation resumes after training
+                self.snapshot(batch, epoch_meter)
+
+            if self.world_size > 1:
+                epoch_meter.all_reduce()
+            values = epoch_meter.read()
+            self._log_event(
+                'epoch', mode, batch, values,
+                epoch_meter.samples - resumed_samples,
+                time.time() - epoch_start)
+            center_loss = values['center']
+            cross_entropy_loss = values['cross_entropy']
+            # the weighted loss, like the intervals, the events and the
+            # checkpoint metric
+            loss = values['together']
+            top1_acc = values['top1']
+            top3_acc = values['top3']
+
+            loss_recorder['center'].append(center_loss)
             loss_recorder['cross_entropy'].append(cross_entropy_loss)
-            loss_recorder['together'].append(total_loss/batch)
+            loss_recorder['together'].append(loss)
             loss_recorder['top1acc'].append(top1_acc)
             loss_recorder['top3acc'].append(top3_acc)
            
@@ -133,31 +265,126 @@ class Trainer(object):
                 "[{}:{}] finished. cross entropy loss: {:.8f} - "
                 "center loss: {:.8f} - together: {:.8f} - "
                 "top1 acc: {:.4f} % - top3 acc: {:.4f} %".format(
-                    mode, self.current_epoch, cross_entropy_loss.item(),
-                    center_loss.item(), loss.item(),
+                    mode, self.current_epoch, cross_entropy_loss,
+                    center_loss, loss,
                     top1_acc*100, top3_acc*100))
 
+    def _log_interval(self, mode, batch, interval_meter, interval_start):
+        # prints and logs the interval's losses and resets its meter, returns
+        # when the next interval starts
+        values = interval_meter.read()
+        print("[{}:{}] cross entropy loss: {:.8f} - center loss: "
+              "{:.8f} - total weighted loss: {:.8f}".format(
+                  mode, self.current_epoch, values['cross_entropy'],
+                  values['center'], values['together']))
+        now = time.time()
+        self._log_event('interval', mode, batch, values,
+                        interval_meter.samples, now - interval_start)
+        interval_meter.reset()
+        return now
+
+    def _log_event(self, event, mode, batch, values, images, seconds):
+        if not self.events:
+            return
+        self.events.write(
+            event, mode=mode, epoch=self.current_epoch, batch=batch,
+            images=images, seconds=seconds,
+            images_per_sec=images / seconds if seconds else 0.0,
+            **values)
+
     def _get_matches(self, targets, logits, n=1):
-        _, preds = logits.topk(n, dim=1)
-        targets_repeated = targets.view(-1, 1).repeat(1, n)
-        matches = torch.sum(preds == targets_repeated, dim=1) \
-            .nonzero().size()[0]
-        return matches
+        # stays on device, the top-n predictions of a row are distinct so
+        # counting equal entries counts the matching rows. A sampled
+        # classifier may have fewer than n columns.
+        _, preds = logits.topk(min(n, logits.size(1)), dim=1)
+        return torch.sum(preds == targets.view(-1, 1))
+
+    def _track_checkpoints(self, model_dir):
+        # the epoch checkpoints of the resumed run, oldest first, count
+        # towards keep_last, and keep_best knows the metrics they were
+        # saved with
+        if not os.path.isdir(model_dir):
+            return
+        epochs = []
+        for file_name in os.listdir(model_dir):
+            match = re.match(r'epoch_(\d+)\.pth\.tar$', file_name)
+            if match and int(match.group(1)) < self.start_epoch:
+                epochs.append(int(match.group(1)))
+        together = self.validation_losses['together']
+        for epoch in sorted(epochs):
+            self.checkpoint_writer.track(
+                os.path.join(model_dir, 'epoch_{}.pth.tar'.format(epoch)),
+                together[epoch - 1] if epoch <= len(together) else None)
 
     def persist(self, group_flie , is_best=False ):
+        if not self.is_main:
+            return
         model_dir = os.path.join(self.log_dir, 'models', group_flie)
         if not os.path.isdir(model_dir):
-            os.mkdir(model_dir)
+            os.makedirs(model_dir)
         file_name = (
             "epoch_{}_best.pth.tar" if is_best else "epoch_{}.pth.tar") \
             .format(self.current_epoch)
 
         state = {
             'epoch': self.current_epoch,
-            'state_dict': self.model.state_dict(),
+            'state_dict': self.module.state_dict(),
             'optimizer': self.optimizer.state_dict(),
             'training_losses': self.training_losses,
             'validation_losses': self.validation_losses
         }
         state_path = os.path.join(model_dir,file_name)
-        torch.save(state, state_path)
+        # copied to cpu here, serialized and renamed into place off the
+        # training thread
+        metric = self.validation_losses['together'][-1] \
+            if self.validation_losses['together'] else None
+        self.checkpoint_writer.save(state, state_path, metric)
+        if self.events:
+            self.events.write('checkpoint', epoch=self.current_epoch,
+                              path=state_path, metric=metric)
+
+    def snapshot(self, batch, epoch_meter):
+        if self.world_size > 1:
+            # every process takes part in summing the meters
+            epoch_meter = copy.deepcopy(epoch_meter)
+            epoch_meter.all_reduce()
+        if not self.is_main:
+            return
+        model_dir = os.path.join(self.log_dir, 'models', self.group_flie)
+        if not os.path.isdir(model_dir):
+            os.makedirs(model_dir)
+
+        sampler = self.training_dataloader.sampler
+        state = {
+            'epoch': self.current_epoch,
+            'batch': batch,
+            'state_dict': self.module.state_dict(),
+            'optimizer': self.optimizer.state_dict(),
+            'training_losses': self.training_losses,
+            'validation_losses': self.validation_losses,
+            'meter': epoch_meter.state_dict(),
+            'rng': self._get_rng_state(),
+            'sampler_seed': sampler.seed
+            if isinstance(sampler, ResumableSampler) else None
+        }
+        # always the same file, replaced atomically, and never subject to
+        # the keep_last cleanup of the epoch checkpoints
+        self.checkpoint_writer.save(
+            state, os.path.join(model_dir, 'snapshot.pth.tar'),
+            managed=False)
+
+    def _get_rng_state(self):
+        return {
+            'torch': torch.get_rng_state(),
+            'cuda': torch.cuda.get_rng_state_all()
+            if torch.cuda.is_available() else None,
+            'numpy': np.random.get_state(),
+            'python': random.getstate()
+        }
+
+    def _set_rng_state(self, state):
+        torch.set_rng_state(state['torch'])
+        if state['cuda'] is not None and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all(state['cuda'])
+        np.random.set_state(state['numpy'])
+        random.setstate(state['python'])